@@ -25,16 +25,47 @@ app.conf.accept_content = ['json']
 app.conf.timezone = 'Asia/Baghdad'
 app.conf.enable_utc = True
 
+# مهام التبديل تُجدول بـ eta قد تبعد عدة ساعات؛ مع Redis تُعاد المهمة غير المؤكدة
+# بعد visibility_timeout (ساعة افتراضياً)، لذا نرفعه فوق أطول فترة تبديل
+app.conf.broker_transport_options = {'visibility_timeout': 12 * 60 * 60}
+
+# الجدولة تُقرأ من قاعدة البيانات (BeatScheduleEntry) وتُعاد قراءتها عند تغييرها من
+# لوحة الإعدادات بدون إعادة تشغيل beat (shifts/beat.py)
+app.conf.beat_scheduler = 'shifts.beat:DatabaseScheduler'
+
+# رسائل تليغرام تُرسل من صندوق الصادر بعامل منفصل على قائمة notifications
+# (celery -A shift_manager worker -Q notifications) حتى لا يؤخرها التبديل أو العكس
+app.conf.task_routes = {
+    'shifts.tasks.deliver_outbox_task': {'queue': 'notifications'},
+    'shifts.tasks.send_broadcast_task': {'queue': 'notifications'},
+    'shifts.tasks.resume_broadcasts_task': {'queue': 'notifications'},
+}
+
 # الجدولة الأساسية لـ Celery Beat
-# ملاحظة: يتم تحديث هذه الجدولة ديناميكياً من خلال update_celery_schedule() في views.py
-# الجدولة الافتراضية (يتم تحديثها عند تغيير الإعدادات)
+# المهام الثابتة هنا تُنسخ إلى قاعدة البيانات عند بدء beat، والمراقب يُحسب من
+# الإعدادات في sync_beat_schedule(). الإشعارات المبكرة والتذكيرات والإشعار النهائي
+# تعمل مع مهام التبديل المجدولة بـ ETA (shifts/scheduler.py) وليس بفحص دوري
 app.conf.beat_schedule = {
-    # مهمة فحص الإشعارات المبكرة - كل 5 دقائق (افتراضي، يتم تحديثه ديناميكياً)
-    'check-early-notifications': {
-        'task': 'shifts.tasks.check_early_notifications_task',
-        'schedule': crontab(),  # كل دقيقة مبدئياً (يتم تعديلها ديناميكياً لاحقاً)
+    # مهمة مطابقة مجموع ساعات العمل المتراكم مع قاعدة البيانات - كل ساعة
+    'reconcile-work-hours-aggregate': {
+        'task': 'shifts.tasks.reconcile_work_hours_aggregate',
+        'schedule': crontab(minute=30),
+    },
+    # مراقب جدولة التبديل - التبديل نفسه يُجدول بمهام ETA (shifts/scheduler.py)
+    'rotation-watchdog': {
+        'task': 'shifts.tasks.rotation_watchdog_task',
+        'schedule': crontab(minute='*/10'),
+    },
+    # إرسال رسائل صندوق الصادر المستحقة (إعادة المحاولة وما فات طلبه بعد المعاملة) - كل دقيقة
+    'deliver-outbox': {
+        'task': 'shifts.tasks.deliver_outbox_task',
+        'schedule': crontab(),
+    },
+    # استئناف الإشعارات المخصصة التي توقف تجهيزها - كل 5 دقائق
+    'resume-broadcasts': {
+        'task': 'shifts.tasks.resume_broadcasts_task',
+        'schedule': crontab(minute='*/5'),
     },
-    # مهمة التبديل التلقائي - سيتم إضافتها ديناميكياً من update_celery_schedule()
     # مهمة تصفير ساعات العمل الشهرية - أول يوم من كل شهر في منتصف الليل
     'reset-monthly-work-hours': {
         'task': 'shifts.tasks.reset_monthly_work_hours',
@@ -43,10 +74,3 @@ app.conf.beat_schedule = {
 }
 
 app.autodiscover_tasks()
-
-# تحديث الجدولة بمجرد بدء Celery (لتفادي الاعتماد على لوحة الإعدادات فقط)
-try:
-    from shifts.views import update_celery_schedule
-    update_celery_schedule()
-except Exception as exc:
-    print(f"⚠️ تعذر تحديث جدولة Celery تلقائياً: {exc}")
@@ -155,3 +155,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# سجل تدقيق للإشعارات المرسلة (EarlyNotification) - منع التكرار لا يعتمد عليه
+# (بتات EmployeeAssignment.notification_flags)، لذا يمكن إيقافه لتقليل حجم الجدول
+NOTIFICATION_AUDIT_LOG = os.getenv('NOTIFICATION_AUDIT_LOG', 'True').lower() in ('true', '1', 'yes')
+
+# عنوان Bot API لتليغرام - يمكن توجيهه إلى خادم محلي (python manage.py telegram_stub)
+# لاختبار الحمل والتكامل بدون إرسال رسائل حقيقية
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org')
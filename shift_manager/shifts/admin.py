@@ -1,5 +1,12 @@
+from collections import Counter
+
 from django.contrib import admin
-from .models import Employee, Sonar, Shift, WeeklyShiftAssignment, EmployeeAssignment, Supervisor, AssignmentConfirmation, Manager, SystemSettings, MonthlyWorkHoursReset
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Employee, Sonar, Shift, WeeklyShiftAssignment, EmployeeAssignment, Supervisor, AssignmentConfirmation, Manager, SystemSettings, MonthlyWorkHoursReset, PlannedAssignment, WorkHoursAggregate, RotationCommit, RotationLease, RotationRun, RotationTimelineEntry, BeatScheduleEntry, BeatScheduleVersion, OutboxMessage, RateLimitBucket, CustomNotification
+from .outbox import schedule_delivery
 
 @admin.register(Employee)
 class EmployeeAdmin(admin.ModelAdmin):
@@ -9,8 +16,8 @@ class EmployeeAdmin(admin.ModelAdmin):
 
 @admin.register(Sonar)
 class SonarAdmin(admin.ModelAdmin):
-    list_display = ('name', 'active', 'max_employees')
-    list_filter = ('active',)
+    list_display = ('name', 'site', 'active', 'max_employees')
+    list_filter = ('active', 'site')
     search_fields = ('name',)
 
 
@@ -20,7 +27,7 @@ class ShiftAdmin(admin.ModelAdmin):
 
 @admin.register(WeeklyShiftAssignment)
 class WeeklyShiftAssignmentAdmin(admin.ModelAdmin):
-    list_display = ['shift', 'week_start_date', 'week_end_date']  # ✅ الحقول الأصلية
+    list_display = ['shift', 'site', 'week_start_date', 'week_end_date']  # ✅ الحقول الأصلية
     filter_horizontal = ('employees',)
     search_fields = ['shift__name']
 
@@ -31,6 +38,12 @@ class EmployeeAssignmentAdmin(admin.ModelAdmin):
     search_fields = ('employee__name', 'sonar__name')
     readonly_fields = ('employee_confirmed_at', 'supervisor_confirmed_at')
 
+@admin.register(PlannedAssignment)
+class PlannedAssignmentAdmin(admin.ModelAdmin):
+    list_display = ('rotation_at', 'shift', 'employee', 'sonar', 'is_standby', 'work_duration_hours', 'activated', 'planned_at')
+    list_filter = ('shift', 'is_standby', 'activated')
+    search_fields = ('employee__name', 'sonar__name')
+
 @admin.register(Manager)
 class ManagerAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'phone', 'is_active', 'created_at')
@@ -62,7 +75,7 @@ class SystemSettingsAdmin(admin.ModelAdmin):
     readonly_fields = ('rotation_interval_hours', 'last_rotation_time', 'created_at', 'updated_at')
     fieldsets = (
         ('⚙️ إعدادات التبديل', {
-            'fields': ('rotation_interval_hours', 'is_rotation_active', 'last_rotation_time')
+            'fields': ('rotation_interval_hours', 'sonar_history_depth', 'is_rotation_active', 'last_rotation_time')
         }),
         ('📢 إعدادات الإشعارات', {
             'fields': ('early_notification_minutes',)
@@ -97,3 +110,87 @@ class MonthlyWorkHoursResetAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         """منع الحذف للحفاظ على السجلات"""
         return False
+
+
+@admin.register(WorkHoursAggregate)
+class WorkHoursAggregateAdmin(admin.ModelAdmin):
+    list_display = ('total_hours', 'employee_count', 'average', 'updated_at')
+    readonly_fields = ('total_hours', 'employee_count', 'updated_at')
+    
+    def has_add_permission(self, request):
+        """صف واحد يُدار تلقائياً"""
+        return False
+
+@admin.register(RotationCommit)
+class RotationCommitAdmin(admin.ModelAdmin):
+    list_display = ('key', 'shift', 'site', 'rotation_at', 'committed_at')
+    list_filter = ('shift', 'site')
+    readonly_fields = ('key', 'shift', 'site', 'rotation_at', 'committed_at')
+    date_hierarchy = 'rotation_at'
+
+@admin.register(RotationLease)
+class RotationLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'expires_at')
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ('name', 'tokens', 'updated_at', 'blocked_until')
+    search_fields = ('name',)
+
+@admin.register(RotationRun)
+class RotationRunAdmin(admin.ModelAdmin):
+    list_display = ('shift_name', 'site', 'trigger', 'is_early_notification', 'rotation_at', 'started_at', 'duration_ms', 'query_count', 'workers_count', 'standby_count', 'status')
+    list_filter = ('status', 'trigger', 'shift_name', 'is_early_notification')
+    search_fields = ('shift_name', 'site', 'error')
+    date_hierarchy = 'started_at'
+    readonly_fields = [field.name for field in RotationRun._meta.fields]
+
+@admin.register(RotationTimelineEntry)
+class RotationTimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('rotation_at', 'shift', 'kind', 'notification_at', 'period_end', 'generated_at')
+    list_filter = ('shift', 'kind')
+    date_hierarchy = 'rotation_at'
+
+@admin.register(BeatScheduleEntry)
+class BeatScheduleEntryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'task', 'minute', 'hour', 'day_of_week', 'day_of_month', 'month_of_year', 'enabled', 'last_run_at', 'total_run_count')
+    list_filter = ('enabled',)
+    readonly_fields = ('last_run_at', 'total_run_count', 'updated_at')
+
+@admin.register(BeatScheduleVersion)
+class BeatScheduleVersionAdmin(admin.ModelAdmin):
+    list_display = ('version', 'updated_at')
+    readonly_fields = ('version', 'updated_at')
+    
+    def has_add_permission(self, request):
+        """صف واحد يُدار تلقائياً"""
+        return False
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'category', 'assignment', 'notification_stage', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'category', 'notification_stage')
+    search_fields = ('chat_id', 'text', 'last_error')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
+    actions = ['retry_messages']
+
+    @admin.action(description='إعادة إرسال الرسائل المحددة')
+    def retry_messages(self, request, queryset):
+        """إعادة الرسائل الفاشلة نهائياً إلى الانتظار"""
+        with transaction.atomic():
+            # الرسائل الفاشلة لإشعار مخصص تخرج من عداد الفشل وتعود بالانتظار
+            retried_failures = Counter(queryset.filter(status='dead', broadcast__isnull=False).values_list(
+                'broadcast_id', flat=True
+            ))
+            for broadcast_id, count in retried_failures.items():
+                CustomNotification.objects.filter(pk=broadcast_id).update(
+                    failed_count=Greatest(F('failed_count') - count, 0), status=Case(
+                        When(status='completed', then=Value('sending')), default=F('status')
+                    )
+                )
+            updated = queryset.exclude(status='sent').update(
+                status='pending', attempts=0, next_attempt_at=timezone.now(), last_error=''
+            )
+        schedule_delivery()
+        self.message_user(request, f'تمت إعادة {updated} رسالة إلى صندوق الصادر')
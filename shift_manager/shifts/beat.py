@@ -0,0 +1,187 @@
+"""جدولة Celery Beat محفوظة في قاعدة البيانات ومشتركة بين جميع العمليات
+
+سابقاً كانت update_celery_schedule تعدّل current_app.conf.beat_schedule في عملية
+الويب التي عالجت نموذج الإعدادات، فلا يرى beat التغيير إلا بعد إعادة تشغيله.
+
+الآن:
+- sync_beat_schedule() تكتب الجدولة المطلوبة (المهام الثابتة من celery.py + المهام
+  المحسوبة من الإعدادات) في BeatScheduleEntry وتزيد BeatScheduleVersion عند التغيير
+- DatabaseScheduler في عملية beat يقرأ رقم الإصدار فقط كل SYNC_INTERVAL ثوانٍ
+  ويعيد تحميل الجدولة عند تغيره، ويحفظ last_run_at لكل مهمة في قاعدة البيانات
+
+التفعيل في celery.py: app.conf.beat_scheduler = 'shifts.beat:DatabaseScheduler'
+"""
+import time
+
+from celery import current_app
+from celery.beat import Scheduler
+from celery.schedules import crontab
+from django.db import DatabaseError, close_old_connections, transaction
+
+
+# المدة بين فحوصات رقم الإصدار في عملية beat (ثوانٍ)
+SYNC_INTERVAL = 5
+
+# المهام التي تُحسب من إعدادات النظام (الباقي من celery.py يبقى كما هو)
+DYNAMIC_TASKS = ('rotation-watchdog',)
+
+# مهام أُزيلت من الجدولة وتُحذف من قاعدة البيانات إن بقيت (فحص الإشعارات الدوري حلت محله مهام ETA)
+RETIRED_TASKS = ('check-early-notifications',)
+
+
+def crontab_fields(schedule):
+    """تحويل crontab إلى حقول BeatScheduleEntry"""
+    return {
+        'minute': str(schedule._orig_minute),
+        'hour': str(schedule._orig_hour),
+        'day_of_week': str(schedule._orig_day_of_week),
+        'day_of_month': str(schedule._orig_day_of_month),
+        'month_of_year': str(schedule._orig_month_of_year),
+    }
+
+
+def dynamic_schedule(settings):
+    """المهام المحسوبة من الإعدادات الحالية
+
+    التبديل والإشعارات المبكرة والتذكيرات تُجدول بمهام ETA دقيقة (scheduler.py)،
+    والمراقب يلتقط أي مهمة ضائعة ما دام التبديل التلقائي مفعلاً.
+    """
+    if not settings.is_rotation_active:
+        return {}
+
+    return {
+        'rotation-watchdog': {
+            'task': 'shifts.tasks.rotation_watchdog_task',
+            'schedule': crontab(minute='*/10'),
+        },
+    }
+
+
+def desired_schedule(settings):
+    """الجدولة الكاملة: المهام الثابتة من celery.py + المهام الديناميكية"""
+    static_schedule = {
+        name: entry for name, entry in current_app.conf.beat_schedule.items()
+        if name not in DYNAMIC_TASKS
+    }
+    return {**static_schedule, **dynamic_schedule(settings)}
+
+
+def sync_beat_schedule():
+    """كتابة الجدولة المطلوبة في قاعدة البيانات (تُستدعى عند حفظ الإعدادات وعند بدء beat)
+
+    الصفوف غير المتغيرة لا تُلمس، فلا يزيد الإصدار ولا يعيد beat التحميل بلا داع.
+
+    Returns:
+        عدد المهام التي أُضيفت أو تغيرت أو حُذفت
+    """
+    from .models import BeatScheduleEntry, SystemSettings
+
+    settings = SystemSettings.get_current_settings()
+    desired = desired_schedule(settings)
+    changed = 0
+
+    with transaction.atomic():
+        existing = {entry.name: entry for entry in BeatScheduleEntry.objects.select_for_update()}
+        for name, spec in desired.items():
+            fields = {'task': spec['task'], 'enabled': True, **crontab_fields(spec['schedule'])}
+            entry = existing.get(name)
+            if entry is None:
+                BeatScheduleEntry.objects.create(name=name, **fields)
+                changed += 1
+            elif any(getattr(entry, field) != value for field, value in fields.items()):
+                for field, value in fields.items():
+                    setattr(entry, field, value)
+                entry.save()
+                changed += 1
+
+        # المهام الديناميكية غير المطلوبة (مثل المراقب عند إيقاف التبديل) والمهام المُزالة
+        for name in DYNAMIC_TASKS + RETIRED_TASKS:
+            if name in existing and name not in desired:
+                existing[name].delete()
+                changed += 1
+
+    if changed:
+        print(f"🗓️ تم تحديث جدولة beat في قاعدة البيانات: {changed} مهمة")
+    return changed
+
+
+def load_schedule():
+    """قراءة المهام المفعلة من قاعدة البيانات بصيغة beat_schedule"""
+    from .models import BeatScheduleEntry
+
+    return {
+        entry.name: {
+            'task': entry.task,
+            'schedule': crontab(**{field: getattr(entry, field) for field in BeatScheduleEntry.CRONTAB_FIELDS}),
+            'last_run_at': entry.last_run_at,
+            'total_run_count': entry.total_run_count,
+        }
+        for entry in BeatScheduleEntry.objects.filter(enabled=True)
+    }
+
+
+class DatabaseScheduler(Scheduler):
+    """مجدول beat يقرأ BeatScheduleEntry ويعيد التحميل عند تغير BeatScheduleVersion"""
+
+    def __init__(self, *args, **kwargs):
+        self._version = None
+        self._last_check = 0.0
+        super().__init__(*args, **kwargs)
+        # حلقة beat يجب أن تستيقظ كل SYNC_INTERVAL على الأقل لتلاحظ التغيير
+        self.max_interval = min(self.max_interval, SYNC_INTERVAL)
+
+    def setup_schedule(self):
+        try:
+            sync_beat_schedule()
+            self.reload()
+        except DatabaseError as e:
+            print(f"⚠️ تعذر قراءة جدولة beat من قاعدة البيانات: {e} - استخدام جدولة celery.py")
+            self.merge_inplace(self.app.conf.beat_schedule)
+
+    def reload(self):
+        """إعادة تحميل الجدولة (تُحفظ last_run_at للمهام التي لم تتغير)"""
+        from .models import BeatScheduleVersion
+
+        version = BeatScheduleVersion.current()
+        self.merge_inplace(load_schedule())
+        self._version = version
+        # merge_inplace يعدّل المهام في مكانها فلا يلاحظ tick التغيير، لذا نعيد بناء الـ heap
+        self._heap = None
+        print(f"🗓️ تم تحميل جدولة beat (الإصدار {version}): {', '.join(sorted(self.schedule))}")
+
+    def reload_if_changed(self):
+        from .models import BeatScheduleVersion
+
+        close_old_connections()
+        try:
+            if BeatScheduleVersion.current() != self._version:
+                self.reload()
+        except DatabaseError as e:
+            # نستمر بالجدولة الحالية ونعيد المحاولة في الفحص القادم
+            print(f"⚠️ تعذر فحص إصدار جدولة beat: {e}")
+
+    def tick(self, *args, **kwargs):
+        now = time.monotonic()
+        if now - self._last_check >= SYNC_INTERVAL:
+            self._last_check = now
+            self.reload_if_changed()
+        return super().tick(*args, **kwargs)
+
+    def sync(self):
+        """حفظ آخر تشغيل لكل مهمة (تكمل الجدولة من حيث توقفت بعد إعادة تشغيل beat)"""
+        from .models import BeatScheduleEntry
+
+        close_old_connections()
+        try:
+            entries = list(BeatScheduleEntry.objects.filter(name__in=list(self.schedule)))
+            for entry in entries:
+                scheduled = self.schedule[entry.name]
+                entry.last_run_at = scheduled.last_run_at
+                entry.total_run_count = scheduled.total_run_count
+            BeatScheduleEntry.objects.bulk_update(entries, ['last_run_at', 'total_run_count'])
+        except DatabaseError as e:
+            print(f"⚠️ تعذر حفظ حالة جدولة beat: {e}")
+
+    @property
+    def info(self):
+        return f'    . db -> BeatScheduleEntry (فحص كل {SYNC_INTERVAL} ثوانٍ)'
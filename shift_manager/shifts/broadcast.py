@@ -0,0 +1,120 @@
+"""إرسال الإشعارات المخصصة في الخلفية (Broadcast)
+
+سابقاً كانت send_custom_notification ترسل لكل موظف داخل طلب HTTP، فالإرسال
+للجميع يتجاوز مهلة gunicorn ويبقى total_sent خاطئاً.
+
+الآن:
+- الواجهة تحفظ الإشعار بحالة queued وتطلب send_broadcast_task بعد نجاح المعاملة
+- المهمة تكتب رسائل المستلمين في صندوق الصادر على دفعات (BROADCAST_CHUNK_SIZE)،
+  كل دفعة في معاملة مع مؤشر last_recipient_id، ومفتاح منع التكرار لكل مستلم يجعل
+  إعادة نفس الدفعة بعد توقف العامل آمنة
+- resume_broadcasts_task الدورية تستأنف أي إشعار بقي queued
+- حالة كل مستلم هي حالة رسالته في OutboxMessage (related_name='deliveries')،
+  والعدادات total_sent / failed_count تُزاد من deliver_due_messages
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .locks import rotation_lock
+from .models import CustomNotification, Employee
+from .outbox import DELIVERY_QUEUE, complete_broadcasts, enqueue, outbox_message
+
+
+# عدد المستلمين في كل دفعة تُكتب في صندوق الصادر
+BROADCAST_CHUNK_SIZE = 500
+
+# مدة قفل تجهيز الإشعار الواحد (بالثواني)
+BROADCAST_LOCK_SECONDS = 300
+
+
+def broadcast_recipients(notification):
+    """الموظفون المستهدفون الذين لديهم معرف تليغرام مرتبين بالمعرف (ترتيب ثابت للاستئناف)"""
+    if notification.send_to_all:
+        employees = Employee.objects.all()
+    else:
+        employees = notification.target_employees.all()
+    return employees.filter(telegram_id__isnull=False).exclude(telegram_id='').order_by('id')
+
+
+def broadcast_text(notification):
+    """نص رسالة الإشعار المخصص"""
+    return f"""
+📢 {notification.title}
+
+{notification.message}
+
+━━━━━━━━━━━━━━━━━
+📤 من: {notification.sent_by.get_full_name() or notification.sent_by.username}
+📅 {timezone.localtime(notification.sent_at).strftime('%Y-%m-%d %H:%M')}
+                """
+
+
+def broadcast_dedupe_key(notification, employee_id):
+    return f"broadcast:{notification.pk}:{employee_id}"
+
+
+def schedule_broadcast(notification):
+    """طلب تجهيز الإشعار بعد نجاح المعاملة (وإلا تستأنفه resume_broadcasts_task)"""
+    notification_id = notification.pk
+
+    def trigger():
+        from .tasks import send_broadcast_task
+        try:
+            send_broadcast_task.apply_async(args=[notification_id], queue=DELIVERY_QUEUE, retry=False)
+        except Exception as e:
+            print(f"⚠️ تعذر طلب مهمة الإشعار {notification_id}: {e} - سيُستأنف في الدورة القادمة")
+
+    transaction.on_commit(trigger)
+
+
+def queue_broadcast(notification_id, chunk_size=BROADCAST_CHUNK_SIZE):
+    """كتابة رسائل مستلمي الإشعار في صندوق الصادر دفعة بعد دفعة
+
+    العدادات تُحدَّث بـ update() فقط لأن عامل الإرسال يزيد total_sent و failed_count
+    في نفس الوقت.
+
+    Returns:
+        عدد الرسائل التي كُتبت في هذا التشغيل
+    """
+    queued = 0
+    with rotation_lock(f'broadcast:{notification_id}', timeout=BROADCAST_LOCK_SECONDS) as acquired:
+        if not acquired:
+            print(f"⏭️ عامل آخر يجهز الإشعار {notification_id} حالياً")
+            return queued
+
+        notification = CustomNotification.objects.select_related('sent_by').filter(
+            pk=notification_id, status='queued'
+        ).first()
+        if notification is None:
+            return queued
+
+        recipients = broadcast_recipients(notification)
+        if notification.last_recipient_id is None:
+            # تقدير أولي لصفحة التقدم (يُصحح بعد آخر دفعة)
+            CustomNotification.objects.filter(pk=notification.pk).update(total_recipients=recipients.count())
+
+        text = broadcast_text(notification)
+        cursor = notification.last_recipient_id or 0
+        while True:
+            chunk = list(recipients.filter(id__gt=cursor).values_list('id', 'telegram_id')[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                queued += enqueue(
+                    outbox_message(
+                        telegram_id, text, category='custom', broadcast=notification,
+                        dedupe_key=broadcast_dedupe_key(notification, employee_id),
+                    )
+                    for employee_id, telegram_id in chunk
+                )
+                cursor = chunk[-1][0]
+                CustomNotification.objects.filter(pk=notification.pk).update(last_recipient_id=cursor)
+
+        with transaction.atomic():
+            CustomNotification.objects.filter(pk=notification.pk).update(
+                status='sending', total_recipients=notification.deliveries.count()
+            )
+            complete_broadcasts([notification.pk])
+
+    print(f"📢 تم تجهيز {queued} رسالة للإشعار {notification_id}")
+    return queued
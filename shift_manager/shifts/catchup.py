@@ -0,0 +1,280 @@
+"""تعويض التبديلات الفائتة دفعة واحدة بعد توقف العامل أو beat
+
+بدلاً من تنفيذ rotate_within_shift لكل فترة فائتة (مع إرسال رسائل تليغرام لفترات
+انتهت منذ ساعات)، تُكتشف جميع الفترات الفائتة منذ last_rotation_time (نهايات الشفتات
+والتبديلات الدورية)، وتُخطط في الذاكرة على التوالي، ثم تُكتب سجلاتها التاريخية
+وتُصحح ساعات الموظفين في معاملة واحدة بدون أي إشعار.
+
+الفترة الحالية فقط تُعاد للمستدعي ليُنفذها بالمسار العادي (مع الإشعارات).
+"""
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Employee, EmployeeAssignment, PlannedAssignment, RotationCommit, Shift, SystemSettings, WorkHoursAggregate,
+)
+from .rotation import RosterEntry, SonarEntry, plan_rotation
+from .runs import RotationRecorder
+from .timeline import EVENT_WINDOW, build_timeline_entries
+from .utils import (
+    auto_confirmation_fields, load_active_sonars, load_saved_plan, load_shift_roster, load_sonar_history,
+    rotation_sites,
+)
+
+
+def missed_rotations(settings, now):
+    """جميع مواعيد التبديل بعد last_rotation_time وحتى now (مواعيد غير محفوظة بترتيب زمني)"""
+    last_rotation = settings.last_rotation_time
+    if last_rotation is None or last_rotation >= now:
+        return []
+    days = math.ceil((now - last_rotation) / timedelta(days=1)) + 1
+    entries = build_timeline_entries(list(Shift.objects.order_by('start_hour')), settings, last_rotation, days)
+    return [
+        entry for entry in entries
+        if last_rotation + timedelta(minutes=1) < entry.rotation_at <= now
+    ]
+
+
+def catch_up_missed_rotations(settings, now=None):
+    """تعويض الفترات الفائتة وإرجاع الفترة الحالية
+
+    Returns:
+        موعد الفترة الحالية (لتنفيذه مع الإشعارات)، أو None إذا لم يفت أي تبديل
+        (التبديل المستحق الآن ضمن نطاق ±2 دقيقة يتولاه المسار العادي)
+    """
+    now = now or timezone.now()
+    missed = missed_rotations(settings, now)
+    if not missed or (len(missed) == 1 and missed[0].rotation_at >= now - EVENT_WINDOW):
+        return None
+
+    historical, current = missed[:-1], missed[-1]
+    if historical:
+        print(f"🧮 تعويض {len(historical)} تبديل فائت دفعة واحدة (بدون إشعارات)")
+        with RotationRecorder('catch-up', trigger='catch_up') as run:
+            run.set_target(None, historical[-1].rotation_at)
+            commit_historical_rotations(historical, settings, run)
+    return current
+
+
+def commit_historical_rotations(periods, settings, run):
+    """تخطيط الفترات الفائتة بالتتابع في الذاكرة وكتابتها في معاملة واحدة
+
+    الفترات المحتسبة مسبقاً (مفتاح RotationCommit أو سجلات محتسبة) تُتجاوز،
+    والخطة المحفوظة للفترة (إشعار مبكر أو تخطيط الشفت) تُستخدم إن وجدت.
+    الفترات التي يحتسبها تبديل حي أثناء التعويض لا تُكتب سجلاتها ولا ساعاتها،
+    وآخر عمل وعداد الراحة يُعادان من الفترات المكتوبة فقط (replay_employee_state).
+    """
+    sites = rotation_sites()
+    groups = sites if len(sites) > 1 else [None]
+    history_depth = settings.sonar_history_depth
+    instants = sorted({period.rotation_at for period in periods})
+
+    with run.phase('roster_load'):
+        committed_keys = set(
+            RotationCommit.objects.filter(rotation_at__in=instants).values_list('key', flat=True)
+        )
+        existing_rows = {}
+        counted_periods = set()
+        for row in EmployeeAssignment.objects.filter(assigned_at__in=instants):
+            existing_rows[(row.shift_id, row.assigned_at, row.employee_id, row.sonar_id)] = row
+            if row.notification_sent:
+                counted_periods.add((row.shift_id, row.assigned_at))
+
+    employees_by_id = {}
+    state = {}
+    commits = []
+    # لكل مفتاح RotationCommit: السجلات الجديدة والمحدثة وساعات الموظفين وعدد العاملين/الاحتياط
+    # والعاملون والاحتياط بوقت الفترة (لإعادة بناء آخر عمل وعداد الراحة)
+    period_rows = {}
+    period_hours = {}
+    period_counts = {}
+    period_events = {}
+    plan_timings = {}
+
+    for site in groups:
+        with run.phase('roster_load'):
+            sonars = load_active_sonars(site)
+            if not sonars:
+                continue
+            sonars_by_id = {sonar.id: sonar for sonar in sonars}
+            sonar_entries = [SonarEntry.from_sonar(sonar) for sonar in sonars]
+
+            rosters = {}
+            for period in periods:
+                roster_key = (period.shift.id, timezone.localtime(period.rotation_at).date())
+                if roster_key not in rosters:
+                    rosters[roster_key] = load_shift_roster(period.shift, roster_key[1], site)
+                for emp in rosters[roster_key]:
+                    if emp.id not in employees_by_id:
+                        employees_by_id[emp.id] = emp
+                        state[emp.id] = RosterEntry.from_employee(emp)
+
+            group_ids = {emp.id for roster in rosters.values() for emp in roster}
+            recent = dict(load_sonar_history(group_ids, periods[0].rotation_at, history_depth))
+
+        for period in periods:
+            commit_key = RotationCommit.make_key(period.shift, period.rotation_at, site)
+            if commit_key in committed_keys or (period.shift.id, period.rotation_at) in counted_periods:
+                continue
+            roster = rosters[(period.shift.id, timezone.localtime(period.rotation_at).date())]
+            if not roster:
+                continue
+
+            hours = (period.period_end - period.rotation_at).total_seconds() / 3600
+            roster_entries = [state[emp.id] for emp in roster]
+            with run.phase('roster_load'):
+                plan = load_saved_plan(
+                    period.shift, period.rotation_at, hours, {emp.id: emp for emp in roster}, sonars_by_id
+                )
+            if plan is None:
+                plan = plan_rotation(
+                    roster_entries, sonar_entries, period.rotation_at, hours,
+                    now=period.rotation_at, recent_sonars=recent, timings=plan_timings,
+                )
+
+            # الحالة المتوقعة للفترة التالية (الساعات، آخر عمل، الراحة، سجل السونارات)
+            for entry in plan.apply(roster_entries):
+                state[entry.employee_id] = entry
+            for employee_id, sonar_id in plan.work_slots:
+                recent[employee_id] = ((sonar_id,) + tuple(recent.get(employee_id, ())))[:history_depth]
+
+            hour_deltas = dict(plan.hour_deltas)
+            period_hours[commit_key] = hour_deltas
+            period_counts[commit_key] = (len(plan.work_slots), len(plan.standby))
+            period_events[commit_key] = (
+                period.rotation_at, [employee_id for employee_id, _ in plan.work_slots], list(plan.standby)
+            )
+            new_rows, updated_rows = period_rows[commit_key] = ([], [])
+            confirmation = auto_confirmation_fields(period.rotation_at)
+            for employee_id, sonar_id in list(plan.work_slots) + [(employee_id, None) for employee_id in plan.standby]:
+                row = existing_rows.get((period.shift.id, period.rotation_at, employee_id, sonar_id))
+                if row is None:
+                    new_rows.append(EmployeeAssignment(
+                        employee_id=employee_id,
+                        sonar_id=sonar_id,
+                        shift=period.shift,
+                        assigned_at=period.rotation_at,
+                        rotation_number=0,
+                        is_standby=sonar_id is None,
+                        work_duration_hours=hour_deltas.get(employee_id, 0.0) if sonar_id is not None else 0.0,
+                        notification_sent=True,
+                        **confirmation
+                    ))
+                else:
+                    row.notification_sent = True
+                    for field, value in confirmation.items():
+                        setattr(row, field, value)
+                    updated_rows.append(row)
+            commits.append(RotationCommit(
+                key=commit_key, shift=period.shift, site=site or '', rotation_at=period.rotation_at
+            ))
+
+    run.add_timings(plan_timings)
+
+    with run.phase('persistence'), transaction.atomic():
+        # فترة احتسبها تبديل حي متزامن بعد قراءة المفاتيح تُتجاوز (سجلاتها وساعاتها)
+        taken = set(RotationCommit.objects.filter(
+            key__in=[commit.key for commit in commits]
+        ).values_list('key', flat=True))
+        if taken:
+            print(f"⏭️ {len(taken)} فترة احتُسبت بالتوازي أثناء التعويض - تم تجاوزها")
+            commits = [commit for commit in commits if commit.key not in taken]
+        new_rows = [row for key in period_rows if key not in taken for row in period_rows[key][0]]
+        updated_rows = [row for key in period_rows if key not in taken for row in period_rows[key][1]]
+        workers = sum(period_counts[key][0] for key in period_counts if key not in taken)
+        standby = sum(period_counts[key][1] for key in period_counts if key not in taken)
+
+        # الساعات تُضاف كفرق (F) وليست قيمة مطلقة حتى لا تُمحى ساعات تبديل متزامن
+        employee_hours = {}
+        for key, hour_deltas in period_hours.items():
+            if key in taken:
+                continue
+            for employee_id, hours in hour_deltas.items():
+                employee_hours[employee_id] = employee_hours.get(employee_id, 0.0) + hours
+        added_hours = sum(employee_hours.values())
+
+        changed_employees = []
+        replayed = replay_employee_state(period_events, taken)
+        for employee_id, (last_work, rest_count) in replayed.items():
+            emp = employees_by_id[employee_id]
+            emp.total_work_hours = F('total_work_hours') + employee_hours.get(employee_id, 0.0)
+            emp.last_work_datetime = last_work
+            emp.consecutive_rest_count = rest_count
+            changed_employees.append(emp)
+
+        RotationCommit.objects.bulk_create(commits, ignore_conflicts=True)
+        EmployeeAssignment.objects.bulk_create(new_rows, batch_size=500, ignore_conflicts=True)
+        if updated_rows:
+            EmployeeAssignment.objects.bulk_update(
+                updated_rows, ['notification_sent', *auto_confirmation_fields(None)], batch_size=500
+            )
+        if changed_employees:
+            # bulk_update لا يمر عبر Employee.save، لذا نحدّث المجموع المتراكم هنا
+            Employee.objects.bulk_update(
+                changed_employees,
+                ['total_work_hours', 'last_work_datetime', 'consecutive_rest_count'],
+                batch_size=500
+            )
+            WorkHoursAggregate.apply_delta(added_hours)
+        PlannedAssignment.objects.filter(rotation_at__in=instants, activated=False).update(activated=True)
+        SystemSettings.objects.filter(pk=settings.pk).update(last_rotation_time=periods[-1].rotation_at)
+    settings.last_rotation_time = periods[-1].rotation_at
+
+    run.set_counts(workers=workers, standby=standby)
+    print(
+        f"✅ تم تعويض {len(commits)} فترة: {len(new_rows)} سجل جديد، "
+        f"تحديث ساعات {len(changed_employees)} موظف (+{added_hours:.1f} ساعة)"
+    )
+
+
+def replay_employee_state(period_events, taken):
+    """آخر وقت عمل وعداد الراحة لكل موظف من الفترات التي ستُكتب فعلاً
+
+    الحالة المخططة في الذاكرة مرت بالفترات المحجوزة (taken) أيضاً، وتبديل حي
+    متزامن هو من احتسبها ونتيجته محفوظة الآن في قاعدة البيانات. لذلك تُعاد الحالة
+    من القيم الحالية المقفلة (select_for_update) بتطبيق فترات الدفعة التي تأتي بعد
+    آخر فترة محجوزة شارك فيها الموظف فقط؛ ما قبلها تجاوزته نتيجة التبديل الحي.
+
+    Args:
+        period_events: مفتاح RotationCommit → (وقت الفترة، العاملون، الاحتياط)
+        taken: مفاتيح الفترات التي احتسبها تبديل آخر
+
+    Returns:
+        قاموس employee_id → (last_work_datetime, consecutive_rest_count) لموظفي الفترات المكتوبة
+    """
+    barrier = {}
+    for key in taken:
+        rotation_at, workers, standby = period_events[key]
+        for employee_id in workers + standby:
+            barrier[employee_id] = max(barrier.get(employee_id, rotation_at), rotation_at)
+
+    # كل موظف في فترات الدفعة يُعاد (ساعاته تُضاف حتى لو لم تتغير حقوله)
+    events = {}
+    for key, (rotation_at, workers, standby) in sorted(period_events.items(), key=lambda item: item[1][0]):
+        if key in taken:
+            continue
+        participants = [(employee_id, True) for employee_id in workers]
+        participants += [(employee_id, False) for employee_id in standby]
+        for employee_id, worked in participants:
+            employee_events = events.setdefault(employee_id, [])
+            barrier_at = barrier.get(employee_id)
+            if barrier_at is None or rotation_at > barrier_at:
+                employee_events.append((rotation_at, worked))
+
+    current = Employee.objects.select_for_update().filter(id__in=events).values_list(
+        'id', 'last_work_datetime', 'consecutive_rest_count'
+    )
+    replayed = {}
+    for employee_id, last_work, rest_count in current:
+        for rotation_at, worked in events[employee_id]:
+            if worked:
+                last_work = rotation_at
+                rest_count = 0
+            else:
+                rest_count += 1
+        replayed[employee_id] = (last_work, rest_count)
+    return replayed
@@ -84,12 +84,16 @@ class EmployeeForm(forms.ModelForm):
 class SonarForm(forms.ModelForm):
     class Meta:
         model = Sonar
-        fields = ['name', 'active', 'max_employees']
+        fields = ['name', 'site', 'active', 'max_employees']
         widgets = {
             'name': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'اسم السونار'
             }),
+            'site': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'اتركه فارغاً إذا كان هناك موقع واحد'
+            }),
             'active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'max_employees': forms.NumberInput(attrs={
                 'class': 'form-control',
@@ -99,6 +103,7 @@ class SonarForm(forms.ModelForm):
         }
         labels = {
             'name': 'اسم السونار',
+            'site': 'الموقع',
             'active': 'نشط؟',
             'max_employees': 'الحد الأقصى للموظفين'
         }
@@ -107,7 +112,7 @@ class SonarForm(forms.ModelForm):
 class ShiftForm(forms.ModelForm):
     class Meta:
         model = Shift
-        fields = ['name', 'start_hour', 'end_hour']
+        fields = ['name', 'start_hour', 'start_minute', 'end_hour', 'end_minute']
         widgets = {
             'name': forms.Select(attrs={'class': 'form-control'}),
             'start_hour': forms.NumberInput(attrs={
@@ -122,11 +127,25 @@ class ShiftForm(forms.ModelForm):
                 'max': 23,
                 'placeholder': 'ساعة النهاية (0-23)'
             }),
+            'start_minute': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 0,
+                'max': 59,
+                'placeholder': 'دقيقة البداية (0-59)'
+            }),
+            'end_minute': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 0,
+                'max': 59,
+                'placeholder': 'دقيقة النهاية (0-59)'
+            }),
         }
         labels = {
             'name': 'نوع الشفت',
             'start_hour': 'ساعة البداية',
-            'end_hour': 'ساعة النهاية'
+            'end_hour': 'ساعة النهاية',
+            'start_minute': 'دقيقة البداية',
+            'end_minute': 'دقيقة النهاية'
         }
 
 # Form لإسناد موظف إلى سونار وشفت
@@ -172,9 +191,13 @@ class LoginForm(AuthenticationForm):
 class WeeklyShiftAssignmentForm(forms.ModelForm):
     class Meta:
         model = WeeklyShiftAssignment
-        fields = ['shift', 'employees', 'week_start_date', 'week_end_date']
+        fields = ['shift', 'site', 'employees', 'week_start_date', 'week_end_date']
         widgets = {
             'shift': forms.Select(attrs={'class': 'form-control'}),
+            'site': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'اتركه فارغاً إذا كان هناك موقع واحد'
+            }),
             'employees': forms.SelectMultiple(attrs={
                 'class': 'form-control',
                 'size': '10'
@@ -190,12 +213,14 @@ class WeeklyShiftAssignmentForm(forms.ModelForm):
         }
         labels = {
             'shift': 'الشفت',
+            'site': 'الموقع',
             'employees': 'الموظفين',
             'week_start_date': 'تاريخ بداية الأسبوع',
             'week_end_date': 'تاريخ نهاية الأسبوع'
         }
         help_texts = {
             'employees': 'اختر الموظفين الذين سيعملون في هذا الشفت خلال الأسبوع (استخدم Ctrl للاختيار المتعدد)',
+            'site': 'الموظفون يتبدلون على سونارات هذا الموقع فقط',
         }
 
 # ==================== Forms لإدارة الحسابات (Manager) ====================
@@ -394,7 +419,7 @@ class EmployeeAccountCreateForm(forms.ModelForm):
 class SystemSettingsForm(forms.ModelForm):
     class Meta:
         model = SystemSettings
-        fields = ['rotation_interval_hours', 'early_notification_minutes', 'is_rotation_active']
+        fields = ['rotation_interval_hours', 'early_notification_minutes', 'sonar_history_depth', 'is_rotation_active']
         widgets = {
             'rotation_interval_hours': forms.NumberInput(attrs={
                 'class': 'form-control',
@@ -409,16 +434,24 @@ class SystemSettingsForm(forms.ModelForm):
                 'max': 120,
                 'placeholder': 'مثال: 10 = قبل 10 دقائق'
             }),
+            'sonar_history_depth': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 1,
+                'max': 20,
+                'placeholder': 'مثال: 3 = آخر 3 سونارات'
+            }),
             'is_rotation_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
         labels = {
             'rotation_interval_hours': 'فترة التبديل (بالساعات)',
             'early_notification_minutes': 'الإشعار المبكر (بالدقائق)',
+            'sonar_history_depth': 'عدد السونارات السابقة لتجنب تكرارها',
             'is_rotation_active': 'تفعيل التبديل التلقائي'
         }
         help_texts = {
             'rotation_interval_hours': 'فترة التبديل بين الموظفين (بالساعات). مثال: 2.0 = كل ساعتين',
             'early_notification_minutes': 'كم دقيقة قبل التبديل الفعلي يتم إرسال الإشعار للأدمن والموظفين',
+            'sonar_history_depth': 'يتجنب التبديل إعادة الموظف لأحد آخر N سونارات عمل عليها',
             'is_rotation_active': 'تفعيل أو إيقاف نظام التبديل التلقائي'
         }
 
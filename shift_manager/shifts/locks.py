@@ -0,0 +1,107 @@
+"""أقفال موزعة بين عمال Celery (Redis مع بديل في قاعدة البيانات)
+
+تُستخدم لضمان أن مجموعة تبديل واحدة (شفت + موقع) لا تُنفذ من عاملين في نفس الوقت.
+"""
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+import redis
+from celery import current_app
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+
+
+LOCK_PREFIX = 'shift_manager:lock:'
+
+_redis_client = None
+
+
+def get_redis_client():
+    """عميل Redis مشترك مبني على رابط الـ broker في إعدادات Celery"""
+    global _redis_client
+    if _redis_client is None:
+        url = current_app.conf.broker_url
+        # Celery يقبل ssl_cert_reqs=CERT_NONE بينما redis-py يتوقع none/optional/required
+        url = re.sub(r'ssl_cert_reqs=CERT_(\w+)', lambda match: f'ssl_cert_reqs={match.group(1).lower()}', url)
+        _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+
+def acquire_db_lease(name, timeout=600):
+    """حجز قفل في جدول RotationLease (القيد الفريد على الاسم يمنع الحجز المزدوج)
+
+    القفل المنتهي (عامل توقف قبل التحرير) يُستعاد بتحديث شرطي واحد.
+
+    Returns:
+        معرف المالك عند النجاح، أو None إذا كان القفل محجوزاً
+    """
+    from .models import RotationLease
+
+    now = timezone.now()
+    owner = uuid.uuid4().hex
+    expires_at = now + timedelta(seconds=timeout)
+
+    if RotationLease.objects.filter(name=name, expires_at__lte=now).update(owner=owner, expires_at=expires_at):
+        return owner
+    try:
+        with transaction.atomic():
+            RotationLease.objects.create(name=name, owner=owner, expires_at=expires_at)
+    except IntegrityError:
+        return None
+    return owner
+
+
+def release_db_lease(name, owner):
+    """تحرير القفل فقط إذا كان ما زال مملوكاً لنفس العامل"""
+    from .models import RotationLease
+
+    RotationLease.objects.filter(name=name, owner=owner).delete()
+
+
+def rotation_lock_name(shift_name, site=None):
+    """اسم قفل مجموعة تبديل واحدة (شفت + موقع)"""
+    return f"rotation:{shift_name}:{site or 'default'}"
+
+
+@contextmanager
+def rotation_lock(name, timeout=600):
+    """قفل غير حاجز باسم معين
+
+    يُرجع True إذا تم الحصول على القفل، و False إذا كان محجوزاً من عامل آخر.
+    إذا تعذر الوصول إلى Redis يُستخدم قفل قاعدة البيانات (RotationLease)،
+    وإذا تعذر الاثنان يتم المتابعة بدون قفل (مفتاح RotationCommit يمنع الاحتساب المزدوج).
+
+    Args:
+        name: اسم القفل (مثال: rotation:morning:site-a)
+        timeout: مدة انتهاء القفل تلقائياً بالثواني (حماية من عامل توقف)
+    """
+    lock = None
+    db_owner = None
+    try:
+        lock = get_redis_client().lock(f'{LOCK_PREFIX}{name}', timeout=timeout, blocking=False)
+        acquired = lock.acquire()
+    except redis.RedisError as e:
+        print(f"⚠️ تعذر الوصول إلى Redis للقفل {name}: {e} - استخدام قفل قاعدة البيانات")
+        lock = None
+        try:
+            db_owner = acquire_db_lease(name, timeout)
+            acquired = db_owner is not None
+        except DatabaseError as db_error:
+            print(f"⚠️ تعذر حجز قفل قاعدة البيانات {name}: {db_error} - المتابعة بدون قفل")
+            acquired = True
+
+    try:
+        yield acquired
+    finally:
+        if lock is not None and acquired:
+            try:
+                lock.release()
+            except redis.RedisError as e:
+                print(f"⚠️ تعذر تحرير القفل {name}: {e}")
+        if db_owner is not None:
+            try:
+                release_db_lease(name, db_owner)
+            except DatabaseError as e:
+                print(f"⚠️ تعذر تحرير قفل قاعدة البيانات {name}: {e}")
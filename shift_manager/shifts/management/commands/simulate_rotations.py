@@ -0,0 +1,340 @@
+"""محاكاة التبديل لشهر كامل وقياس الأداء والعدالة
+
+يشغّل rotate_within_shift الحقيقي على بيانات اصطناعية داخل قاعدة بيانات
+SQLite في الذاكرة وبساعة وهمية (timezone.now)، بدون إرسال أي رسالة تليغرام.
+
+أمثلة:
+    python manage.py simulate_rotations
+    python manage.py simulate_rotations --employees 150 --sonars 20 --days 30
+    python manage.py simulate_rotations --interval-change 10:2 --interval-change 20:4
+    python manage.py simulate_rotations --rest-weight 8 --since-work-weight 0.2 --json
+
+مع --deliver تُرسل رسائل صندوق الصادر بعد المحاكاة إلى خادم تليغرام محلي
+(telegram_stub.py) ويُقاس معدل الإرسال، ومع --broadcast يُضاف إشعار مخصص للجميع:
+    python manage.py simulate_rotations --days 3 --deliver --broadcast --stub-latency 0.05
+    python manage.py simulate_rotations --deliver --stub-rate-limit-rate 0.05 --stub-error-rate 0.02
+"""
+import io
+import json
+import random
+import statistics
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'محاكاة التبديل التلقائي لشهر كامل على بيانات اصطناعية وقياس الأداء والعدالة'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, default=90, help='عدد الموظفين (يُوزعون على الشفتات الثلاثة)')
+        parser.add_argument('--sonars', type=int, default=8, help='عدد السونارات')
+        parser.add_argument('--max-capacity', type=int, default=3, help='أقصى سعة للسونار (السعة عشوائية من 1 إلى هذا الرقم)')
+        parser.add_argument('--days', type=int, default=30, help='عدد أيام المحاكاة')
+        parser.add_argument('--interval', type=float, default=3.0, help='فترة التبديل بالساعات')
+        parser.add_argument(
+            '--interval-change', action='append', default=[], metavar='DAY:HOURS',
+            help='تغيير فترة التبديل في يوم معين (مثال: 10:2)، يمكن تكراره'
+        )
+        parser.add_argument('--leave-rate', type=float, default=0.03, help='احتمال خروج الموظف بإجازة في كل يوم')
+        parser.add_argument('--history-depth', type=int, default=3, help='عدد السونارات السابقة لتجنب تكرارها')
+        parser.add_argument('--lookahead', action='store_true', help='تخطيط الشفت كاملاً عند بدايته (plan_whole_shift)')
+        parser.add_argument('--seed', type=int, default=1, help='بذرة الأرقام العشوائية')
+        parser.add_argument('--since-work-weight', type=float, help='تجاوز وزن الساعات منذ آخر عمل')
+        parser.add_argument('--never-worked-bonus', type=float, help='تجاوز مكافأة من لم يعمل أبداً')
+        parser.add_argument('--rest-weight', type=float, help='تجاوز وزن مرات الراحة المتتالية')
+        parser.add_argument('--json', action='store_true', help='إخراج النتائج بصيغة JSON')
+        parser.add_argument('--deliver', action='store_true', help='إرسال صندوق الصادر إلى خادم تليغرام محلي وقياس المعدل')
+        parser.add_argument('--broadcast', action='store_true', help='إضافة إشعار مخصص لجميع الموظفين قبل الإرسال (مع --deliver)')
+        parser.add_argument('--deliver-timeout', type=float, default=300, help='أقصى مدة للإرسال بالثواني')
+        parser.add_argument('--stub-latency', type=float, default=0.0, help='تأخير كل طلب في الخادم المحلي بالثواني')
+        parser.add_argument('--stub-rate-limit-rate', type=float, default=0.0, help='نسبة ردود 429 المحقونة')
+        parser.add_argument('--stub-retry-after', type=int, default=1, help='retry_after في ردود 429 المحقونة')
+        parser.add_argument('--stub-error-rate', type=float, default=0.0, help='نسبة ردود 5xx المحقونة')
+
+    def handle(self, *args, **options):
+        interval_changes = self.parse_interval_changes(options['interval_change'])
+        self.use_memory_database()
+
+        from shifts import outbox, scoring
+
+        weight_overrides = {
+            'HOURS_SINCE_WORK_WEIGHT': options['since_work_weight'],
+            'NEVER_WORKED_BONUS': options['never_worked_bonus'],
+            'CONSECUTIVE_REST_WEIGHT': options['rest_weight'],
+        }
+        patches = [
+            mock.patch.object(scoring, name, value)
+            for name, value in weight_overrides.items() if value is not None
+        ]
+        # الرسائل تبقى في صندوق الصادر (لا يوجد عامل إرسال) وتُعد في collect_metrics
+        patches.append(mock.patch.object(outbox, 'schedule_delivery', lambda: None))
+
+        for patcher in patches:
+            patcher.start()
+        try:
+            metrics = self.simulate(options, interval_changes)
+            if options['deliver']:
+                metrics['delivery'] = self.deliver(options)
+        finally:
+            for patcher in patches:
+                patcher.stop()
+
+        metrics['weights'] = {
+            name: getattr(scoring, name) if value is None else value
+            for name, value in weight_overrides.items()
+        }
+        self.report(metrics, options['json'])
+
+    def parse_interval_changes(self, values):
+        changes = {}
+        for value in values:
+            try:
+                day, hours = value.split(':')
+                changes[int(day)] = float(hours)
+            except ValueError:
+                raise CommandError(f'صيغة غير صحيحة لـ --interval-change: {value} (المطلوب DAY:HOURS)')
+        return changes
+
+    def use_memory_database(self):
+        """تحويل الاتصال الافتراضي إلى SQLite في الذاكرة وتطبيق migrations"""
+        connections[DEFAULT_DB_ALIAS].close()
+        connections.settings[DEFAULT_DB_ALIAS] = {
+            **connections.settings[DEFAULT_DB_ALIAS],
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+            'OPTIONS': {},
+        }
+        connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+        call_command('migrate', verbosity=0, interactive=False)
+
+    def build_roster(self, options, rng, start_date, end_date):
+        from shifts.models import Employee, Shift, Sonar, SystemSettings, WeeklyShiftAssignment
+        from shifts.utils import create_default_shifts
+
+        create_default_shifts()
+        shifts = list(Shift.objects.order_by('start_hour'))
+
+        Sonar.objects.bulk_create([
+            Sonar(name=f'سونار {index + 1}', max_employees=rng.randint(1, options['max_capacity']))
+            for index in range(options['sonars'])
+        ])
+        employees = [
+            Employee.objects.create(name=f'موظف {index + 1}', telegram_id=str(100000 + index))
+            for index in range(options['employees'])
+        ]
+        for offset, shift in enumerate(shifts):
+            weekly = WeeklyShiftAssignment.objects.create(
+                shift=shift, week_start_date=start_date, week_end_date=end_date
+            )
+            weekly.employees.set(employees[offset::len(shifts)])
+
+        settings = SystemSettings.get_current_settings()
+        settings.rotation_interval_hours = options['interval']
+        settings.sonar_history_depth = options['history_depth']
+        settings.save()
+        return shifts, employees
+
+    def simulate(self, options, interval_changes):
+        from shifts.models import Employee, SystemSettings
+        from shifts.utils import plan_whole_shift, rotate_within_shift, shift_bounds, shift_rotation_times
+
+        rng = random.Random(options['seed'])
+        random.seed(options['seed'])  # خلط السونارات داخل المخطط
+        tz = timezone.get_current_timezone()
+        start_date = date(2026, 1, 1)
+        end_date = start_date + timedelta(days=options['days'] + 1)
+        clock = {'now': timezone.make_aware(datetime.combine(start_date, datetime.min.time()), tz)}
+
+        rotation_times = []
+        rotation_queries = []
+        max_rest = 0
+        leave_until = {}
+
+        with mock.patch('django.utils.timezone.now', lambda: clock['now']), redirect_stdout(io.StringIO()):
+            shifts, employees = self.build_roster(options, rng, start_date, end_date)
+            connection = connections[DEFAULT_DB_ALIAS]
+
+            for day in range(options['days']):
+                current_date = start_date + timedelta(days=day)
+                clock['now'] = timezone.make_aware(datetime.combine(current_date, datetime.min.time()), tz)
+
+                if day in interval_changes:
+                    SystemSettings.objects.filter(pk=1).update(rotation_interval_hours=interval_changes[day])
+                settings = SystemSettings.get_current_settings()
+                rotation_hours = settings.get_effective_rotation_hours()
+
+                # 🏖️ تغيّر الإجازات (الخروج والعودة تمر عبر Employee.save الحقيقي)
+                for emp in employees:
+                    if emp.id in leave_until and leave_until[emp.id] <= day:
+                        del leave_until[emp.id]
+                        emp.refresh_from_db()
+                        emp.is_on_leave = False
+                        emp.save()
+                    elif emp.id not in leave_until and rng.random() < options['leave_rate']:
+                        leave_until[emp.id] = day + rng.randint(1, 4)
+                        emp.refresh_from_db()
+                        emp.is_on_leave = True
+                        emp.save()
+
+                for shift in shifts:
+                    shift_start = timezone.make_aware(
+                        datetime.combine(current_date, datetime.min.time()).replace(hour=shift.start_hour), tz
+                    )
+                    shift_start, shift_end = shift_bounds(shift, shift_start)
+                    if options['lookahead']:
+                        clock['now'] = shift_start
+                        plan_whole_shift(shift.name, shift_start=shift_start)
+
+                    for rotation_at in shift_rotation_times(shift_start, shift_end, rotation_hours):
+                        clock['now'] = rotation_at
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            rotate_within_shift(
+                                shift.name,
+                                rotation_hours,
+                                next_rotation_time=rotation_at,
+                                is_early_notification=False
+                            )
+                            rotation_times.append(time.perf_counter() - started)
+                        rotation_queries.append(len(queries))
+                        max_rest = max(max_rest, max(
+                            Employee.objects.values_list('consecutive_rest_count', flat=True)
+                        ))
+
+        return self.collect_metrics(rotation_times, rotation_queries, max_rest)
+
+    def deliver(self, options):
+        """إرسال رسائل صندوق الصادر (والإشعار المخصص) إلى خادم تليغرام محلي وقياس المعدل
+
+        التأخير بين المحاولات يُقصّر إلى ثانية (مع احترام retry_after) حتى تنتهي
+        إعادة المحاولة داخل مدة القياس.
+        """
+        from shifts import outbox
+        from shifts.broadcast import queue_broadcast
+        from shifts.models import CustomNotification, OutboxMessage
+        from shifts.telegram_stub import TelegramStub
+        from django.contrib.auth.models import User
+
+        with redirect_stdout(io.StringIO()):
+            broadcast = None
+            if options['broadcast']:
+                sender = User.objects.create(username='simulation')
+                broadcast = CustomNotification.objects.create(
+                    title='محاكاة', message='إشعار تجريبي لجميع الموظفين', sent_by=sender, send_to_all=True
+                )
+                queue_broadcast(broadcast.pk)
+            # الرسائل كُتبت بالساعة الوهمية
+            OutboxMessage.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+        stub = TelegramStub(
+            latency=options['stub_latency'],
+            rate_limit_rate=options['stub_rate_limit_rate'],
+            retry_after=options['stub_retry_after'],
+            error_rate=options['stub_error_rate'],
+            enforce_limits=True,
+            seed=options['seed'],
+        )
+        totals = {'sent': 0, 'retried': 0, 'dead': 0}
+        with stub, override_settings(TELEGRAM_API_BASE_URL=stub.base_url), \
+                mock.patch.object(outbox, 'BASE_BACKOFF_SECONDS', 1), redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            deadline = started + options['deliver_timeout']
+            while time.perf_counter() < deadline:
+                stats = outbox.deliver_due_messages()
+                for key, value in stats.items():
+                    totals[key] += value
+                if not any(stats.values()):
+                    if not OutboxMessage.objects.filter(status='pending').exists():
+                        break
+                    time.sleep(0.5)  # بانتظار موعد إعادة المحاولة
+            elapsed = time.perf_counter() - started
+
+        result = {
+            **totals,
+            'pending': OutboxMessage.objects.filter(status='pending').count(),
+            'seconds': elapsed,
+            'messages_per_second': totals['sent'] / elapsed if elapsed else 0.0,
+            'stub': stub.stats(),
+        }
+        if broadcast is not None:
+            broadcast.refresh_from_db()
+            result['broadcast'] = broadcast.progress()
+        return result
+
+    def collect_metrics(self, rotation_times, rotation_queries, max_rest):
+        from shifts.models import Employee, EmployeeAssignment, OutboxMessage
+
+        hours = list(Employee.objects.filter(is_on_leave=False).values_list('total_work_hours', flat=True))
+
+        # 🔁 نسبة تكرار نفس السونار في تبديلين متتاليين للموظف
+        repeats = transitions = 0
+        last_sonar = {}
+        working = EmployeeAssignment.objects.filter(is_standby=False, sonar__isnull=False).order_by(
+            'employee_id', 'assigned_at'
+        ).values_list('employee_id', 'sonar_id')
+        for employee_id, sonar_id in working:
+            if employee_id in last_sonar:
+                transitions += 1
+                repeats += last_sonar[employee_id] == sonar_id
+            last_sonar[employee_id] = sonar_id
+
+        times_ms = sorted(value * 1000 for value in rotation_times)
+        return {
+            'rotations': len(rotation_times),
+            'wall_ms_mean': statistics.fmean(times_ms) if times_ms else 0.0,
+            'wall_ms_p95': times_ms[int(len(times_ms) * 0.95) - 1] if times_ms else 0.0,
+            'wall_ms_max': times_ms[-1] if times_ms else 0.0,
+            'queries_mean': statistics.fmean(rotation_queries) if rotation_queries else 0.0,
+            'queries_max': max(rotation_queries, default=0),
+            'hours_spread': (max(hours) - min(hours)) if hours else 0.0,
+            'hours_stdev': statistics.pstdev(hours) if hours else 0.0,
+            'max_consecutive_rest': max_rest,
+            'sonar_repeat_rate': repeats / transitions if transitions else 0.0,
+            'messages': OutboxMessage.objects.count(),
+        }
+
+    def report(self, metrics, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(metrics, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ اكتملت المحاكاة: {metrics['rotations']} تبديل"))
+        self.stdout.write("\n⏱️ الأداء لكل تبديل:")
+        self.stdout.write(
+            f"  • الوقت: متوسط {metrics['wall_ms_mean']:.1f}ms | p95 {metrics['wall_ms_p95']:.1f}ms"
+            f" | أقصى {metrics['wall_ms_max']:.1f}ms"
+        )
+        self.stdout.write(f"  • الاستعلامات: متوسط {metrics['queries_mean']:.1f} | أقصى {metrics['queries_max']}")
+        self.stdout.write("\n⚖️ العدالة:")
+        self.stdout.write(
+            f"  • فرق الساعات (أعلى - أدنى): {metrics['hours_spread']:.1f} ساعة"
+            f" | الانحراف المعياري: {metrics['hours_stdev']:.2f}"
+        )
+        self.stdout.write(f"  • أقصى عدد مرات راحة متتالية: {metrics['max_consecutive_rest']}")
+        self.stdout.write(f"  • نسبة تكرار نفس السونار: {metrics['sonar_repeat_rate']:.1%}")
+        self.stdout.write(f"\n📨 رسائل التبديل في صندوق الصادر: {metrics['messages']}")
+        delivery = metrics.get('delivery')
+        if delivery:
+            self.stdout.write(
+                f"📬 الإرسال إلى الخادم المحلي: {delivery['sent']} رسالة في {delivery['seconds']:.1f} ث"
+                f" ({delivery['messages_per_second']:.1f} رسالة/ث) | إعادة محاولة {delivery['retried']}"
+                f" | فشل نهائي {delivery['dead']} | متبقية {delivery['pending']}"
+            )
+            self.stdout.write(f"  • ردود الخادم: {delivery['stub']['statuses']}")
+            if 'broadcast' in delivery:
+                progress = delivery['broadcast']
+                self.stdout.write(
+                    f"  • الإشعار المخصص: {progress['status_display']} - أُرسلت {progress['sent']}"
+                    f" | فشلت {progress['failed']} | بالانتظار {progress['pending']} من {progress['total']}"
+                )
+        self.stdout.write(
+            "🎚️ الأوزان: " + ", ".join(f"{name}={value}" for name, value in metrics['weights'].items())
+        )
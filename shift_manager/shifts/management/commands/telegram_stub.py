@@ -0,0 +1,69 @@
+"""تشغيل خادم محلي يحاكي Bot API لتليغرام (sendMessage) بدل الخادم الحقيقي
+
+وجّه العمال والواجهة إليه بـ TELEGRAM_API_BASE_URL ثم شغّل التبديل أو الإشعارات:
+
+    python manage.py telegram_stub --port 8081 --latency 0.05 --jitter 0.02
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 celery -A shift_manager worker -Q notifications
+
+أمثلة حقن الأعطال:
+    python manage.py telegram_stub --rate-limit-rate 0.05 --retry-after 3
+    python manage.py telegram_stub --error-rate 0.02 --error-status 503 --forbidden-chat 100001
+    python manage.py telegram_stub --enforce-limits --record /tmp/telegram.jsonl
+"""
+from django.core.management.base import BaseCommand
+
+from shifts.telegram_stub import TelegramStub
+
+
+class Command(BaseCommand):
+    help = 'خادم محلي يحاكي sendMessage في تليغرام مع حقن التأخير وأخطاء 429/5xx وتسجيل الرسائل'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='عنوان الاستماع')
+        parser.add_argument('--port', type=int, default=8081, help='منفذ الاستماع')
+        parser.add_argument('--latency', type=float, default=0.0, help='تأخير كل طلب بالثواني')
+        parser.add_argument('--jitter', type=float, default=0.0, help='تذبذب عشوائي للتأخير (± ثوانٍ)')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='نسبة الطلبات التي تُرد بـ 429 (0-1)')
+        parser.add_argument('--retry-after', type=int, default=1, help='قيمة retry_after في ردود 429 المحقونة')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='نسبة الطلبات التي تُرد بخطأ خادم (0-1)')
+        parser.add_argument('--error-status', type=int, default=502, help='رمز خطأ الخادم المحقون')
+        parser.add_argument(
+            '--forbidden-chat', action='append', default=[], metavar='CHAT_ID',
+            help='محادثة تُرد دائماً بـ 403 (البوت محظور)، يمكن تكراره'
+        )
+        parser.add_argument(
+            '--enforce-limits', action='store_true',
+            help='فرض حدود تليغرام (30 رسالة/ثانية، ورسالة/ثانية لكل محادثة) بردود 429'
+        )
+        parser.add_argument('--record', metavar='PATH', help='تسجيل كل طلب في ملف JSONL')
+        parser.add_argument('--seed', type=int, help='بذرة الأرقام العشوائية (أعطال قابلة للتكرار)')
+
+    def handle(self, *args, **options):
+        stub = TelegramStub(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            rate_limit_rate=options['rate_limit_rate'],
+            retry_after=options['retry_after'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            forbidden_chats=options['forbidden_chat'],
+            enforce_limits=options['enforce_limits'],
+            record_path=options['record'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"🤖 خادم تليغرام المحلي يعمل على {stub.base_url}"))
+        self.stdout.write(f"   TELEGRAM_API_BASE_URL={stub.base_url}")
+        self.stdout.write("   الرسائل المسجلة: GET /_stub/messages | الإحصائيات: GET /_stub/stats | تصفير: POST /_stub/reset")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
+            stats = stub.stats()
+            self.stdout.write(
+                f"\n📊 {stats['requests']} طلب، {stats['delivered']} رسالة مقبولة لـ {stats['chats']} محادثة"
+                f" | الردود: {stats['statuses']}"
+            )
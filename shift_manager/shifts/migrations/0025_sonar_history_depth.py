@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0024_fix_rotation_interval_to_3_hours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemsettings',
+            name='sonar_history_depth',
+            field=models.PositiveSmallIntegerField(default=3, help_text='يتجنب التبديل إعادة الموظف لأحد آخر N سونارات عمل عليها (الأحدث أولاً)', verbose_name='عدد السونارات السابقة لتجنب تكرارها'),
+        ),
+        migrations.AddIndex(
+            model_name='employeeassignment',
+            index=models.Index(fields=['employee', '-assigned_at'], name='assignment_emp_history_idx'),
+        ),
+    ]
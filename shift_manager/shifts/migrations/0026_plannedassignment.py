@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0025_sonar_history_depth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlannedAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rotation_at', models.DateTimeField(verbose_name='بداية الفترة')),
+                ('is_standby', models.BooleanField(default=False, verbose_name='احتياط')),
+                ('work_duration_hours', models.FloatField(default=0.0, verbose_name='مدة العمل بالساعات')),
+                ('activated', models.BooleanField(default=False, verbose_name='تم التفعيل')),
+                ('planned_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت التخطيط')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shifts.employee', verbose_name='الموظف')),
+                ('shift', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shifts.shift', verbose_name='الشفت')),
+                ('sonar', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='shifts.sonar', verbose_name='السونار')),
+            ],
+            options={
+                'verbose_name': 'تبديل مخطط',
+                'verbose_name_plural': 'التبديلات المخططة',
+                'ordering': ['rotation_at', 'is_standby', 'sonar__name'],
+                'indexes': [models.Index(fields=['rotation_at', 'shift'], name='planned_rotation_at_idx')],
+                'unique_together': {('shift', 'rotation_at', 'employee')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0026_plannedassignment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sonar',
+            name='site',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='الموقع'),
+        ),
+        migrations.AddField(
+            model_name='weeklyshiftassignment',
+            name='site',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='الموقع'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_aggregate(apps, schema_editor):
+    """بناء المجموع المتراكم من بيانات الموظفين الحالية"""
+    Employee = apps.get_model('shifts', 'Employee')
+    WorkHoursAggregate = apps.get_model('shifts', 'WorkHoursAggregate')
+
+    result = Employee.objects.filter(is_on_leave=False).aggregate(
+        total=Sum('total_work_hours'),
+        count=Count('id'),
+    )
+    WorkHoursAggregate.objects.update_or_create(
+        pk=1,
+        defaults={'total_hours': result['total'] or 0.0, 'employee_count': result['count'] or 0},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0027_sonar_site'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkHoursAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_hours', models.FloatField(default=0.0, verbose_name='مجموع ساعات العمل')),
+                ('employee_count', models.IntegerField(default=0, verbose_name='عدد الموظفين غير المجازين')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+            ],
+            options={
+                'verbose_name': 'مجموع ساعات العمل',
+                'verbose_name_plural': 'مجموع ساعات العمل',
+            },
+        ),
+        migrations.RunPython(build_aggregate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0028_workhoursaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationCommit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True, verbose_name='مفتاح التبديل')),
+                ('site', models.CharField(blank=True, default='', max_length=100, verbose_name='الموقع')),
+                ('rotation_at', models.DateTimeField(verbose_name='وقت التبديل الرسمي')),
+                ('committed_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت التنفيذ')),
+                ('shift', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rotation_commits', to='shifts.shift', verbose_name='الشفت')),
+            ],
+            options={
+                'verbose_name': 'تبديل منفذ',
+                'verbose_name_plural': 'التبديلات المنفذة',
+                'ordering': ['-rotation_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RotationLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='اسم القفل')),
+                ('owner', models.CharField(max_length=64, verbose_name='المالك')),
+                ('expires_at', models.DateTimeField(verbose_name='ينتهي في')),
+            ],
+            options={
+                'verbose_name': 'قفل تبديل',
+                'verbose_name_plural': 'أقفال التبديل',
+            },
+        ),
+    ]
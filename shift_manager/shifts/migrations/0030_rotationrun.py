@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0029_rotationcommit_rotationlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shift_name', models.CharField(max_length=20, verbose_name='اسم الشفت')),
+                ('site', models.CharField(blank=True, default='', max_length=100, verbose_name='الموقع')),
+                ('trigger', models.CharField(choices=[('shift_end', 'نهاية الشفت'), ('interval', 'حسب الفترة'), ('first_run', 'أول تبديل'), ('early_check', 'فحص الإشعار المبكر'), ('manual', 'يدوي')], default='manual', max_length=20, verbose_name='سبب التشغيل')),
+                ('is_early_notification', models.BooleanField(default=False, verbose_name='إشعار مبكر')),
+                ('rotation_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت التبديل الرسمي')),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='وقت البدء')),
+                ('duration_ms', models.FloatField(default=0.0, verbose_name='المدة (ms)')),
+                ('phase_timings', models.JSONField(blank=True, default=dict, verbose_name='زمن المراحل (ms)')),
+                ('query_count', models.PositiveIntegerField(default=0, verbose_name='عدد الاستعلامات')),
+                ('workers_count', models.PositiveIntegerField(default=0, verbose_name='العاملون')),
+                ('standby_count', models.PositiveIntegerField(default=0, verbose_name='الاحتياط')),
+                ('notifications_count', models.PositiveIntegerField(default=0, verbose_name='الإشعارات المرسلة')),
+                ('status', models.CharField(choices=[('success', 'ناجح'), ('skipped', 'متجاوز'), ('failed', 'فشل')], default='success', max_length=10, verbose_name='الحالة')),
+                ('error', models.TextField(blank=True, default='', verbose_name='الخطأ')),
+                ('shift', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rotation_runs', to='shifts.shift', verbose_name='الشفت')),
+            ],
+            options={
+                'verbose_name': 'تنفيذ تبديل',
+                'verbose_name_plural': 'سجل تنفيذ التبديلات',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0030_rotationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemsettings',
+            name='scheduled_rotation_at',
+            field=models.DateTimeField(blank=True, help_text='اللحظة التي ستعمل فيها مهمة التبديل القادمة', null=True, verbose_name='التشغيل القادم المجدول'),
+        ),
+        migrations.AddField(
+            model_name='systemsettings',
+            name='scheduled_rotation_task_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='معرف مهمة التبديل المجدولة'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0031_systemsettings_scheduled_rotation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationTimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rotation_at', models.DateTimeField(db_index=True, verbose_name='وقت التبديل الرسمي')),
+                ('period_end', models.DateTimeField(verbose_name='نهاية الفترة')),
+                ('kind', models.CharField(choices=[('shift_start', 'بداية شفت'), ('interval', 'تبديل دوري')], max_length=20, verbose_name='النوع')),
+                ('notification_at', models.DateTimeField(db_index=True, verbose_name='وقت الإشعار المبكر')),
+                ('reminder_times', models.JSONField(blank=True, default=list, verbose_name='أوقات التذكير')),
+                ('generated_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت الإنشاء')),
+                ('shift', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='shifts.shift', verbose_name='الشفت')),
+            ],
+            options={
+                'verbose_name': 'موعد تبديل',
+                'verbose_name_plural': 'الجدول الزمني للتبديل',
+                'ordering': ['rotation_at'],
+                'constraints': [models.UniqueConstraint(fields=('shift', 'rotation_at'), name='unique_timeline_rotation')],
+            },
+        ),
+    ]
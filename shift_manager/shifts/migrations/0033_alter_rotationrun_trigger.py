@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0032_rotationtimelineentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rotationrun',
+            name='trigger',
+            field=models.CharField(choices=[('shift_end', 'نهاية الشفت'), ('interval', 'حسب الفترة'), ('first_run', 'أول تبديل'), ('early_check', 'فحص الإشعار المبكر'), ('catch_up', 'تعويض الفائت'), ('manual', 'يدوي')], default='manual', max_length=20, verbose_name='سبب التشغيل'),
+        ),
+    ]
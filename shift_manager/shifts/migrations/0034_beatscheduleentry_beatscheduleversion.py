@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0033_alter_rotationrun_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BeatScheduleEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='الاسم')),
+                ('task', models.CharField(max_length=200, verbose_name='المهمة')),
+                ('minute', models.CharField(default='*', max_length=64, verbose_name='الدقيقة')),
+                ('hour', models.CharField(default='*', max_length=64, verbose_name='الساعة')),
+                ('day_of_week', models.CharField(default='*', max_length=64, verbose_name='يوم الأسبوع')),
+                ('day_of_month', models.CharField(default='*', max_length=64, verbose_name='يوم الشهر')),
+                ('month_of_year', models.CharField(default='*', max_length=64, verbose_name='الشهر')),
+                ('enabled', models.BooleanField(default=True, verbose_name='مفعلة')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='آخر تشغيل')),
+                ('total_run_count', models.PositiveIntegerField(default=0, verbose_name='عدد مرات التشغيل')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+            ],
+            options={
+                'verbose_name': 'مهمة مجدولة',
+                'verbose_name_plural': 'جدولة المهام الدورية',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BeatScheduleVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='الإصدار')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+            ],
+            options={
+                'verbose_name': 'إصدار الجدولة',
+                'verbose_name_plural': 'إصدار الجدولة',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0034_beatscheduleentry_beatscheduleversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shift',
+            name='start_minute',
+            field=models.IntegerField(default=0, verbose_name='دقيقة البداية'),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='end_minute',
+            field=models.IntegerField(default=0, verbose_name='دقيقة النهاية'),
+        ),
+    ]
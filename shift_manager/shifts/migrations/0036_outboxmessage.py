@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0035_shift_start_minute_end_minute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=50, verbose_name='معرف المحادثة')),
+                ('text', models.TextField(verbose_name='نص الرسالة')),
+                ('category', models.CharField(choices=[('rotation', 'تبديل'), ('final', 'إشعار نهائي'), ('reminder', 'تذكير'), ('supervisor', 'تنبيه المشرفين'), ('confirmation', 'تأكيد التبديل'), ('custom', 'إشعار مخصص'), ('system', 'النظام')], default='system', max_length=20, verbose_name='النوع')),
+                ('notification_type', models.CharField(blank=True, default='', max_length=20, verbose_name='نوع الإشعار')),
+                ('notification_stage', models.CharField(blank=True, default='', max_length=30, verbose_name='مرحلة الإشعار')),
+                ('minutes_before', models.IntegerField(blank=True, null=True, verbose_name='الدقائق المتبقية')),
+                ('dedupe_key', models.CharField(blank=True, max_length=200, null=True, unique=True, verbose_name='مفتاح منع التكرار')),
+                ('status', models.CharField(choices=[('pending', 'بانتظار الإرسال'), ('sent', 'أُرسلت'), ('dead', 'فشلت نهائياً')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='المحاولة القادمة')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='آخر خطأ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت الإنشاء')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الإرسال')),
+                ('assignment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outbox_messages', to='shifts.employeeassignment', verbose_name='التبديل')),
+            ],
+            options={
+                'verbose_name': 'رسالة صادرة',
+                'verbose_name_plural': 'صندوق الصادر',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'), models.Index(fields=['assignment', 'notification_stage'], name='outbox_assignment_stage_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 21:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0036_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='اسم الدلو')),
+                ('tokens', models.FloatField(default=0.0, verbose_name='الرموز المتاحة')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='آخر تحديث')),
+                ('blocked_until', models.DateTimeField(blank=True, null=True, verbose_name='محظور حتى')),
+            ],
+            options={
+                'verbose_name': 'حد إرسال',
+                'verbose_name_plural': 'حدود الإرسال',
+            },
+        ),
+    ]
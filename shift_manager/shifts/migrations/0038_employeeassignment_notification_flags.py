@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:00
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+# نفس ترتيب EmployeeAssignment.NOTIFICATION_STAGES و NOTIFICATION_TYPES وقت كتابة الـ migration
+NOTIFICATION_STAGES = ('initial', 'reminder', 'final', 'unconfirmed_warning')
+NOTIFICATION_TYPES = ('employee', 'admin')
+BATCH_SIZE = 1000
+
+
+def notification_bit(stage, notification_type):
+    index = NOTIFICATION_STAGES.index(stage) * len(NOTIFICATION_TYPES)
+    return 1 << (index + NOTIFICATION_TYPES.index(notification_type))
+
+
+def backfill_notification_flags(apps, schema_editor):
+    """حساب البتات وآخر إشعار أولي/تذكير من EarlyNotification ورسائل صندوق الصادر الحالية"""
+    EmployeeAssignment = apps.get_model('shifts', 'EmployeeAssignment')
+    EarlyNotification = apps.get_model('shifts', 'EarlyNotification')
+    OutboxMessage = apps.get_model('shifts', 'OutboxMessage')
+
+    flags = {}
+    recorded = list(EarlyNotification.objects.values_list(
+        'assignment_id', 'notification_type', 'notification_stage'
+    ).distinct())
+    recorded += list(OutboxMessage.objects.filter(assignment__isnull=False).exclude(status='dead').exclude(
+        notification_stage=''
+    ).values_list('assignment_id', 'notification_type', 'notification_stage').distinct())
+    for assignment_id, notification_type, stage in recorded:
+        if stage in NOTIFICATION_STAGES and notification_type in NOTIFICATION_TYPES:
+            flags[assignment_id] = flags.get(assignment_id, 0) | notification_bit(stage, notification_type)
+
+    # آخر إشعار أولي/تذكير من السجل ومن رسائل صندوق الصادر (الأحدث بينهما)، حتى لا يبقى
+    # last_reminder_at فارغاً لتبديل سُجل إشعاره الأولي في صندوق الصادر فقط
+    last_reminders = dict(EarlyNotification.objects.filter(
+        notification_stage__in=['initial', 'reminder']
+    ).values('assignment_id').annotate(last_sent=Max('sent_at')).values_list('assignment_id', 'last_sent'))
+    queued_reminders = OutboxMessage.objects.filter(
+        assignment__isnull=False, notification_type='employee', notification_stage__in=['initial', 'reminder']
+    ).exclude(status='dead').values('assignment_id').annotate(
+        last_queued=Max('created_at')
+    ).values_list('assignment_id', 'last_queued')
+    for assignment_id, last_queued in queued_reminders:
+        if last_reminders.get(assignment_id) is None or last_queued > last_reminders[assignment_id]:
+            last_reminders[assignment_id] = last_queued
+
+    assignment_ids = sorted(set(flags) | set(last_reminders))
+    for start in range(0, len(assignment_ids), BATCH_SIZE):
+        batch = list(EmployeeAssignment.objects.filter(pk__in=assignment_ids[start:start + BATCH_SIZE]))
+        for assignment in batch:
+            assignment.notification_flags = flags.get(assignment.pk, 0)
+            assignment.last_reminder_at = last_reminders.get(assignment.pk)
+        EmployeeAssignment.objects.bulk_update(batch, ['notification_flags', 'last_reminder_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0037_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employeeassignment',
+            name='notification_flags',
+            field=models.PositiveIntegerField(default=0, verbose_name='الإشعارات المسجلة'),
+        ),
+        migrations.AddField(
+            model_name='employeeassignment',
+            name='last_reminder_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر إشعار أولي/تذكير'),
+        ),
+        migrations.RunPython(backfill_notification_flags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_completed(apps, schema_editor):
+    """الإشعارات السابقة أُرسلت داخل الطلب نفسه، فعدد المستلمين هو عدد المرسل إليهم"""
+    CustomNotification = apps.get_model('shifts', 'CustomNotification')
+    CustomNotification.objects.update(status='completed', total_recipients=F('total_sent'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0038_employeeassignment_notification_flags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customnotification',
+            name='status',
+            field=models.CharField(choices=[('queued', 'بانتظار التجهيز'), ('sending', 'جارٍ الإرسال'), ('completed', 'اكتمل الإرسال')], default='queued', max_length=10, verbose_name='حالة الإرسال'),
+        ),
+        migrations.AddField(
+            model_name='customnotification',
+            name='last_recipient_id',
+            field=models.PositiveIntegerField(blank=True, help_text='يُستأنف تجهيز الرسائل بعده إذا توقف العامل', null=True, verbose_name='آخر موظف تمت جدولته'),
+        ),
+        migrations.AddField(
+            model_name='customnotification',
+            name='total_recipients',
+            field=models.PositiveIntegerField(default=0, verbose_name='عدد المستلمين'),
+        ),
+        migrations.AddField(
+            model_name='customnotification',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='عدد الفاشلة'),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='broadcast',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='shifts.customnotification', verbose_name='الإشعار المخصص'),
+        ),
+        migrations.RunPython(mark_existing_completed, migrations.RunPython.noop),
+    ]
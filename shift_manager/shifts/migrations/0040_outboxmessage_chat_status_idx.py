@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0039_customnotification_progress'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['chat_id', 'status'], name='outbox_chat_status_idx'),
+        ),
+    ]
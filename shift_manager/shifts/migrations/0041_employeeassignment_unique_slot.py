@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+def remove_duplicate_assignments(apps, schema_editor):
+    """حذف السجلات المكررة لنفس (الموظف، الشفت، الوقت، السونار) قبل إضافة القيد الفريد
+
+    يُبقى السجل المحتسب (notification_sent) أو الأقدم، وتُنقل إليه رسائل صندوق الصادر
+    وسجلات EarlyNotification والتأكيد وبتات الإشعارات من السجلات المحذوفة.
+    """
+    EmployeeAssignment = apps.get_model('shifts', 'EmployeeAssignment')
+    EarlyNotification = apps.get_model('shifts', 'EarlyNotification')
+    OutboxMessage = apps.get_model('shifts', 'OutboxMessage')
+    AssignmentConfirmation = apps.get_model('shifts', 'AssignmentConfirmation')
+
+    duplicates = (
+        EmployeeAssignment.objects.values('employee_id', 'shift_id', 'assigned_at', 'sonar_id')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for group in duplicates:
+        count = group.pop('count')
+        rows = list(EmployeeAssignment.objects.filter(**group).order_by('-notification_sent', 'id'))
+        kept, removed = rows[0], rows[1:]
+        removed_ids = [row.pk for row in removed]
+        print(f"  🧹 {count} سجلات مكررة للموظف {group['employee_id']} في {group['assigned_at']} - إبقاء {kept.pk}")
+
+        EarlyNotification.objects.filter(assignment_id__in=removed_ids).update(assignment_id=kept.pk)
+        OutboxMessage.objects.filter(assignment_id__in=removed_ids).update(assignment_id=kept.pk)
+        if not AssignmentConfirmation.objects.filter(assignment_id=kept.pk).exists():
+            confirmation = AssignmentConfirmation.objects.filter(assignment_id__in=removed_ids).order_by('id').first()
+            if confirmation is not None:
+                confirmation.assignment_id = kept.pk
+                confirmation.save(update_fields=['assignment'])
+
+        for row in removed:
+            kept.notification_flags |= row.notification_flags
+            if row.last_reminder_at and (kept.last_reminder_at is None or row.last_reminder_at > kept.last_reminder_at):
+                kept.last_reminder_at = row.last_reminder_at
+        kept.save(update_fields=['notification_flags', 'last_reminder_at'])
+        EmployeeAssignment.objects.filter(pk__in=removed_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0040_outboxmessage_chat_status_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_assignments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='employeeassignment',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('sonar__isnull', False)),
+                fields=('employee', 'shift', 'assigned_at', 'sonar'),
+                name='unique_assignment_work_slot',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='employeeassignment',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('sonar__isnull', True)),
+                fields=('employee', 'shift', 'assigned_at'),
+                name='unique_assignment_standby',
+            ),
+        ),
+    ]
@@ -1,7 +1,9 @@
-from datetime import date
+from datetime import date, timezone as dt_timezone
 
 from django.db import models
 from django.db.models import ManyToManyField
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.forms import DateField
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -97,6 +99,7 @@ class Employee(models.Model):
         
         # التحقق من العودة من الإجازة
         returning_from_leave = False
+        old_instance = None
         if not is_new and self.pk:
             try:
                 old_instance = Employee.objects.get(pk=self.pk)
@@ -121,6 +124,20 @@ class Employee(models.Model):
             self.equalize_work_hours_to_average()
             # حفظ مرة أخرى بعد المعادلة
             super().save(update_fields=['total_work_hours', 'last_work_datetime', 'consecutive_rest_count'])
+        
+        # 📊 تحديث مجموع الساعات المتراكم بالفرق فقط (بدون إعادة حساب الجدول)
+        hours_delta, count_delta = self.aggregate_contribution()
+        if old_instance is not None:
+            old_hours, old_count = old_instance.aggregate_contribution()
+            hours_delta -= old_hours
+            count_delta -= old_count
+        WorkHoursAggregate.apply_delta(hours_delta, count_delta)
+    
+    def aggregate_contribution(self):
+        """مساهمة الموظف في WorkHoursAggregate: (الساعات، العدد) - صفر للمجاز"""
+        if self.is_on_leave:
+            return 0.0, 0
+        return self.total_work_hours, 1
     
     def get_work_hours_today(self):
         """حساب ساعات العمل اليوم"""
@@ -154,12 +171,12 @@ class Employee(models.Model):
         """
         from django.utils import timezone
         
-        # حساب متوسط ساعات العمل للموظفين المتاحين (غير المجازين)
-        all_employees = Employee.objects.filter(is_on_leave=False).exclude(id=self.id)
+        # متوسط ساعات العمل للموظفين المتاحين (غير المجازين)
+        # المجموع المتراكم لا يشمل هذا الموظف بعد (جديد أو كان في إجازة)
+        aggregate = WorkHoursAggregate.get_current()
         
-        if all_employees.count() > 0:
-            total = sum(emp.total_work_hours for emp in all_employees)
-            avg_work_hours = total / all_employees.count()
+        if aggregate.employee_count > 0:
+            avg_work_hours = aggregate.average
             
             # تحديث ساعات الموظف للمتوسط
             self.total_work_hours = avg_work_hours
@@ -184,40 +201,26 @@ class Employee(models.Model):
         """
         from django.utils import timezone
         
-        # إذا لم يُعطى المتوسط، نحسبه
+        # إذا لم يُعطى المتوسط، نقرأه من المجموع المتراكم
         if avg_work_hours is None:
-            all_employees = Employee.objects.filter(is_on_leave=False)
-            if all_employees.count() > 0:
-                total = sum(emp.total_work_hours for emp in all_employees)
-                avg_work_hours = total / all_employees.count()
-            else:
-                avg_work_hours = 0.0
-        
-        # ⭐ العامل الأهم: الفرق عن المتوسط
-        # الموظف الذي عمل أقل من المتوسط → نقاط أقل (أولوية أعلى)
-        # الموظف الذي عمل أكثر من المتوسط → نقاط أعلى (أولوية أقل)
-        score = self.total_work_hours - avg_work_hours
-        
-        # ⭐ مكافأة للموظفين الذين لم يعملوا مؤخراً
-        if self.last_work_datetime:
-            hours_since_work = (timezone.now() - self.last_work_datetime).total_seconds() / 3600
-            # كل ساعة راحة = خصم 0.3 نقطة (تقليل التأثير)
-            score -= (hours_since_work * 0.1)  # تم تقليل من 0.3 إلى 0.1
-        else:
-            # لم يعمل أبداً → أولوية متوسطة (تم إزالة -500)
-            score -= 10  # مكافأة صغيرة فقط
-        
-        # ⭐ مكافأة إضافية للموظفين الذين استراحوا عدة مرات متتالية
-        # كل مرة راحة = خصم 5 نقاط
-        score -= (self.consecutive_rest_count * 5)
+            avg_work_hours = WorkHoursAggregate.get_current().average
         
-        return score
+        # نفس المعادلة المستخدمة في الحساب الجماعي (scoring.py)
+        from .scoring import priority_score
+        return priority_score(
+            self.total_work_hours,
+            self.last_work_datetime,
+            self.consecutive_rest_count,
+            avg_work_hours,
+            timezone.now(),
+        )
 
 
 class Sonar(models.Model):
     name = models.CharField(max_length=50)
     active = models.BooleanField(default=True)  # لتحديد إذا كانت المحطة نشطة
     max_employees = models.IntegerField(default=1)  # عدد الموظفين المطلوب لكل محطة
+    site = models.CharField(max_length=100, blank=True, default='', db_index=True, verbose_name='الموقع')  # مجموعة تبديل مستقلة
 
     def __str__(self):
         return self.name
@@ -233,10 +236,41 @@ class Shift(models.Model):
     name = models.CharField(max_length=20, choices=SHIFT_CHOICES, unique=True)
     start_hour = models.IntegerField()
     end_hour = models.IntegerField()
+    start_minute = models.IntegerField(default=0, verbose_name='دقيقة البداية')
+    end_minute = models.IntegerField(default=0, verbose_name='دقيقة النهاية')
 
     def __str__(self):
         return dict(self.SHIFT_CHOICES).get(self.name, self.name)
 
+    @property
+    def start_minute_of_day(self):
+        """بداية الشفت بالدقائق من منتصف الليل"""
+        return self.start_hour * 60 + self.start_minute
+
+    @property
+    def duration_minutes(self):
+        """مدة الشفت بالدقائق (الشفت الذي يمر منتصف الليل يُحسب على يومين)"""
+        return (self.end_hour * 60 + self.end_minute - self.start_minute_of_day) % (24 * 60) or 24 * 60
+
+    @property
+    def duration_hours(self):
+        return self.duration_minutes / 60
+
+    @property
+    def start_label(self):
+        return f"{self.start_hour:02d}:{self.start_minute:02d}"
+
+    @property
+    def end_label(self):
+        return f"{self.end_hour:02d}:{self.end_minute:02d}"
+
+
+@receiver([post_save, post_delete], sender=Shift)
+def invalidate_shift_calendar_cache(sender, **kwargs):
+    """إبطال تقويم الشفتات المخزن في هذه العملية عند تعديل أي شفت"""
+    from .shift_calendar import invalidate_shift_calendar
+    invalidate_shift_calendar()
+
 
 class WeeklyShiftAssignment(models.Model):
     shift = models.ForeignKey(Shift, on_delete=models.CASCADE)
@@ -244,8 +278,11 @@ class WeeklyShiftAssignment(models.Model):
 
     week_start_date = models.DateField(default=date.today)  # ✅ تاريخ افتراضي
     week_end_date = models.DateField(default=date.today)  # ✅ تاريخ افتراضي
+    site = models.CharField(max_length=100, blank=True, default='', verbose_name='الموقع')  # موقع السونارات لهذه الجدولة
 
     def __str__(self):
+        if self.site:
+            return f"{self.shift.name} - {self.site} - {self.week_start_date}"
         return f"{self.shift.name} - {self.week_start_date}"
 
 
@@ -278,16 +315,84 @@ class EmployeeAssignment(models.Model):
         verbose_name='المشرف المؤكد'
     )
 
+    # 🔔 الإشعارات المسجلة لهذا التبديل (بت لكل مرحلة × نوع، انظر notification_bit)
+    # بدلاً من استعلام EarlyNotification في كل فحص "هل أُرسل مسبقاً؟"
+    notification_flags = models.PositiveIntegerField(default=0, verbose_name='الإشعارات المسجلة')
+    last_reminder_at = models.DateTimeField(null=True, blank=True, verbose_name='آخر إشعار أولي/تذكير')
+
+    NOTIFICATION_STAGES = ('initial', 'reminder', 'final', 'unconfirmed_warning')
+    NOTIFICATION_TYPES = ('employee', 'admin')
+
     class Meta:
         verbose_name = 'إسناد موظف'
         verbose_name_plural = 'إسنادات الموظفين'
         ordering = ['-assigned_at']
+        indexes = [
+            # سجل السونارات السابقة لكل موظف (تجنب التكرار في التبديل)
+            models.Index(fields=['employee', '-assigned_at'], name='assignment_emp_history_idx'),
+        ]
+        constraints = [
+            # تبديل واحد لكل موظف في الفترة: عاملان متزامنان لا يكرران السجلات (تُكتب بـ ignore_conflicts)
+            # الاحتياط بقيد منفصل لأن NULL في sonar لا يتعارض مع NULL آخر في القيد الفريد
+            models.UniqueConstraint(
+                fields=['employee', 'shift', 'assigned_at', 'sonar'],
+                condition=models.Q(sonar__isnull=False),
+                name='unique_assignment_work_slot',
+            ),
+            models.UniqueConstraint(
+                fields=['employee', 'shift', 'assigned_at'],
+                condition=models.Q(sonar__isnull=True),
+                name='unique_assignment_standby',
+            ),
+        ]
 
     def __str__(self):
         if self.is_standby:
             return f"{self.employee} - احتياط ({self.shift.name})"
         return f"{self.employee} → {self.sonar} ({self.shift.name})"
 
+    @classmethod
+    def notification_bit(cls, stage, notification_type=None):
+        """بت المرحلة والنوع (بدون نوع: بتا الموظف والإدارة معاً)"""
+        index = cls.NOTIFICATION_STAGES.index(stage) * len(cls.NOTIFICATION_TYPES)
+        if notification_type is None:
+            return sum(1 << (index + offset) for offset in range(len(cls.NOTIFICATION_TYPES)))
+        return 1 << (index + cls.NOTIFICATION_TYPES.index(notification_type))
+
+    def has_notification(self, stage, notification_type=None):
+        """هل سُجل إشعار بهذه المرحلة (ولهذا النوع إن حُدد)؟ قراءة عمود بدون استعلام"""
+        return bool(self.notification_flags & self.notification_bit(stage, notification_type))
+
+    @classmethod
+    def mark_notified(cls, assignments, stage, notification_type, at=None):
+        """تسجيل الإشعار لمجموعة تبديلات باستعلام UPDATE واحد (F().bitor ذري بين العمليات)
+
+        الإشعار الأولي والتذكير يحدّثان last_reminder_at أيضاً. الكائنات المعطاة تُحدَّث
+        في الذاكرة حتى تبقى قراءات has_notification اللاحقة صحيحة.
+        """
+        assignments = [assignment for assignment in assignments if assignment.pk]
+        if not assignments:
+            return
+        bit = cls.notification_bit(stage, notification_type)
+        updates = {'notification_flags': models.F('notification_flags').bitor(bit)}
+        if stage in ('initial', 'reminder'):
+            at = at or timezone.now()
+            updates['last_reminder_at'] = at
+        cls.objects.filter(pk__in=[assignment.pk for assignment in assignments]).update(**updates)
+        for assignment in assignments:
+            assignment.notification_flags |= bit
+            if 'last_reminder_at' in updates:
+                assignment.last_reminder_at = at
+
+    @classmethod
+    def notification_filter(cls, queryset, stage, notification_type=None, notified=True):
+        """تصفية التبديلات حسب بت الإشعار داخل قاعدة البيانات"""
+        bit = cls.notification_bit(stage, notification_type)
+        alias = f'{stage}_notification_bits'
+        queryset = queryset.alias(**{alias: models.F('notification_flags').bitand(bit)})
+        lookup = {alias: 0}
+        return queryset.exclude(**lookup) if notified else queryset.filter(**lookup)
+
 
 class AssignmentConfirmation(models.Model):
     """موديل لتخزين تأكيدات/رفض التبديلات من قبل المشرف"""
@@ -343,6 +448,13 @@ class SystemSettings(models.Model):
         help_text='كم دقيقة قبل التبديل الفعلي يتم إرسال الإشعار'
     )
 
+    # عمق سجل السونارات لتجنب التكرار
+    sonar_history_depth = models.PositiveSmallIntegerField(
+        default=3,
+        verbose_name='عدد السونارات السابقة لتجنب تكرارها',
+        help_text='يتجنب التبديل إعادة الموظف لأحد آخر N سونارات عمل عليها (الأحدث أولاً)'
+    )
+
     # إعدادات النظام
     is_rotation_active = models.BooleanField(
         default=True,
@@ -357,6 +469,20 @@ class SystemSettings(models.Model):
         help_text='آخر وقت تم فيه تنفيذ التبديل التلقائي'
     )
 
+    # مهمة ETA المجدولة للتشغيل القادم (scheduler.py)
+    scheduled_rotation_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='التشغيل القادم المجدول',
+        help_text='اللحظة التي ستعمل فيها مهمة التبديل القادمة'
+    )
+    scheduled_rotation_task_id = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='معرف مهمة التبديل المجدولة'
+    )
+
     # تواريخ الإنشاء والتحديث
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='تاريخ آخر تحديث')
@@ -380,50 +506,29 @@ class SystemSettings(models.Model):
 
     def get_next_rotation_time(self):
         """حساب وقت التبديل التالي مع مراعاة:
-        1. التبديل في نهاية كل شفت (7:00، 15:00، 23:00)
+        1. التبديل في نهاية كل شفت (من تقويم الشفتات المبني على جدول Shift)
         2. التبديل الدوري بناءً على rotation_interval_hours من آخر تبديل رسمي
-        يتم اختيار أقرب وقت قادم مع أولوية لنهاية الشفتات."""
+        يتم اختيار أقرب وقت قادم مع أولوية لنهاية الشفتات.
+
+        يُقرأ من الجدول الزمني المحسوب مسبقاً (RotationTimelineEntry) إن وجد،
+        والحساب أدناه احتياطي فقط عندما يكون الجدول فارغاً."""
         from datetime import datetime, timedelta, time
 
         tz = timezone.get_current_timezone()
         now = timezone.localtime(timezone.now())
-        current_time = now.time()
 
-        rotation_hours = max(float(self.rotation_interval_hours or 1.0), 0.1)
+        entry = RotationTimelineEntry.next_after(now)
+        if entry:
+            return timezone.localtime(entry.rotation_at)
 
-        shift_end_times = {
-            "night": time(7, 0),
-            "morning": time(15, 0),
-            "evening": time(23, 0),
-        }
+        from .shift_calendar import get_shift_calendar
+        calendar = get_shift_calendar()
 
-        shift_ranges = {
-            "morning": (time(7, 0), time(15, 0)),
-            "evening": (time(15, 0), time(23, 0)),
-            "night": (time(23, 0), time(7, 0)),
-        }
+        rotation_hours = max(float(self.rotation_interval_hours or 1.0), 0.1)
 
-        # تحديد الشفت الحالي
-        current_shift_name = None
-        for name, (start, end) in shift_ranges.items():
-            if start <= end:
-                if start <= current_time < end:
-                    current_shift_name = name
-                    break
-            else:
-                if current_time >= start or current_time < end:
-                    current_shift_name = name
-                    break
-
-        # حساب أقرب نهاية شفت (وقت رسمي)
-        next_shift_end = None
-        for end_time in shift_end_times.values():
-            candidate = datetime.combine(now.date(), end_time)
-            candidate = timezone.make_aware(candidate, tz)
-            if candidate <= now:
-                candidate += timedelta(days=1)
-            if next_shift_end is None or candidate < next_shift_end:
-                next_shift_end = candidate
+        # حساب أقرب نهاية شفت (وقت رسمي) من تقويم الشفتات
+        boundary = calendar.next_boundary(now)
+        next_shift_end = boundary.at if boundary else None
 
         # حساب التبديل الدوري التالي
         next_interval_time = None
@@ -435,17 +540,8 @@ class SystemSettings(models.Model):
                 next_interval_time += rotation_delta
         else:
             # حساب البداية من الشفت الحالي
-            try:
-                shift = Shift.objects.get(name__iexact=current_shift_name.strip())
-            except (Shift.DoesNotExist, AttributeError):
-                shift = None
-
-            if shift:
-                shift_start = datetime.combine(now.date(), time(shift.start_hour, 0))
-                shift_start = timezone.make_aware(shift_start, tz)
-                if shift.end_hour <= shift.start_hour and current_time < time(shift.start_hour, 0):
-                    shift_start -= timedelta(days=1)
-
+            _, shift_start = calendar.locate(now)
+            if shift_start:
                 hours_since_start = (now - shift_start).total_seconds() / 3600
                 rotation_index = int(hours_since_start // rotation_hours) if rotation_hours > 0 else 0
                 next_interval_time = shift_start + timedelta(hours=(rotation_index + 1) * rotation_hours)
@@ -541,8 +637,23 @@ class CustomNotification(models.Model):
         verbose_name='إرسال لجميع الموظفين'
     )
 
-    # إحصائيات
+    # حالة الإرسال في الخلفية (انظر broadcast.py)
+    STATUS_CHOICES = [
+        ('queued', 'بانتظار التجهيز'),
+        ('sending', 'جارٍ الإرسال'),
+        ('completed', 'اكتمل الإرسال'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', verbose_name='حالة الإرسال')
+    last_recipient_id = models.PositiveIntegerField(
+        null=True, blank=True,
+        verbose_name='آخر موظف تمت جدولته',
+        help_text='يُستأنف تجهيز الرسائل بعده إذا توقف العامل'
+    )
+
+    # إحصائيات (تُحدَّث مع كل دفعة إرسال من صندوق الصادر)
+    total_recipients = models.PositiveIntegerField(default=0, verbose_name='عدد المستلمين')
     total_sent = models.IntegerField(default=0, verbose_name='عدد المرسل إليهم')
+    failed_count = models.PositiveIntegerField(default=0, verbose_name='عدد الفاشلة')
 
     class Meta:
         verbose_name = 'إشعار مخصص'
@@ -552,6 +663,30 @@ class CustomNotification(models.Model):
     def __str__(self):
         return f"{self.title} - {self.sent_by.username} ({self.sent_at.strftime('%Y-%m-%d %H:%M')})"
 
+    @property
+    def pending_count(self):
+        """المستلمون الذين لم تُرسل رسائلهم بعد"""
+        return max(self.total_recipients - self.total_sent - self.failed_count, 0)
+
+    @property
+    def progress_percent(self):
+        if not self.total_recipients:
+            return 100 if self.status == 'completed' else 0
+        return (self.total_sent + self.failed_count) * 100 // self.total_recipients
+
+    def progress(self):
+        """ملخص التقدم لصفحات القائمة والتفاصيل"""
+        return {
+            'id': self.pk,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'total': self.total_recipients,
+            'sent': self.total_sent,
+            'failed': self.failed_count,
+            'pending': self.pending_count,
+            'percent': self.progress_percent,
+        }
+
 
 class MonthlyWorkHoursReset(models.Model):
     """سجل تصفير ساعات العمل الشهرية
@@ -602,3 +737,415 @@ class MonthlyWorkHoursReset(models.Model):
             9: 'سبتمبر', 10: 'أكتوبر', 11: 'نوفمبر', 12: 'ديسمبر'
         }
         return months.get(self.month, str(self.month))
+
+
+class PlannedAssignment(models.Model):
+    """خانة تبديل مخططة مسبقاً لفترة مستقبلية داخل الشفت
+
+    يتم تخطيط جميع فترات الشفت دفعة واحدة (plan_whole_shift)، وعند حلول وقت
+    كل فترة تُفعّل الخانات المحفوظة وتتحول إلى EmployeeAssignment بدلاً من
+    إعادة حساب التوزيع.
+    """
+    shift = models.ForeignKey(Shift, on_delete=models.CASCADE, verbose_name='الشفت')
+    rotation_at = models.DateTimeField(verbose_name='بداية الفترة')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, verbose_name='الموظف')
+    sonar = models.ForeignKey(
+        Sonar,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='السونار'
+    )
+    is_standby = models.BooleanField(default=False, verbose_name='احتياط')
+    work_duration_hours = models.FloatField(default=0.0, verbose_name='مدة العمل بالساعات')
+    activated = models.BooleanField(default=False, verbose_name='تم التفعيل')
+    planned_at = models.DateTimeField(auto_now_add=True, verbose_name='وقت التخطيط')
+
+    class Meta:
+        verbose_name = 'تبديل مخطط'
+        verbose_name_plural = 'التبديلات المخططة'
+        ordering = ['rotation_at', 'is_standby', 'sonar__name']
+        unique_together = [['shift', 'rotation_at', 'employee']]
+        indexes = [
+            models.Index(fields=['rotation_at', 'shift'], name='planned_rotation_at_idx'),
+        ]
+
+    def __str__(self):
+        if self.is_standby:
+            return f"{self.employee} - احتياط ({self.rotation_at:%H:%M})"
+        return f"{self.employee} → {self.sonar} ({self.rotation_at:%H:%M})"
+
+
+class WorkHoursAggregate(models.Model):
+    """مجموع ساعات العمل وعدد الموظفين غير المجازين (صف واحد pk=1)
+
+    يُحدّث بالفرق (F expressions) داخل نفس المعاملة عند تغيير الساعات أو حالة
+    الإجازة، فيصبح متوسط الساعات قراءة صف واحد بدلاً من المرور على جميع الموظفين.
+    reconcile() تقارنه مع Sum/Count من قاعدة البيانات وتصحح أي انحراف.
+    """
+    total_hours = models.FloatField(default=0.0, verbose_name='مجموع ساعات العمل')
+    employee_count = models.IntegerField(default=0, verbose_name='عدد الموظفين غير المجازين')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')
+
+    class Meta:
+        verbose_name = 'مجموع ساعات العمل'
+        verbose_name_plural = 'مجموع ساعات العمل'
+
+    def __str__(self):
+        return f"{self.total_hours:.1f} ساعة / {self.employee_count} موظف (متوسط {self.average:.1f})"
+
+    @property
+    def average(self):
+        return self.total_hours / self.employee_count if self.employee_count > 0 else 0.0
+
+    @classmethod
+    def get_current(cls):
+        """قراءة المجموع الحالي (يُبنى من قاعدة البيانات في أول مرة)"""
+        aggregate = cls.objects.filter(pk=1).first()
+        return aggregate or cls.rebuild()
+
+    @classmethod
+    def get_average(cls):
+        return cls.get_current().average
+
+    @classmethod
+    def apply_delta(cls, hours=0.0, count=0):
+        """إضافة فرق للمجموع (ذري على مستوى قاعدة البيانات)"""
+        if not hours and not count:
+            return
+        updated = cls.objects.filter(pk=1).update(
+            total_hours=models.F('total_hours') + hours,
+            employee_count=models.F('employee_count') + count,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            # أول استخدام: البناء من البيانات الحالية (يتضمن التغيير الحالي)
+            cls.rebuild()
+
+    @classmethod
+    def compute(cls):
+        """المجموع والعدد الفعليين من قاعدة البيانات"""
+        result = Employee.objects.filter(is_on_leave=False).aggregate(
+            total=models.Sum('total_work_hours'),
+            count=models.Count('id'),
+        )
+        return result['total'] or 0.0, result['count'] or 0
+
+    @classmethod
+    def rebuild(cls):
+        total, count = cls.compute()
+        aggregate, _ = cls.objects.update_or_create(
+            pk=1, defaults={'total_hours': total, 'employee_count': count}
+        )
+        return aggregate
+
+    @classmethod
+    def reconcile(cls, tolerance=0.01):
+        """مقارنة المجموع المتراكم مع قاعدة البيانات وتصحيحه عند الاختلاف
+
+        Returns:
+            (فرق الساعات، فرق العدد) قبل التصحيح
+        """
+        stored = cls.get_current()
+        total, count = cls.compute()
+        drift = (stored.total_hours - total, stored.employee_count - count)
+        if abs(drift[0]) > tolerance or drift[1] != 0:
+            cls.objects.filter(pk=1).update(total_hours=total, employee_count=count, updated_at=timezone.now())
+        return drift
+
+
+@receiver(post_delete, sender=Employee)
+def remove_employee_from_aggregate(sender, instance, **kwargs):
+    """خصم مساهمة الموظف المحذوف من المجموع المتراكم"""
+    hours, count = instance.aggregate_contribution()
+    WorkHoursAggregate.apply_delta(-hours, -count)
+
+
+class RotationCommit(models.Model):
+    """مفتاح منع التكرار لكل تبديل رسمي (شفت + موقع + وقت التبديل الرسمي)
+
+    يُنشأ داخل نفس معاملة احتساب الساعات؛ القيد الفريد يضمن أن التبديل يُحتسب
+    مرة واحدة فقط حتى مع تشغيل beat مكرر أو إعادة محاولة المهمة.
+    """
+    key = models.CharField(max_length=200, unique=True, verbose_name='مفتاح التبديل')
+    shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='rotation_commits', verbose_name='الشفت')
+    site = models.CharField(max_length=100, blank=True, default='', verbose_name='الموقع')
+    rotation_at = models.DateTimeField(verbose_name='وقت التبديل الرسمي')
+    committed_at = models.DateTimeField(auto_now_add=True, verbose_name='وقت التنفيذ')
+
+    class Meta:
+        verbose_name = 'تبديل منفذ'
+        verbose_name_plural = 'التبديلات المنفذة'
+        ordering = ['-rotation_at']
+
+    def __str__(self):
+        return self.key
+
+    @staticmethod
+    def make_key(shift, rotation_at, site=''):
+        """المفتاح بتوقيت UTC حتى لا يختلف باختلاف المنطقة الزمنية للعامل"""
+        rotation_at = rotation_at.astimezone(dt_timezone.utc).replace(microsecond=0)
+        return f"{shift.name}:{site or '*'}:{rotation_at.isoformat()}"
+
+
+class RotationLease(models.Model):
+    """قفل احتياطي في قاعدة البيانات عند تعذر الوصول إلى Redis (انظر locks.py)"""
+    name = models.CharField(max_length=200, unique=True, verbose_name='اسم القفل')
+    owner = models.CharField(max_length=64, verbose_name='المالك')
+    expires_at = models.DateTimeField(verbose_name='ينتهي في')
+
+    class Meta:
+        verbose_name = 'قفل تبديل'
+        verbose_name_plural = 'أقفال التبديل'
+
+    def __str__(self):
+        return f"{self.name} حتى {self.expires_at}"
+
+
+class RotationRun(models.Model):
+    """سجل تنفيذ تبديل واحد مع زمن كل مرحلة (لتتبع التبديلات البطيئة من صفحة الإعدادات)"""
+
+    TRIGGER_CHOICES = [
+        ('shift_end', 'نهاية الشفت'),
+        ('interval', 'حسب الفترة'),
+        ('first_run', 'أول تبديل'),
+        ('early_check', 'فحص الإشعار المبكر'),
+        ('catch_up', 'تعويض الفائت'),
+        ('manual', 'يدوي'),
+    ]
+
+    STATUS_CHOICES = [
+        ('success', 'ناجح'),
+        ('skipped', 'متجاوز'),
+        ('failed', 'فشل'),
+    ]
+
+    # المراحل بترتيب التنفيذ (المفتاح في phase_timings ← الاسم المعروض)
+    PHASES = [
+        ('cancel_expired', 'رفض المنتهية'),
+        ('roster_load', 'تحميل الموظفين'),
+        ('scoring', 'حساب الأولوية'),
+        ('assignment', 'التوزيع'),
+        ('persistence', 'الحفظ'),
+        ('notifications', 'الإشعارات'),
+    ]
+
+    shift = models.ForeignKey(Shift, on_delete=models.SET_NULL, null=True, blank=True, related_name='rotation_runs', verbose_name='الشفت')
+    shift_name = models.CharField(max_length=20, verbose_name='اسم الشفت')
+    site = models.CharField(max_length=100, blank=True, default='', verbose_name='الموقع')
+    trigger = models.CharField(max_length=20, choices=TRIGGER_CHOICES, default='manual', verbose_name='سبب التشغيل')
+    is_early_notification = models.BooleanField(default=False, verbose_name='إشعار مبكر')
+    rotation_at = models.DateTimeField(null=True, blank=True, verbose_name='وقت التبديل الرسمي')
+    started_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='وقت البدء')
+    duration_ms = models.FloatField(default=0.0, verbose_name='المدة (ms)')
+    phase_timings = models.JSONField(default=dict, blank=True, verbose_name='زمن المراحل (ms)')
+    query_count = models.PositiveIntegerField(default=0, verbose_name='عدد الاستعلامات')
+    workers_count = models.PositiveIntegerField(default=0, verbose_name='العاملون')
+    standby_count = models.PositiveIntegerField(default=0, verbose_name='الاحتياط')
+    notifications_count = models.PositiveIntegerField(default=0, verbose_name='الإشعارات المرسلة')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='success', verbose_name='الحالة')
+    error = models.TextField(blank=True, default='', verbose_name='الخطأ')
+
+    class Meta:
+        verbose_name = 'تنفيذ تبديل'
+        verbose_name_plural = 'سجل تنفيذ التبديلات'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.shift_name} {self.get_trigger_display()} - {self.duration_ms:.0f}ms ({self.get_status_display()})"
+
+    def phase_breakdown(self):
+        """[(المفتاح، الاسم، الزمن ms)] بترتيب المراحل للعرض"""
+        timings = self.phase_timings or {}
+        return [(key, label, timings[key]) for key, label in self.PHASES if key in timings]
+
+
+class RotationTimelineEntry(models.Model):
+    """جدول زمني محسوب مسبقاً لأوقات التبديل والإشعارات للأيام القادمة (انظر timeline.py)
+
+    يُعاد بناؤه صراحة عند تغيير الإعدادات أو الشفتات، وتقرأ المهام ولوحة التحكم
+    الحدث القادم باستعلام مفهرس بدلاً من إعادة حساب حدود الشفتات في كل مرة.
+    """
+
+    KIND_CHOICES = [
+        ('shift_start', 'بداية شفت'),
+        ('interval', 'تبديل دوري'),
+    ]
+
+    shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='timeline_entries', verbose_name='الشفت')
+    rotation_at = models.DateTimeField(db_index=True, verbose_name='وقت التبديل الرسمي')
+    period_end = models.DateTimeField(verbose_name='نهاية الفترة')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='النوع')
+    notification_at = models.DateTimeField(db_index=True, verbose_name='وقت الإشعار المبكر')
+    reminder_times = models.JSONField(default=list, blank=True, verbose_name='أوقات التذكير')
+    generated_at = models.DateTimeField(auto_now_add=True, verbose_name='وقت الإنشاء')
+
+    class Meta:
+        verbose_name = 'موعد تبديل'
+        verbose_name_plural = 'الجدول الزمني للتبديل'
+        ordering = ['rotation_at']
+        constraints = [
+            models.UniqueConstraint(fields=['shift', 'rotation_at'], name='unique_timeline_rotation'),
+        ]
+
+    def __str__(self):
+        return f"{self.shift} - {timezone.localtime(self.rotation_at).strftime('%Y-%m-%d %H:%M')} ({self.get_kind_display()})"
+
+    @classmethod
+    def next_after(cls, moment):
+        """أقرب تبديل بعد الوقت المعطى (None إذا كان الجدول فارغاً)"""
+        return cls.objects.filter(rotation_at__gt=moment).select_related('shift').order_by('rotation_at').first()
+
+    def event_times(self, lead_minutes):
+        """جميع اللحظات التي تحتاج تنفيذاً لهذا الموعد: التبديل، الإشعار، والإشعار المبكر حسب الإعدادات"""
+        from datetime import timedelta
+
+        return [
+            self.rotation_at,
+            self.notification_at,
+            self.rotation_at - timedelta(minutes=lead_minutes),
+        ]
+
+
+class BeatScheduleEntry(models.Model):
+    """مهمة دورية في جدولة Celery Beat محفوظة في قاعدة البيانات (انظر beat.py)
+
+    عملية beat تقرأ هذا الجدول عبر DatabaseScheduler وتعيد تحميله عند تغير
+    BeatScheduleVersion، فيسري تغيير الإعدادات من عملية الويب خلال ثوانٍ بدون إعادة تشغيل.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name='الاسم')
+    task = models.CharField(max_length=200, verbose_name='المهمة')
+    minute = models.CharField(max_length=64, default='*', verbose_name='الدقيقة')
+    hour = models.CharField(max_length=64, default='*', verbose_name='الساعة')
+    day_of_week = models.CharField(max_length=64, default='*', verbose_name='يوم الأسبوع')
+    day_of_month = models.CharField(max_length=64, default='*', verbose_name='يوم الشهر')
+    month_of_year = models.CharField(max_length=64, default='*', verbose_name='الشهر')
+    enabled = models.BooleanField(default=True, verbose_name='مفعلة')
+    last_run_at = models.DateTimeField(null=True, blank=True, verbose_name='آخر تشغيل')
+    total_run_count = models.PositiveIntegerField(default=0, verbose_name='عدد مرات التشغيل')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')
+
+    CRONTAB_FIELDS = ('minute', 'hour', 'day_of_week', 'day_of_month', 'month_of_year')
+
+    class Meta:
+        verbose_name = 'مهمة مجدولة'
+        verbose_name_plural = 'جدولة المهام الدورية'
+        ordering = ['name']
+
+    def __str__(self):
+        cron = ' '.join(getattr(self, field) for field in self.CRONTAB_FIELDS)
+        return f"{self.name} ({cron})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # تحديث last_run_at من beat نفسه لا يحتاج إعادة تحميل
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) - {'last_run_at', 'total_run_count'}:
+            BeatScheduleVersion.bump()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        BeatScheduleVersion.bump()
+        return result
+
+
+class BeatScheduleVersion(models.Model):
+    """رقم إصدار جدولة beat (صف واحد pk=1) - يُزاد عند أي تغيير في BeatScheduleEntry
+
+    عملية beat تقرأ هذا الرقم فقط كل بضع ثوانٍ وتعيد تحميل الجدولة عند تغيره.
+    """
+    version = models.PositiveIntegerField(default=0, verbose_name='الإصدار')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')
+
+    class Meta:
+        verbose_name = 'إصدار الجدولة'
+        verbose_name_plural = 'إصدار الجدولة'
+
+    def __str__(self):
+        return f"v{self.version}"
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        """زيادة الإصدار ذرياً"""
+        updated = cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class OutboxMessage(models.Model):
+    """رسالة تليغرام في صندوق الصادر (انظر outbox.py)
+
+    تُكتب في نفس معاملة التغيير (التبديل، التأكيد...) ويرسلها عامل منفصل على
+    قائمة notifications مع إعادة المحاولة والتأخير المتزايد. سجل EarlyNotification
+    المرتبط يُكتب فقط بعد تأكيد الإرسال.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'بانتظار الإرسال'),
+        ('sent', 'أُرسلت'),
+        ('dead', 'فشلت نهائياً'),
+    ]
+
+    CATEGORY_CHOICES = [
+        ('rotation', 'تبديل'),
+        ('final', 'إشعار نهائي'),
+        ('reminder', 'تذكير'),
+        ('supervisor', 'تنبيه المشرفين'),
+        ('confirmation', 'تأكيد التبديل'),
+        ('custom', 'إشعار مخصص'),
+        ('system', 'النظام'),
+    ]
+
+    chat_id = models.CharField(max_length=50, verbose_name='معرف المحادثة')
+    text = models.TextField(verbose_name='نص الرسالة')
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, default='system', verbose_name='النوع')
+    assignment = models.ForeignKey(
+        EmployeeAssignment, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='outbox_messages', verbose_name='التبديل'
+    )
+    notification_type = models.CharField(max_length=20, blank=True, default='', verbose_name='نوع الإشعار')
+    notification_stage = models.CharField(max_length=30, blank=True, default='', verbose_name='مرحلة الإشعار')
+    minutes_before = models.IntegerField(null=True, blank=True, verbose_name='الدقائق المتبقية')
+    broadcast = models.ForeignKey(
+        CustomNotification, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='deliveries', verbose_name='الإشعار المخصص'
+    )
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True, unique=True, verbose_name='مفتاح منع التكرار')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name='الحالة')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='عدد المحاولات')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='المحاولة القادمة')
+    last_error = models.TextField(blank=True, default='', verbose_name='آخر خطأ')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='وقت الإنشاء')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='وقت الإرسال')
+
+    class Meta:
+        verbose_name = 'رسالة صادرة'
+        verbose_name_plural = 'صندوق الصادر'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+            models.Index(fields=['assignment', 'notification_stage'], name='outbox_assignment_stage_idx'),
+            models.Index(fields=['chat_id', 'status'], name='outbox_chat_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_category_display()} → {self.chat_id} ({self.get_status_display()})"
+
+
+class RateLimitBucket(models.Model):
+    """دلو رموز لحد إرسال تليغرام في قاعدة البيانات عند تعذر الوصول إلى Redis (انظر ratelimit.py)"""
+    name = models.CharField(max_length=200, unique=True, verbose_name='اسم الدلو')
+    tokens = models.FloatField(default=0.0, verbose_name='الرموز المتاحة')
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name='آخر تحديث')
+    blocked_until = models.DateTimeField(null=True, blank=True, verbose_name='محظور حتى')
+
+    class Meta:
+        verbose_name = 'حد إرسال'
+        verbose_name_plural = 'حدود الإرسال'
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.2f}"
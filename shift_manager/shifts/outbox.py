@@ -0,0 +1,273 @@
+"""صندوق صادر لرسائل تليغرام (Transactional Outbox)
+
+سابقاً كانت الرسائل تُرسل مباشرة داخل rotate_within_shift و
+check_and_send_early_notifications وواجهات التأكيد، فبطء تليغرام يوقف التبديل أو
+طلب HTTP، والفشل يُطبع فقط ويُسجل EarlyNotification كأن الرسالة وصلت.
+
+الآن:
+- enqueue() تكتب الرسائل في OutboxMessage داخل نفس معاملة التغيير، وبعد نجاح
+  المعاملة (transaction.on_commit) تُطلب مهمة الإرسال على قائمة notifications
+- deliver_due_messages() يستدعيها عامل منفصل: يرسل الرسائل المستحقة بالترتيب لكل
+  محادثة، ويعيد المحاولة بتأخير متزايد، ويحوّل الرسالة إلى dead بعد MAX_ATTEMPTS
+  أو عند خطأ دائم (محادثة غير موجودة / البوت محظور)
+- منع التكرار من بتات EmployeeAssignment.notification_flags (تُحدَّث عند الكتابة هنا)،
+  وسجل EarlyNotification اختياري للتدقيق (NOTIFICATION_AUDIT_LOG) ويُكتب فقط بعد
+  تأكيد الإرسال
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import CustomNotification, EarlyNotification, OutboxMessage
+
+
+DELIVERY_QUEUE = 'notifications'
+
+# عدد الرسائل المقروءة في كل دورة إرسال
+DELIVERY_BATCH_SIZE = 200
+
+# إعادة المحاولة: 30 ث، 1 د، 2 د، 4 د، 8 د ... بحد أقصى 30 دقيقة
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 30 * 60
+MAX_ATTEMPTS = 6
+
+
+def outbox_message(chat_id, text, category='system', assignment=None, notification_type='',
+                   notification_stage='', minutes_before=None, dedupe_key=None, broadcast=None):
+    """رسالة صادرة غير محفوظة (تُحفظ دفعة واحدة عبر enqueue)"""
+    return OutboxMessage(
+        chat_id=str(chat_id),
+        text=text,
+        category=category,
+        assignment=assignment,
+        notification_type=notification_type,
+        notification_stage=notification_stage,
+        minutes_before=minutes_before,
+        dedupe_key=dedupe_key,
+        broadcast=broadcast,
+    )
+
+
+def notification_dedupe_key(assignment, notification_type, notification_stage, chat_id):
+    """مفتاح يمنع تكرار نفس الإشعار لنفس المحادثة (التذكيرات تتكرر عمداً فلا مفتاح لها)"""
+    if notification_stage == 'reminder':
+        return None
+    return f"{assignment.pk}:{notification_type}:{notification_stage}:{chat_id}"
+
+
+def enqueue(messages):
+    """حفظ الرسائل في صندوق الصادر وطلب الإرسال بعد نجاح المعاملة الحالية
+
+    الرسائل بنفس dedupe_key الموجود مسبقاً تُتجاهل (تُستبعد قبل الحفظ، و
+    ignore_conflicts يحمي من كتابة متزامنة لنفس المفتاح).
+
+    Returns:
+        عدد الرسائل الجديدة المكتوبة (قد يزيد عن الفعلي فقط عند سباق مع معاملة متزامنة)
+    """
+    messages = [message for message in messages if message.chat_id and message.chat_id != 'None']
+    keys = {message.dedupe_key for message in messages if message.dedupe_key}
+    if keys:
+        existing = set(OutboxMessage.objects.filter(dedupe_key__in=keys).values_list('dedupe_key', flat=True))
+        seen = set()
+        unique = []
+        for message in messages:
+            if message.dedupe_key:
+                if message.dedupe_key in existing or message.dedupe_key in seen:
+                    continue
+                seen.add(message.dedupe_key)
+            unique.append(message)
+        messages = unique
+    if not messages:
+        return 0
+    OutboxMessage.objects.bulk_create(messages, ignore_conflicts=True)
+    schedule_delivery()
+    return len(messages)
+
+
+def notification_messages(assignment, notification_type, notification_stage, recipients,
+                          minutes_before=0, category='rotation'):
+    """رسائل إشعار مرتبط بتبديل لعدة مستلمين [(chat_id, text), ...] (تُحفظ عبر enqueue)
+
+    المستدعي يسجل الإشعار بـ EmployeeAssignment.mark_notified حتى بدون مستلمين
+    (لا يتكرر الفحص ولا يتوقف تحديث الساعات المرتبط بالإشعار النهائي).
+    """
+    return [
+        outbox_message(
+            chat_id, text, category=category, assignment=assignment,
+            notification_type=notification_type, notification_stage=notification_stage,
+            minutes_before=minutes_before,
+            dedupe_key=notification_dedupe_key(assignment, notification_type, notification_stage, chat_id),
+        )
+        for chat_id, text in recipients if chat_id
+    ]
+
+
+def enqueue_texts(messages, category='system'):
+    """رسائل غير مرتبطة بتبديل [(chat_id, text), ...]"""
+    return enqueue(outbox_message(chat_id, text, category=category) for chat_id, text in messages if chat_id)
+
+
+def schedule_delivery():
+    """طلب مهمة الإرسال بعد نجاح المعاملة (وإلا تلتقطها المهمة الدورية deliver-outbox)"""
+    def trigger():
+        from .tasks import deliver_outbox_task
+        try:
+            deliver_outbox_task.apply_async(queue=DELIVERY_QUEUE, retry=False)
+        except Exception as e:
+            print(f"⚠️ تعذر طلب مهمة إرسال الرسائل: {e} - ستُرسل في الدورة القادمة")
+
+    transaction.on_commit(trigger)
+
+
+def backoff_delay(attempts, retry_after=None):
+    """التأخير قبل المحاولة القادمة (تأخير متزايد، ولا يقل عن retry_after من تليغرام)"""
+    delay = min(BASE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+    return timedelta(seconds=max(delay, retry_after or 0))
+
+
+def due_messages(now, batch_size=DELIVERY_BATCH_SIZE):
+    """الرسائل المستحقة بترتيب الإنشاء مع الحفاظ على ترتيب كل محادثة
+
+    الفلترة على next_attempt_at تتم في الاستعلام قبل القص، حتى لا تملأ رسائل
+    محادثات متوقفة (تنتظر إعادة المحاولة) الدفعة وتحجب باقي المحادثات. الرسالة
+    التي تسبقها في نفس المحادثة رسالة تنتظر إعادة المحاولة لا تُرسل قبلها (الرسائل
+    المستحقة السابقة تأتي قبلها في نفس الدفعة).
+    """
+    earlier_waiting = OutboxMessage.objects.filter(
+        status='pending', chat_id=OuterRef('chat_id'), id__lt=OuterRef('id'), next_attempt_at__gt=now
+    )
+    return list(
+        OutboxMessage.objects.filter(status='pending', next_attempt_at__lte=now)
+        .exclude(Exists(earlier_waiting))
+        .order_by('id')[:batch_size]
+    )
+
+
+def deliver_due_messages(now=None, batch_size=DELIVERY_BATCH_SIZE):
+    """إرسال دفعة من الرسائل المستحقة (يستدعيها deliver_outbox_task)
+
+    Returns:
+        {'sent': ..., 'retried': ..., 'dead': ...}
+    """
+    from .utils import BOT_TOKEN
+    from .telegram import get_telegram_client
+
+    stats = {'sent': 0, 'retried': 0, 'dead': 0}
+    due = due_messages(now or timezone.now(), batch_size)
+    if not due:
+        return stats
+
+    results = get_telegram_client(BOT_TOKEN).deliver_many(
+        [(message.chat_id, message.text) for message in due], stop_on_failure=True
+    )
+
+    finished_at = timezone.now()
+    delivered = []
+    attempted = []
+    finished = []
+    for message, result in zip(due, results):
+        if result is None:
+            continue  # لم تُرسل لأن رسالة سابقة لنفس المحادثة فشلت
+        message.attempts += 1
+        attempted.append(message)
+        if result.ok:
+            message.status = 'sent'
+            message.sent_at = finished_at
+            message.last_error = ''
+            delivered.append(message)
+            finished.append(message)
+            stats['sent'] += 1
+        elif result.permanent or message.attempts >= MAX_ATTEMPTS:
+            message.status = 'dead'
+            message.last_error = f"{result.status_code or ''} {result.error}".strip()
+            finished.append(message)
+            stats['dead'] += 1
+            print(f"💀 فشل إرسال الرسالة {message.pk} نهائياً للـ chat_id {message.chat_id}: {message.last_error}")
+        else:
+            message.next_attempt_at = finished_at + backoff_delay(message.attempts, result.retry_after)
+            message.last_error = f"{result.status_code or ''} {result.error}".strip()
+            stats['retried'] += 1
+
+    with transaction.atomic():
+        OutboxMessage.objects.bulk_update(
+            attempted, ['status', 'attempts', 'sent_at', 'next_attempt_at', 'last_error']
+        )
+        record_broadcast_progress(finished)
+        if settings.NOTIFICATION_AUDIT_LOG:
+            record_delivered_notifications(delivered)
+
+    print(f"📬 صندوق الصادر: أُرسلت {stats['sent']}، إعادة محاولة {stats['retried']}، فشل نهائي {stats['dead']}")
+    return stats
+
+
+def record_broadcast_progress(messages):
+    """تحديث عدادات الإشعارات المخصصة (sent/failed) للرسائل التي انتهى إرسالها
+
+    العدادات تُزاد بـ F() فلا تتعارض مع عامل آخر، والإشعار يكتمل عندما تنتهي
+    رسائل جميع مستلميه.
+    """
+    sent = Counter(message.broadcast_id for message in messages if message.broadcast_id and message.status == 'sent')
+    failed = Counter(message.broadcast_id for message in messages if message.broadcast_id and message.status == 'dead')
+    broadcast_ids = set(sent) | set(failed)
+    if not broadcast_ids:
+        return
+    for broadcast_id in broadcast_ids:
+        CustomNotification.objects.filter(pk=broadcast_id).update(
+            total_sent=F('total_sent') + sent[broadcast_id],
+            failed_count=F('failed_count') + failed[broadcast_id],
+        )
+    complete_broadcasts(broadcast_ids)
+
+
+def complete_broadcasts(broadcast_ids):
+    """تحويل الإشعارات التي جُهزت كل رسائلها وانتهى إرسالها إلى completed"""
+    CustomNotification.objects.filter(pk__in=broadcast_ids, status='sending').alias(
+        finished=F('total_sent') + F('failed_count')
+    ).filter(finished__gte=F('total_recipients')).update(status='completed')
+
+
+def record_delivered_notifications(messages):
+    """كتابة EarlyNotification (سجل تدقيق) للإشعارات التي تأكد إرسالها
+
+    إشعار الإدارة يُرسل لعدة مشرفين ويُسجل مرة واحدة، والتذكيرات تُسجل كل مرة.
+    """
+    notifications = {}
+    for message in messages:
+        if not message.assignment_id or not message.notification_stage:
+            continue
+        key = (message.assignment_id, message.notification_type, message.notification_stage)
+        if message.notification_stage == 'reminder':
+            key += (message.pk,)
+        notifications.setdefault(key, message)
+    if not notifications:
+        return
+
+    existing_filter = Q()
+    for message in notifications.values():
+        if message.notification_stage != 'reminder':
+            existing_filter |= Q(
+                assignment_id=message.assignment_id,
+                notification_type=message.notification_type,
+                notification_stage=message.notification_stage,
+            )
+    existing = set()
+    if existing_filter:
+        existing = set(EarlyNotification.objects.filter(existing_filter).values_list(
+            'assignment_id', 'notification_type', 'notification_stage'
+        ))
+
+    EarlyNotification.objects.bulk_create([
+        EarlyNotification(
+            assignment_id=message.assignment_id,
+            notification_type=message.notification_type,
+            notification_stage=message.notification_stage,
+            minutes_before=message.minutes_before or 0,
+        )
+        for key, message in notifications.items()
+        if key[:3] not in existing
+    ])
+
@@ -0,0 +1,268 @@
+"""حد إرسال مشترك لرسائل تليغرام بين جميع العمليات (Token Bucket)
+
+تليغرام يسمح بحوالي 30 رسالة/ثانية للبوت ورسالة/ثانية لكل محادثة. سابقاً كان كل
+عميل (عملية ويب، عامل Celery) يتباعد محلياً فقط، فعمليتان معاً تتجاوزان الحد
+وتصلهما 429 (Too Many Requests).
+
+الآن كل رسالة تأخذ رمزاً من دلوين مشتركين: الدلو العام ودلو المحادثة:
+- Redis: سكربت Lua واحد يفحص الدلوين ويستهلك منهما معاً (ذري بين العمليات)
+- عند تعذر Redis: صفوف RateLimitBucket في قاعدة البيانات (select_for_update)
+- عند تعذر الاثنين: دلو محلي في العملية (كما كان سابقاً)
+
+retry_after من تليغرام يُحترم بحظر دلو المحادثة (block) للمدة المطلوبة، فلا ترسل
+أي عملية لنفس المحادثة قبل انتهائها.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+import redis
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .locks import get_redis_client
+
+
+BUCKET_PREFIX = 'shift_manager:ratelimit:'
+
+# الدلو العام: متوسط الرسائل في الثانية وأقصى دفعة فورية (أقل قليلاً من حد تليغرام)
+GLOBAL_RATE = 25
+GLOBAL_CAPACITY = 25
+
+# دلو المحادثة: رسالة في الثانية بلا دفعات
+CHAT_RATE = 1
+CHAT_CAPACITY = 1
+
+# بعد فشل Redis لا نحاول الاتصال به مع كل رسالة
+REDIS_RETRY_SECONDS = 30
+
+# مدة بقاء مفاتيح الدلاء في Redis بعد آخر استخدام (الدلو الممتلئ لا يحتاج حالة)
+BUCKET_TTL_MS = 60 * 1000
+
+# KEYS: الدلو العام، دلو المحادثة، حظر عام، حظر المحادثة
+# ARGV: الآن (ms)، معدل العام، سعة العام، معدل المحادثة، سعة المحادثة، مدة بقاء المفاتيح (ms)
+# يُرجع 0 عند أخذ الرمز، أو مدة الانتظار بالميلي ثانية
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local blocked = math.max(redis.call('PTTL', KEYS[3]), redis.call('PTTL', KEYS[4]))
+if blocked > 0 then
+    return blocked
+end
+
+local function level(key, rate, capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, tokens + math.max(now - ts, 0) * rate / 1000)
+end
+
+local global_rate, global_capacity = tonumber(ARGV[2]), tonumber(ARGV[3])
+local chat_rate, chat_capacity = tonumber(ARGV[4]), tonumber(ARGV[5])
+local global_tokens = level(KEYS[1], global_rate, global_capacity)
+local chat_tokens = level(KEYS[2], chat_rate, chat_capacity)
+
+local wait = 0
+if global_tokens < 1 then
+    wait = math.max(wait, math.ceil((1 - global_tokens) * 1000 / global_rate))
+end
+if chat_tokens < 1 then
+    wait = math.max(wait, math.ceil((1 - chat_tokens) * 1000 / chat_rate))
+end
+if wait > 0 then
+    return wait
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(global_tokens - 1), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+redis.call('HSET', KEYS[2], 'tokens', tostring(chat_tokens - 1), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[2], ARGV[6])
+return 0
+"""
+
+
+def refill(tokens, elapsed_seconds, rate, capacity):
+    """رموز الدلو بعد مرور elapsed_seconds"""
+    return min(capacity, tokens + max(elapsed_seconds, 0) * rate)
+
+
+def wait_for(tokens, rate):
+    """الثواني حتى يتوفر رمز واحد"""
+    return 0.0 if tokens >= 1 else (1 - tokens) / rate
+
+
+class RateLimiter:
+    """دلو عام + دلو لكل محادثة مشتركان بين العمليات"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, global_capacity=GLOBAL_CAPACITY,
+                 chat_rate=CHAT_RATE, chat_capacity=CHAT_CAPACITY):
+        self.global_rate = global_rate
+        self.global_capacity = global_capacity
+        self.chat_rate = chat_rate
+        self.chat_capacity = chat_capacity
+        self._script = None
+        self._redis_down_until = 0.0
+        self._local_lock = threading.Lock()
+        self._local = {}  # الاسم → (الرموز، آخر تحديث monotonic)
+        self._local_blocks = {}  # الاسم → محظور حتى (monotonic)
+
+    def _limits(self, name):
+        if name == 'global':
+            return self.global_rate, self.global_capacity
+        return self.chat_rate, self.chat_capacity
+
+    # ---------------------------------------------------------------- Redis
+
+    def _redis_available(self):
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e):
+        print(f"⚠️ تعذر الوصول إلى Redis لحد الإرسال: {e} - استخدام قاعدة البيانات")
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def _acquire_redis(self, chat_id):
+        if self._script is None:
+            self._script = get_redis_client().register_script(ACQUIRE_SCRIPT)
+        keys = [
+            f'{BUCKET_PREFIX}global',
+            f'{BUCKET_PREFIX}chat:{chat_id}',
+            f'{BUCKET_PREFIX}block:global',
+            f'{BUCKET_PREFIX}block:chat:{chat_id}',
+        ]
+        args = [
+            int(time.time() * 1000),
+            self.global_rate, self.global_capacity,
+            self.chat_rate, self.chat_capacity,
+            BUCKET_TTL_MS,
+        ]
+        return int(self._script(keys=keys, args=args)) / 1000
+
+    # ------------------------------------------------------ قاعدة البيانات
+
+    def _acquire_db(self, chat_id):
+        from .models import RateLimitBucket
+
+        names = ['global', f'chat:{chat_id}']
+        now = timezone.now()
+        RateLimitBucket.objects.bulk_create(
+            [RateLimitBucket(name=name, tokens=self._limits(name)[1], updated_at=now) for name in names],
+            ignore_conflicts=True,
+        )
+        with transaction.atomic():
+            buckets = list(RateLimitBucket.objects.select_for_update().filter(name__in=names))
+            blocked = max(
+                ((bucket.blocked_until - now).total_seconds() for bucket in buckets if bucket.blocked_until),
+                default=0,
+            )
+            if blocked > 0:
+                return blocked
+
+            levels = {}
+            for bucket in buckets:
+                rate, capacity = self._limits(bucket.name)
+                levels[bucket] = refill(bucket.tokens, (now - bucket.updated_at).total_seconds(), rate, capacity)
+            wait = max(wait_for(tokens, self._limits(bucket.name)[0]) for bucket, tokens in levels.items())
+            if wait > 0:
+                return wait
+
+            for bucket, tokens in levels.items():
+                bucket.tokens = tokens - 1
+                bucket.updated_at = now
+            RateLimitBucket.objects.bulk_update(list(levels), ['tokens', 'updated_at'])
+        return 0.0
+
+    # ---------------------------------------------------------------- محلي
+
+    def _acquire_local(self, chat_id):
+        names = ['global', f'chat:{chat_id}']
+        with self._local_lock:
+            now = time.monotonic()
+            blocked = max(self._local_blocks.get(name, 0) - now for name in names)
+            if blocked > 0:
+                return blocked
+            levels = {}
+            for name in names:
+                rate, capacity = self._limits(name)
+                tokens, updated = self._local.get(name, (capacity, now))
+                levels[name] = refill(tokens, now - updated, rate, capacity)
+            wait = max(wait_for(tokens, self._limits(name)[0]) for name, tokens in levels.items())
+            if wait > 0:
+                return wait
+            for name, tokens in levels.items():
+                self._local[name] = (tokens - 1, now)
+        return 0.0
+
+    # -------------------------------------------------------------- الواجهة
+
+    def acquire(self, chat_id):
+        """محاولة أخذ رمز لرسالة واحدة إلى chat_id
+
+        Returns:
+            0 عند النجاح، أو عدد الثواني المطلوب انتظارها قبل المحاولة مجدداً
+        """
+        if self._redis_available():
+            try:
+                return self._acquire_redis(chat_id)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        try:
+            return self._acquire_db(chat_id)
+        except DatabaseError as e:
+            print(f"⚠️ تعذر استخدام قاعدة البيانات لحد الإرسال: {e} - استخدام حد محلي")
+            return self._acquire_local(chat_id)
+
+    def wait(self, chat_id, max_wait=None):
+        """الانتظار حتى يتوفر رمز للمحادثة
+
+        Returns:
+            0 عند أخذ الرمز، أو مدة الانتظار المتبقية إذا تجاوزت max_wait (بدون أخذ رمز)
+        """
+        while True:
+            wait = self.acquire(chat_id)
+            if wait <= 0:
+                return 0
+            if max_wait is not None and wait > max_wait:
+                return wait
+            time.sleep(wait)
+
+    def block(self, chat_id, seconds):
+        """حظر المحادثة seconds ثانية (retry_after من تليغرام) لجميع العمليات"""
+        seconds = max(float(seconds), 0)
+        if not seconds:
+            return
+        if self._redis_available():
+            try:
+                get_redis_client().set(
+                    f'{BUCKET_PREFIX}block:chat:{chat_id}', 1, px=math.ceil(seconds * 1000)
+                )
+                return
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        try:
+            from .models import RateLimitBucket
+
+            RateLimitBucket.objects.update_or_create(
+                name=f'chat:{chat_id}',
+                defaults={'blocked_until': timezone.now() + timedelta(seconds=seconds)},
+            )
+        except DatabaseError as e:
+            print(f"⚠️ تعذر حفظ حظر المحادثة {chat_id}: {e} - حظر محلي")
+            with self._local_lock:
+                self._local_blocks[f'chat:{chat_id}'] = time.monotonic() + seconds
+
+    def close(self):
+        """إغلاق اتصال قاعدة البيانات للخيط الحالي (خيوط الإرسال المتوازي)"""
+        connection.close()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """حد الإرسال المشترك لهذه العملية"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
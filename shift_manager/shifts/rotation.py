@@ -0,0 +1,424 @@
+"""محرك تخطيط التبديل (Rotation Planner)
+
+منطق نقي بالكامل: لا يلمس قاعدة البيانات ولا يرسل إشعارات.
+يأخذ لقطات مضغوطة للموظفين والسونارات وسجل السونارات السابقة،
+ويُرجع خطة تبديل ثابتة (RotationPlan) يتولى تطبيقها كود منفصل في utils.py.
+
+هذا الفصل يسمح بـ:
+- تشغيل المخطط آلاف المرات في الثانية للمحاكاة وقياس الأداء
+- إعادة استخدام نفس الخطة بين الإشعار المبكر والتبديل الفعلي
+- تخطيط الشفت كاملاً مسبقاً (plan_shift)
+"""
+import heapq
+import random
+import time
+from dataclasses import dataclass, replace
+
+from .scoring import priority_order, priority_scores
+
+
+# الحد الأعلى لعمل المطابقة المثلى (عدد المعادين × العاملين × السونارات)، بعده يُستخدم توزيع جشع
+ASSIGN_SONARS_MAX_WORK = 2_000_000
+
+@dataclass(frozen=True)
+class RosterEntry:
+    """لقطة لموظف متاح للتبديل (نسخة خفيفة من Employee)"""
+    employee_id: int
+    name: str
+    total_work_hours: float = 0.0
+    last_work_datetime: object = None
+    consecutive_rest_count: int = 0
+
+    @classmethod
+    def from_employee(cls, employee):
+        return cls(
+            employee_id=employee.id,
+            name=employee.name,
+            total_work_hours=employee.total_work_hours,
+            last_work_datetime=employee.last_work_datetime,
+            consecutive_rest_count=employee.consecutive_rest_count,
+        )
+
+
+@dataclass(frozen=True)
+class SonarEntry:
+    """لقطة لسونار نشط مع سعته"""
+    sonar_id: int
+    name: str
+    max_employees: int = 1
+
+    @classmethod
+    def from_sonar(cls, sonar):
+        return cls(sonar_id=sonar.id, name=sonar.name, max_employees=sonar.max_employees)
+
+
+@dataclass(frozen=True)
+class RotationPlan:
+    """خطة تبديل ثابتة لفترة رسمية واحدة
+
+    work_slots: أزواج (employee_id, sonar_id) للعاملين
+    standby: معرّفات الموظفين في الاحتياط
+    hour_deltas: أزواج (employee_id, ساعات) تُضاف لإجمالي ساعات العاملين
+    priority: أزواج (employee_id, نقاط الأولوية) مرتبة من الأعلى أولوية للأقل
+    """
+    rotation_start: object
+    rotation_hours: float
+    work_slots: tuple = ()
+    standby: tuple = ()
+    hour_deltas: tuple = ()
+    priority: tuple = ()
+
+    @property
+    def working_ids(self):
+        return tuple(employee_id for employee_id, _ in self.work_slots)
+
+    def sonar_for(self, employee_id):
+        """السونار المخصص لموظف في هذه الخطة (None للاحتياط أو غير الموجود)"""
+        for slot_employee_id, sonar_id in self.work_slots:
+            if slot_employee_id == employee_id:
+                return sonar_id
+        return None
+
+    def apply(self, roster):
+        """إرجاع لقطة جديدة للموظفين بعد تطبيق الخطة (بدون تعديل المدخلات)
+
+        تُستخدم لتخطيط عدة فترات متتالية في الذاكرة.
+        """
+        deltas = dict(self.hour_deltas)
+        standby = set(self.standby)
+        updated = []
+        for entry in roster:
+            if entry.employee_id in deltas:
+                entry = replace(
+                    entry,
+                    total_work_hours=entry.total_work_hours + deltas[entry.employee_id],
+                    last_work_datetime=self.rotation_start,
+                    consecutive_rest_count=0,
+                )
+            elif entry.employee_id in standby:
+                entry = replace(entry, consecutive_rest_count=entry.consecutive_rest_count + 1)
+            updated.append(entry)
+        return tuple(updated)
+
+
+def plan_rotation(roster, sonars, rotation_start, rotation_hours, now=None, recent_sonars=None, rng=None, timings=None):
+    """تخطيط تبديل واحد بالكامل في الذاكرة
+
+    Args:
+        roster: قائمة RosterEntry للموظفين المتاحين (غير المجازين)
+        sonars: قائمة SonarEntry للسونارات النشطة
+        rotation_start: بداية الفترة الرسمية
+        rotation_hours: مدة الفترة بالساعات
+        now: الوقت المرجعي لحساب الأولوية (افتراضياً rotation_start)
+        recent_sonars: قاموس employee_id → sonar_id (أو قائمة سونارات من الأحدث للأقدم)
+            من التبديلات السابقة (لتجنب التكرار)
+        rng: مولد أرقام عشوائية (random.Random) لخلط السونارات
+        timings: قاموس اختياري يُضاف إليه زمن مرحلتي scoring و assignment بالثواني
+
+    Returns:
+        RotationPlan
+    """
+    now = now or rotation_start
+    rng = rng or random
+
+    roster = list(roster)
+    if not roster or not sonars:
+        return RotationPlan(rotation_start=rotation_start, rotation_hours=rotation_hours)
+
+    started = time.perf_counter()
+
+    # 🎯 ترتيب الموظفين حسب الأولوية (الأقل نقاطاً = الأعلى أولوية للعمل)
+    scores = priority_scores(roster, now=now)
+    scored = [(roster[index], float(scores[index])) for index in priority_order(scores)]
+
+    total_available_slots = sum(sonar.max_employees for sonar in sonars)
+    working = [entry for entry, _ in scored[:total_available_slots]]
+    standby = [entry for entry, _ in scored[total_available_slots:]]
+
+    scored_at = time.perf_counter()
+
+    # خلط السونارات لتوزيع عشوائي عادل
+    shuffled_sonars = list(sonars)
+    rng.shuffle(shuffled_sonars)
+
+    # 🔒 توزيع العاملين على السونارات بأقل تكلفة (تجنب تكرار السونارات الأخيرة)
+    work_slots = assign_sonars(
+        [entry.employee_id for entry in working],
+        shuffled_sonars,
+        recent_sonars,
+    )
+
+    if timings is not None:
+        timings['scoring'] = timings.get('scoring', 0.0) + scored_at - started
+        timings['assignment'] = timings.get('assignment', 0.0) + time.perf_counter() - scored_at
+
+    return RotationPlan(
+        rotation_start=rotation_start,
+        rotation_hours=rotation_hours,
+        work_slots=tuple(work_slots),
+        standby=tuple(entry.employee_id for entry in standby),
+        hour_deltas=tuple((employee_id, rotation_hours) for employee_id, _ in work_slots),
+        priority=tuple((entry.employee_id, score) for entry, score in scored),
+    )
+
+
+def plan_shift(roster, sonars, period_starts, rotation_hours, shift_end, recent_sonars=None, history_depth=3, rng=None):
+    """تخطيط جميع فترات الشفت دفعة واحدة (Lookahead)
+
+    كل فترة تُخطط على الحالة المتوقعة بعد الفترات السابقة (الساعات، آخر عمل،
+    عداد الراحة، وسجل السونارات)، فتتوزع الساعات على الشفت كاملاً بدلاً من
+    قرار منفصل لكل فترة على بيانات قديمة. مدة آخر فترة لا تتجاوز نهاية الشفت.
+
+    Args:
+        roster: قائمة RosterEntry
+        sonars: قائمة SonarEntry
+        period_starts: أوقات بداية الفترات بالترتيب
+        rotation_hours: مدة الفترة بالساعات
+        shift_end: نهاية الشفت
+        recent_sonars: سجل السونارات الحالي (employee_id → tuple من الأحدث للأقدم)
+        history_depth: عدد السونارات المحفوظة في السجل المتوقع
+
+    Returns:
+        قائمة RotationPlan بنفس ترتيب period_starts
+    """
+    roster = tuple(roster)
+    recent = {
+        employee_id: history if isinstance(history, tuple) else (history,)
+        for employee_id, history in (recent_sonars or {}).items()
+    }
+    plans = []
+    for period_start in period_starts:
+        hours = min(rotation_hours, (shift_end - period_start).total_seconds() / 3600)
+        if hours <= 0:
+            break
+        plan = plan_rotation(roster, sonars, period_start, hours, recent_sonars=recent, rng=rng)
+        plans.append(plan)
+
+        # تحديث الحالة المتوقعة للفترة التالية
+        roster = plan.apply(roster)
+        for employee_id, sonar_id in plan.work_slots:
+            recent[employee_id] = ((sonar_id,) + recent.get(employee_id, ()))[:history_depth]
+    return plans
+
+
+def assign_sonars(workers, sonars, recent_sonars=None):
+    """توزيع العاملين على خانات السونارات كمسألة مطابقة بأقل تكلفة (min-cost flow)
+
+    الخانات مرتبة حسب ترتيب السونارات المعطى (بعد الخلط)، والتوزيع "الطبيعي"
+    هو وضع صاحب الترتيب i في الخانة i. التكلفة لكل (موظف، سونار):
+    - غرامة تكرار سونار حديث للموظف (الأحدث أغلى)، وهي أكبر من أي مجموع
+      لتكاليف الترتيب، أي أن تقليل التكرار له الأولوية دائماً
+    - بُعد ترتيب الموظف عن خانات السونار (يحافظ على ترتيب الأولوية قدر الإمكان)
+
+    يبدأ الحل من التوزيع الطبيعي (تكلفته صفر) ثم يعيد توجيه أصحاب التكرار فقط
+    عبر أقصر مسارات (Dijkstra مع potentials)، لذلك يكون سريعاً عندما يكون التكرار قليلاً.
+
+    التعقيد: O(F × W × M) حيث F عدد العاملين الذين تتكرر خانتهم الطبيعية، أي O(W³)
+    في أسوأ حالة (كل خانة تتكرر وسعة كل سونار 1؛ 300 موظف ≈ 5 ثوانٍ). إذا تجاوز
+    F × W × M قيمة ASSIGN_SONARS_MAX_WORK يُوزَّع المعادون بطريقة جشعة: كل واحد
+    (بترتيب الأولوية) لأرخص سونار بقيت فيه سعة. تجنب التكرار يبقى أولوية لكن
+    النتيجة لم تعد مضمونة المثالية.
+
+    Args:
+        workers: معرّفات الموظفين العاملين مرتبة حسب الأولوية
+        sonars: قائمة SonarEntry بترتيب الخانات
+        recent_sonars: قاموس employee_id → sonar_id أو قائمة سونارات (من الأحدث للأقدم)
+
+    Returns:
+        قائمة أزواج (employee_id, sonar_id) بترتيب الخانات
+    """
+    recent_sonars = recent_sonars or {}
+    worker_count = len(workers)
+    sonar_count = len(sonars)
+    capacity = [sonar.max_employees for sonar in sonars]
+    slot_start = []
+    position = 0
+    for cap in capacity:
+        slot_start.append(position)
+        position += cap
+    if worker_count > position:
+        raise ValueError("عدد العاملين أكبر من عدد الخانات المتاحة")
+
+    # غرامة التكرار: أحدث سونار = depth وحدات، الأقدم = وحدة واحدة
+    penalty_unit = worker_count * position + 1
+    sonar_index = {sonar.sonar_id: j for j, sonar in enumerate(sonars)}
+    penalties = []
+    for employee_id in workers:
+        history = recent_sonars.get(employee_id)
+        if history is None:
+            history = ()
+        elif not isinstance(history, (list, tuple)):
+            history = (history,)
+        depth = len(history)
+        worker_penalty = {}
+        for age, sonar_id in enumerate(history):
+            j = sonar_index.get(sonar_id)
+            if j is not None and j not in worker_penalty:
+                worker_penalty[j] = (depth - age) * penalty_unit
+        penalties.append(worker_penalty)
+
+    # مصفوفة التكاليف تُحسب مرة واحدة (W × M)
+    costs = []
+    for i in range(worker_count):
+        row = []
+        for j in range(sonar_count):
+            start, end = slot_start[j], slot_start[j] + capacity[j] - 1
+            distance = start - i if i < start else (i - end if i > end else 0)
+            row.append(distance + penalties[i].get(j, 0))
+        costs.append(row)
+
+    # التوزيع الطبيعي: الموظف i في السونار الذي يحتوي الخانة i
+    natural = []
+    for j, cap in enumerate(capacity):
+        natural.extend([j] * cap)
+    assigned = [None] * worker_count
+    load = [0] * sonar_count
+    members = [set() for _ in range(sonar_count)]
+    free = []
+    for i in range(worker_count):
+        j = natural[i]
+        if penalties[i].get(j):
+            free.append(i)
+        else:
+            assigned[i] = j
+            load[j] += 1
+            members[j].add(i)
+
+    # العقد: 0..W-1 موظفون، W..W+M-1 سونارات، W+M المصرف (sink)
+    # التوزيع الجزئي بتكلفة صفر أمثل لحجمه، لذا potentials = 0 صالحة كبداية
+    sink = worker_count + sonar_count
+    potential = [0] * (sink + 1)
+    infinity = float('inf')
+
+    if len(free) * worker_count * sonar_count > ASSIGN_SONARS_MAX_WORK:
+        print(f"⚠️ {len(free)} موظف يتكرر سونارهم من {worker_count} - توزيع جشع بدل المطابقة المثلى")
+        for i in free:
+            j = min(
+                (j for j in range(sonar_count) if load[j] < capacity[j]),
+                key=lambda j: costs[i][j],
+            )
+            assigned[i] = j
+            load[j] += 1
+            members[j].add(i)
+        free = []
+
+    for _ in range(len(free)):
+        dist = [infinity] * (sink + 1)
+        previous = [None] * (sink + 1)
+        done = [False] * (sink + 1)
+        heap = []
+        for i in free:
+            if assigned[i] is None:
+                dist[i] = 0
+                heap.append((0, i))
+        heapq.heapify(heap)
+
+        while heap:
+            d, node = heapq.heappop(heap)
+            if done[node]:
+                continue
+            done[node] = True
+            if node == sink:
+                break
+            if node < worker_count:
+                # موظف → أي سونار آخر
+                base = d + potential[node]
+                current = assigned[node]
+                for j, edge_cost in enumerate(costs[node]):
+                    target = worker_count + j
+                    nd = base + edge_cost - potential[target]
+                    if nd < dist[target] and j != current:
+                        dist[target] = nd
+                        previous[target] = node
+                        heapq.heappush(heap, (nd, target))
+            else:
+                j = node - worker_count
+                base = d + potential[node]
+                # سونار → المصرف إذا بقيت سعة
+                if load[j] < capacity[j]:
+                    nd = base - potential[sink]
+                    if nd < dist[sink]:
+                        dist[sink] = nd
+                        previous[sink] = node
+                        heapq.heappush(heap, (nd, sink))
+                # سونار → موظف مخصص له (إزاحة الموظف لسونار آخر)
+                for i in members[j]:
+                    nd = base - costs[i][j] - potential[i]
+                    if nd < dist[i]:
+                        dist[i] = nd
+                        previous[i] = node
+                        heapq.heappush(heap, (nd, i))
+
+        sink_distance = dist[sink]
+        for node in range(sink + 1):
+            potential[node] += min(dist[node], sink_distance)
+
+        # تطبيق المسار: كل موظف على المسار ينتقل للسونار التالي
+        sonar_node = previous[sink]
+        load[sonar_node - worker_count] += 1
+        while True:
+            i = previous[sonar_node]
+            j = sonar_node - worker_count
+            old = assigned[i]
+            if old is not None:
+                members[old].discard(i)
+            assigned[i] = j
+            members[j].add(i)
+            if previous[i] is None:
+                break
+            sonar_node = previous[i]
+
+    slots = []
+    for j, sonar in enumerate(sonars):
+        for i in sorted(members[j]):
+            slots.append((workers[i], sonar.sonar_id))
+    return slots
+
+
+def plan_from_assignments(assignments, rotation_start, rotation_hours, roster_ids=None):
+    """إعادة بناء خطة من سجلات EmployeeAssignment محفوظة مسبقاً
+
+    تسمح للتبديل الفعلي بإعادة استخدام الخطة التي أُعلن عنها في الإشعار المبكر
+    بدلاً من إعادة حسابها (وبالتالي عدم تغيير السونار الذي أُبلغ به الموظف).
+
+    Args:
+        assignments: سجلات (أو كائنات) تحتوي employee_id و sonar_id و is_standby
+            (و work_duration_hours اختيارياً)
+        roster_ids: معرّفات الموظفين المتاحين حالياً؛ من ليس له سجل يُضاف للاحتياط
+
+    Returns:
+        RotationPlan أو None إذا لم تعد الخطة صالحة (موظف عامل لم يعد متاحاً)
+    """
+    work_slots = []
+    standby = []
+    hour_deltas = []
+    seen = set()
+    for assignment in assignments:
+        if assignment.employee_id in seen:
+            continue
+        seen.add(assignment.employee_id)
+        if assignment.is_standby or assignment.sonar_id is None:
+            standby.append(assignment.employee_id)
+        else:
+            work_slots.append((assignment.employee_id, assignment.sonar_id))
+            # مدة الفترة المحفوظة (قد تكون أقصر من rotation_hours في آخر الشفت)
+            hours = getattr(assignment, 'work_duration_hours', 0) or rotation_hours
+            hour_deltas.append((assignment.employee_id, hours))
+
+    if not work_slots and not standby:
+        return None
+
+    if roster_ids is not None:
+        roster_ids = set(roster_ids)
+        if any(employee_id not in roster_ids for employee_id, _ in work_slots):
+            return None
+        standby = [employee_id for employee_id in standby if employee_id in roster_ids]
+        standby.extend(sorted(roster_ids - seen))
+
+    return RotationPlan(
+        rotation_start=rotation_start,
+        rotation_hours=rotation_hours,
+        work_slots=tuple(work_slots),
+        standby=tuple(standby),
+        hour_deltas=tuple(hour_deltas),
+    )
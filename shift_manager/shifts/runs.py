@@ -0,0 +1,85 @@
+"""تسجيل تنفيذ التبديلات (RotationRun) مع زمن كل مرحلة وعدد الاستعلامات
+
+الاستخدام داخل rotate_within_shift:
+
+    with RotationRecorder(shift_name, trigger) as run:
+        with run.phase('roster_load'):
+            ...
+        run.set_counts(workers=..., standby=...)
+
+يُحفظ السجل عند الخروج حتى في حال حدوث استثناء (بحالة failed ثم يُعاد رفع الاستثناء).
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import RotationRun
+
+
+class RotationRecorder:
+    def __init__(self, shift_name, trigger='manual', site=None, is_early_notification=False):
+        self.run = RotationRun(
+            shift_name=shift_name,
+            site=site or '',
+            trigger=trigger,
+            is_early_notification=is_early_notification,
+        )
+        self.timings = {}
+        self.query_count = 0
+        self._started = None
+        self._query_wrapper = None
+
+    def __enter__(self):
+        self.run.started_at = timezone.now()
+        self._started = time.perf_counter()
+        self._query_wrapper = connection.execute_wrapper(self._count_query)
+        self._query_wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._query_wrapper.__exit__(exc_type, exc, tb)
+        self.run.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.run.phase_timings = {key: round(value, 2) for key, value in self.timings.items()}
+        self.run.query_count = self.query_count
+        if exc is not None:
+            self.run.status = 'failed'
+            self.run.error = f"{exc_type.__name__}: {exc}"
+        try:
+            self.run.save()
+        except DatabaseError as e:
+            print(f"⚠️ تعذر حفظ سجل التبديل: {e}")
+        return False
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.query_count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def phase(self, name):
+        """قياس زمن مرحلة (يُجمع إذا تكررت نفس المرحلة)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def add_timings(self, timings):
+        """إضافة أزمنة مقاسة خارجياً بالثواني (مثل plan_rotation)"""
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds * 1000
+
+    def set_target(self, shift, rotation_at):
+        self.run.shift = shift
+        self.run.rotation_at = rotation_at
+
+    def set_counts(self, workers=0, standby=0, notifications=0):
+        self.run.workers_count = workers
+        self.run.standby_count = standby
+        self.run.notifications_count = notifications
+
+    def skip(self, reason):
+        """تبديل لم يُنفذ (لا يوجد سونارات أو موظفون...)"""
+        self.run.status = 'skipped'
+        self.run.error = reason
@@ -0,0 +1,157 @@
+"""جدولة التبديل بمهام ETA دقيقة بدلاً من الفحص كل دقيقة
+
+بدلاً من تشغيل rotate_shifts_task كل دقيقة ليقرر أنه لا يوجد شيء لفعله،
+نحسب اللحظة القادمة التي تحتاج تنفيذاً (تبديل، إشعار مبكر، تذكير، إشعار نهاية الشفت)
+ونضع مهمة واحدة بـ apply_async(eta=...) لتلك اللحظة. المهمة نفسها تشغل
+check_and_send_early_notifications بعد التبديل، فلا حاجة لفحص دوري للإشعارات في beat.
+
+تُعاد الجدولة فقط عند:
+- انتهاء تنفيذ rotate_shifts_task (يجدول اللحظة التالية)
+- تغيير الإعدادات (تُلغى المهمة القديمة revoke وتُجدول من جديد)
+- المراقب rotation_watchdog_task إذا ضاعت المهمة المجدولة (إعادة تشغيل الـ broker مثلاً)
+"""
+from datetime import timedelta
+
+from celery import current_app
+from django.db.models import Min
+from django.utils import timezone
+
+from .locks import rotation_lock
+from .models import RotationTimelineEntry, SystemSettings
+from .shift_calendar import get_shift_calendar
+from .utils import REMINDER_INTERVAL_MINUTES, pending_reminders
+
+
+# إشعار نهاية الشفت في rotate_shifts_task (قبل حد الشفت بـ 10 دقائق)
+SHIFT_END_NOTICE_MINUTES = 10
+
+# تأخير بسيط بعد اللحظة المحسوبة حتى لا تعمل المهمة قبلها بسبب فرق الساعة بين الخوادم
+ETA_GRACE_SECONDS = 5
+
+# المهمة المجدولة تُعتبر ضائعة إذا تأخرت أكثر من هذا (نطاق rotate_shifts_task ±2 دقيقة)
+MISSED_AFTER = timedelta(minutes=2)
+
+
+def next_shift_end(now):
+    """أقرب نهاية شفت قادمة بعد now (None إذا لم توجد شفتات)"""
+    boundary = get_shift_calendar().next_boundary(now)
+    return boundary.at if boundary else None
+
+
+def next_reminder_due(now, lead_minutes):
+    """أقرب لحظة يستحق فيها تذكير (آخر إشعار أولي/تذكير + الفترة) أو None
+
+    تُحسب من last_reminder_at الفعلي وليس من أوقات الجدول الزمني، لأن الإشعار الأولي
+    قد يُسجل متأخراً ثوانٍ عن موعده فيسبق تذكيرُ الجدول شرطَ الفترة.
+    """
+    last_sent = pending_reminders(now, lead_minutes).aggregate(last=Min('last_reminder_at'))['last']
+    if last_sent is None:
+        return None
+    return last_sent + timedelta(minutes=REMINDER_INTERVAL_MINUTES)
+
+
+def next_wakeup(settings, now=None):
+    """اللحظة القادمة التي يجب أن يعمل فيها rotate_shifts_task
+
+    تُقرأ من الجدول الزمني (أقرب موعدين: التبديل والإشعار قبله). إذا كان الجدول
+    فارغاً: التبديل القادم والإشعار المبكر قبله، ونهاية الشفت القادمة والإشعار قبلها بـ 10 دقائق.
+    التذكير القادم المستحق (next_reminder_due) يُقدَّم إذا كان أقرب.
+    """
+    now = now or timezone.now()
+    lead_minutes = max(int(settings.early_notification_minutes or 10), 0)
+    wakeup = scheduled_event_wakeup(settings, now, lead_minutes)
+
+    reminder_at = next_reminder_due(now, lead_minutes)
+    if reminder_at and reminder_at > now:
+        return min(wakeup, reminder_at)
+    return wakeup
+
+
+def scheduled_event_wakeup(settings, now, lead_minutes):
+    """أقرب موعد تبديل أو إشعار بعد now من الجدول الزمني أو من الإعدادات"""
+    upcoming = RotationTimelineEntry.objects.filter(rotation_at__gt=now).order_by('rotation_at')[:2]
+    timeline_events = [
+        event_at
+        for entry in upcoming
+        for event_at in entry.event_times(lead_minutes)
+        if event_at > now
+    ]
+    if timeline_events:
+        return min(timeline_events)
+
+    lead = timedelta(minutes=lead_minutes)
+    shift_notice = timedelta(minutes=SHIFT_END_NOTICE_MINUTES)
+
+    next_rotation = settings.get_next_rotation_time()
+    candidates = [next_rotation, next_rotation - lead]
+    shift_end = next_shift_end(now)
+    if shift_end:
+        candidates += [shift_end, shift_end - shift_notice]
+    return min(candidate for candidate in candidates if candidate > now)
+
+
+def revoke_scheduled(task_id):
+    """إلغاء مهمة ETA سابقة (تجاهل الخطأ: المهمة المكررة آمنة بفضل القفل ومفتاح RotationCommit)"""
+    if not task_id:
+        return
+    try:
+        current_app.control.revoke(task_id)
+    except Exception as e:
+        print(f"⚠️ تعذر إلغاء مهمة التبديل المجدولة {task_id}: {e}")
+
+
+def schedule_next_rotation(replan=False, current_task_id=None):
+    """جدولة rotate_shifts_task عند اللحظة القادمة بالضبط
+
+    Args:
+        replan: إلغاء المهمة الحالية وإعادة الجدولة حتى لو كانت لنفس اللحظة (عند تغيير الإعدادات)
+        current_task_id: معرف المهمة الجارية (لا داعي لإلغائها)
+
+    Returns:
+        اللحظة المجدولة أو None إذا كان التبديل التلقائي معطلاً
+    """
+    from .tasks import rotate_shifts_task
+
+    with rotation_lock('rotation-scheduler', timeout=60) as acquired:
+        if not acquired:
+            print("⏸️ جدولة التبديل قيد التنفيذ من عامل آخر")
+            return None
+
+        settings = SystemSettings.get_current_settings()
+        previous_task_id = settings.scheduled_rotation_task_id
+        if previous_task_id == current_task_id:
+            previous_task_id = ''
+
+        if not settings.is_rotation_active:
+            revoke_scheduled(previous_task_id)
+            SystemSettings.objects.filter(pk=settings.pk).update(
+                scheduled_rotation_at=None, scheduled_rotation_task_id=''
+            )
+            print("🔕 التبديل التلقائي معطل - لا توجد مهمة مجدولة")
+            return None
+
+        wakeup = next_wakeup(settings)
+        if not replan and previous_task_id and settings.scheduled_rotation_at == wakeup:
+            return wakeup  # مجدولة مسبقاً لنفس اللحظة
+
+        revoke_scheduled(previous_task_id)
+        try:
+            result = rotate_shifts_task.apply_async(eta=wakeup + timedelta(seconds=ETA_GRACE_SECONDS))
+        except Exception as e:
+            # المراقب سيعيد المحاولة في دورته القادمة
+            print(f"❌ تعذر جدولة التبديل القادم: {e}")
+            return None
+
+        SystemSettings.objects.filter(pk=settings.pk).update(
+            scheduled_rotation_at=wakeup, scheduled_rotation_task_id=result.id
+        )
+        print(f"⏰ التشغيل القادم للتبديل: {timezone.localtime(wakeup).strftime('%Y-%m-%d %H:%M')}")
+        return wakeup
+
+
+def scheduled_rotation_missed(settings, now=None):
+    """هل فاتت اللحظة المجدولة بدون تنفيذ (أو لا توجد جدولة أصلاً)؟"""
+    now = now or timezone.now()
+    if not settings.scheduled_rotation_at:
+        return True
+    return settings.scheduled_rotation_at + MISSED_AFTER < now
@@ -0,0 +1,93 @@
+"""حساب نقاط أولوية الموظفين دفعة واحدة (Vectorized Priority Scoring)
+
+نقاط الأولوية: أقل = أولوية أعلى للعمل.
+يتم تحميل ساعات العمل وآخر وقت عمل وعدد مرات الراحة المتتالية في مصفوفات NumPy
+وحساب جميع النقاط والترتيب في عملية واحدة بدلاً من حلقة لكل موظف.
+
+تُستخدم من محرك التبديل (rotation.py) ولوحة المشرف.
+"""
+import numpy as np
+from django.utils import timezone
+
+
+# ⚖️ أوزان معادلة الأولوية
+HOURS_SINCE_WORK_WEIGHT = 0.1   # كل ساعة راحة = خصم 0.1 نقطة
+NEVER_WORKED_BONUS = 10.0       # لم يعمل أبداً → مكافأة صغيرة فقط
+CONSECUTIVE_REST_WEIGHT = 5.0   # كل مرة راحة متتالية = خصم 5 نقاط
+
+
+def priority_score(total_work_hours, last_work_datetime, consecutive_rest_count, avg_work_hours, now):
+    """حساب نقاط الأولوية لموظف واحد (نفس معادلة priority_scores)
+
+    يأخذ في الاعتبار:
+    1. الفرق عن المتوسط (أهم عامل)
+    2. الوقت منذ آخر عمل
+    3. عدد مرات الراحة المتتالية
+    """
+    score = total_work_hours - avg_work_hours
+    if last_work_datetime:
+        score -= (now - last_work_datetime).total_seconds() / 3600 * HOURS_SINCE_WORK_WEIGHT
+    else:
+        score -= NEVER_WORKED_BONUS
+    score -= consecutive_rest_count * CONSECUTIVE_REST_WEIGHT
+    return score
+
+
+def load_arrays(employees):
+    """تحويل قائمة موظفين (Employee أو RosterEntry) إلى مصفوفات NumPy
+
+    Returns:
+        (total_hours, last_work_ts, rest_counts): last_work_ts بالثواني (NaN لمن لم يعمل أبداً)
+    """
+    total_hours = np.fromiter(
+        (emp.total_work_hours for emp in employees), dtype=np.float64, count=len(employees)
+    )
+    last_work_ts = np.fromiter(
+        (emp.last_work_datetime.timestamp() if emp.last_work_datetime else np.nan for emp in employees),
+        dtype=np.float64,
+        count=len(employees),
+    )
+    rest_counts = np.fromiter(
+        (emp.consecutive_rest_count for emp in employees), dtype=np.float64, count=len(employees)
+    )
+    return total_hours, last_work_ts, rest_counts
+
+
+def priority_scores(employees, now=None, avg_work_hours=None):
+    """حساب نقاط الأولوية لجميع الموظفين دفعة واحدة
+
+    Args:
+        employees: قائمة (list) من Employee أو RosterEntry
+        now: الوقت المرجعي (افتراضياً timezone.now())
+        avg_work_hours: متوسط الساعات (افتراضياً متوسط القائمة نفسها)
+
+    Returns:
+        np.ndarray بنفس ترتيب employees
+    """
+    if not employees:
+        return np.empty(0, dtype=np.float64)
+
+    now = now or timezone.now()
+    total_hours, last_work_ts, rest_counts = load_arrays(employees)
+    if avg_work_hours is None:
+        avg_work_hours = float(total_hours.mean())
+
+    # ⭐ العامل الأهم: الفرق عن المتوسط
+    scores = total_hours - avg_work_hours
+
+    # ⭐ مكافأة الراحة منذ آخر عمل (أو مكافأة ثابتة لمن لم يعمل أبداً)
+    hours_since_work = (now.timestamp() - last_work_ts) / 3600
+    scores -= np.where(
+        np.isnan(last_work_ts),
+        NEVER_WORKED_BONUS,
+        hours_since_work * HOURS_SINCE_WORK_WEIGHT,
+    )
+
+    # ⭐ مكافأة مرات الراحة المتتالية
+    scores -= rest_counts * CONSECUTIVE_REST_WEIGHT
+    return scores
+
+
+def priority_order(scores):
+    """فهارس الموظفين مرتبة من الأعلى أولوية للأقل (ترتيب مستقر عند التساوي)"""
+    return np.argsort(scores, kind='stable')
@@ -0,0 +1,167 @@
+"""تقويم الشفتات: حدود الشفتات محسوبة مرة واحدة من جدول Shift
+
+بدلاً من الخرائط الثابتة (7:00 / 15:00 / 23:00) في rotate_shifts_task و
+get_next_rotation_time و check_and_send_early_notifications، واستعلام
+Shift.objects.get(name__iexact=...) في كل مرة، يُبنى التقويم من جدول Shift:
+قائمة مرتبة ببدايات الشفتات (بالدقائق من منتصف الليل) ويتم البحث فيها بـ bisect.
+
+يدعم أي عدد من الشفتات وبدايات بدقة الدقيقة. التقويم مخزن لكل عملية ويُبطل
+عند حفظ أو حذف أي Shift (إشارة في models.py)، ويُعاد بناؤه بعد CALENDAR_TTL_SECONDS
+على الأكثر حتى تلاحظ العمليات الأخرى (عمال Celery) التعديل.
+"""
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Shift
+
+
+MINUTES_PER_DAY = 24 * 60
+
+# مدة صلاحية التقويم في العمليات التي لم تصلها إشارة الحفظ
+CALENDAR_TTL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class ShiftSlot:
+    """شفت في التقويم: بدايته بالدقائق من منتصف الليل ومدته بالدقائق"""
+    shift: Shift
+    start_minute: int
+    duration_minutes: int
+
+    @classmethod
+    def from_shift(cls, shift):
+        return cls(shift=shift, start_minute=shift.start_minute_of_day, duration_minutes=shift.duration_minutes)
+
+    @property
+    def name(self):
+        return self.shift.name
+
+
+@dataclass(frozen=True)
+class ShiftBoundary:
+    """حد شفت: بداية starting عند at (وهي نهاية previous إذا كانت الشفتات متصلة)"""
+    at: object
+    previous: ShiftSlot
+    starting: ShiftSlot
+
+
+def _day_start(moment):
+    """منتصف ليل اليوم المحلي للوقت المعطى والدقائق المنقضية منه"""
+    local = timezone.localtime(moment)
+    day_start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_start, (local - day_start) / timedelta(minutes=1)
+
+
+class ShiftCalendar:
+    def __init__(self, shifts):
+        self.slots = sorted((ShiftSlot.from_shift(shift) for shift in shifts), key=lambda slot: slot.start_minute)
+        self._starts = [slot.start_minute for slot in self.slots]
+        self._by_name = {slot.name.lower(): slot for slot in self.slots}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, name):
+        """الشفت بالاسم (بدون حساسية لحالة الأحرف) أو None"""
+        slot = self._by_name.get((name or '').strip().lower())
+        return slot.shift if slot else None
+
+    @property
+    def labels(self):
+        """أسماء الشفتات بالعربية للطباعة"""
+        return {slot.name: str(slot.shift) for slot in self.slots}
+
+    def locate(self, moment):
+        """الشفت الذي يحتوي الوقت المعطى وبدايته
+
+        Returns:
+            (ShiftSlot، بداية الشفت) أو (None، None) إذا وقع الوقت في فجوة بين شفتين
+        """
+        if not self.slots:
+            return None, None
+        day_start, minute = _day_start(moment)
+        index = bisect_right(self._starts, minute) - 1
+        if index < 0:
+            # قبل أول بداية اليوم: آخر شفت بدأ أمس (مثل الليلي)
+            slot = self.slots[-1]
+            shift_start = day_start - timedelta(days=1) + timedelta(minutes=slot.start_minute)
+        else:
+            slot = self.slots[index]
+            shift_start = day_start + timedelta(minutes=slot.start_minute)
+        if timezone.localtime(moment) < shift_start + timedelta(minutes=slot.duration_minutes):
+            return slot, shift_start
+        return None, None
+
+    def shift_at(self, moment):
+        """الشفت الذي يحتوي الوقت المعطى (None في الفجوات)"""
+        slot, _ = self.locate(moment)
+        return slot.shift if slot else None
+
+    def shift_name_at(self, moment):
+        slot, _ = self.locate(moment)
+        return slot.name if slot else None
+
+    def iter_boundaries(self, moment):
+        """حدود الشفتات من moment (شاملة) بترتيب زمني بلا نهاية"""
+        if not self.slots:
+            return
+        day_start, minute = _day_start(moment)
+        index = bisect_left(self._starts, minute)
+        while True:
+            if index == len(self.slots):
+                index = 0
+                day_start += timedelta(days=1)
+            slot = self.slots[index]
+            yield ShiftBoundary(
+                at=day_start + timedelta(minutes=slot.start_minute),
+                previous=self.slots[index - 1],
+                starting=slot,
+            )
+            index += 1
+
+    def boundaries_between(self, start, end):
+        """حدود الشفتات في الفترة [start، end]"""
+        boundaries = []
+        for boundary in self.iter_boundaries(start):
+            if boundary.at > end:
+                break
+            boundaries.append(boundary)
+        return boundaries
+
+    def next_boundary(self, moment):
+        """أقرب حد شفت بعد moment (None إذا لم توجد شفتات)"""
+        for boundary in self.iter_boundaries(moment):
+            if boundary.at > moment:
+                return boundary
+        return None
+
+
+def shift_bounds(shift, moment):
+    """بداية ونهاية الشفت الذي يحتوي الوقت المعطى (أو الذي يبدأ عنده)"""
+    day_start, minute = _day_start(moment)
+    shift_start = day_start + timedelta(minutes=shift.start_minute_of_day)
+    if shift.start_minute_of_day > minute:
+        shift_start -= timedelta(days=1)
+    return shift_start, shift_start + timedelta(minutes=shift.duration_minutes)
+
+
+_calendar = None
+_built_at = 0.0
+
+
+def get_shift_calendar():
+    """التقويم المخزن في هذه العملية (يُبنى من جدول Shift عند الحاجة)"""
+    global _calendar, _built_at
+    if _calendar is None or time.monotonic() - _built_at > CALENDAR_TTL_SECONDS:
+        _calendar = ShiftCalendar(Shift.objects.all())
+        _built_at = time.monotonic()
+    return _calendar
+
+
+def invalidate_shift_calendar():
+    global _calendar
+    _calendar = None
@@ -1,14 +1,69 @@
 # shifts/tasks.py
-from celery import shared_task
-from datetime import time
+import time
+
+from celery import shared_task, chord
+from datetime import datetime as dt
 from django.utils import timezone
-from .models import Shift, Sonar, Employee, EmployeeAssignment, EarlyNotification
-from .utils import rotate_within_shift, check_and_send_early_notifications
-from .models import SystemSettings
+from .models import Sonar, Employee, EmployeeAssignment, SystemSettings
+from .utils import (
+    rotate_within_shift, check_and_send_early_notifications, plan_whole_shift_all_sites,
+    cancel_expired_confirmations, rotation_sites,
+)
+from .locks import rotation_lock
+from .scheduler import SHIFT_END_NOTICE_MINUTES, schedule_next_rotation, scheduled_rotation_missed
+from .shift_calendar import get_shift_calendar
+from .timeline import ensure_rotation_timeline, timeline_event_due
+from .catchup import catch_up_missed_rotations
+
+
+# مدة عمل مهمة الإرسال الواحدة وقفلها (بالثواني)
+OUTBOX_DELIVERY_BUDGET_SECONDS = 240
+OUTBOX_LOCK_SECONDS = 300
+
+
+@shared_task(bind=True)
+def rotate_shifts_task(self, rotation_hours=None):
+    """مهمة التبديل التلقائي محمية بقفل موزع
+
+    تشغيل مكرر أو إعادة محاولة المهمة أثناء تنفيذها يتم تجاهله بدلاً من
+    تنفيذ تبديلين متداخلين. احتساب كل تبديل مرة واحدة مضمون أيضاً بمفتاح RotationCommit.
+    بعد التبديل تُفحص الإشعارات المبكرة والتذكيرات والإشعار النهائي (بدلاً من فحص beat
+    الدوري)، ثم تُجدول المهمة نفسها للحظة القادمة (scheduler.py).
+    """
+    with rotation_lock('rotate-shifts') as acquired:
+        if not acquired:
+            print("⏸️ مهمة التبديل قيد التنفيذ من عامل آخر. تجاهل...")
+            return
+        try:
+            result = run_rotate_shifts(rotation_hours)
+            check_early_notifications_task()
+            return result
+        finally:
+            schedule_next_rotation(current_task_id=self.request.id)
 
 
 @shared_task
-def rotate_shifts_task(rotation_hours=None):
+def rotation_watchdog_task():
+    """مراقب الجدولة: يمدد الجدول الزمني ويعيد تشغيل التبديل إذا ضاعت مهمة ETA أو لم تُجدول بعد"""
+    settings = SystemSettings.get_current_settings()
+    if not settings.is_rotation_active:
+        return
+    ensure_rotation_timeline()
+    if not scheduled_rotation_missed(settings):
+        return
+
+    if settings.scheduled_rotation_at is None:
+        print("🐕 لا توجد مهمة تبديل مجدولة - جدولة التشغيل القادم")
+        schedule_next_rotation()
+    else:
+        print(
+            f"🐕 فاتت مهمة التبديل المجدولة "
+            f"({timezone.localtime(settings.scheduled_rotation_at).strftime('%H:%M')}) - تشغيل فوري"
+        )
+        rotate_shifts_task.delay()
+
+
+def run_rotate_shifts(rotation_hours=None):
     """
     مهمة التبديل التلقائي مع الأولويات التالية:
     1. الأولوية الأولى: التبديل في نهاية كل شفت (7:00, 15:00, 23:00) مع إشعار قبل 10 دقائق
@@ -23,65 +78,45 @@ def rotate_shifts_task(rotation_hours=None):
         return
     
     # الحصول على الوقت الحالي بالمنطقة الزمنية المحلية (Asia/Baghdad)
-    from datetime import timedelta, datetime
+    from datetime import timedelta
     now = timezone.now()
+
+    # ⚡ الجدول الزمني المحسوب مسبقاً: لا داعي لإعادة حساب حدود الشفتات إذا لم يحن أي حدث
+    if not timeline_event_due(settings, now):
+        print("⏳ لا يوجد تبديل أو إشعار مستحق الآن حسب الجدول الزمني")
+        return
+
+    # 🧮 تعويض التبديلات الفائتة (توقف العامل أو beat عبر نهاية شفت) دفعة واحدة،
+    # ثم تنفيذ الفترة الحالية فقط بالمسار العادي مع الإشعارات
+    current_period = catch_up_missed_rotations(settings, now)
+    if current_period:
+        print(
+            f"🔄 تنفيذ الفترة الحالية بعد التعويض: {current_period.shift.name} "
+            f"{timezone.localtime(current_period.rotation_at).strftime('%Y-%m-%d %H:%M')}"
+        )
+        try:
+            dispatch_rotation(
+                current_period.shift.name,
+                settings.get_effective_rotation_hours(),
+                lead_time_minutes=0,
+                next_rotation_time=current_period.rotation_at,
+                is_early_notification=False,
+                trigger='catch_up'
+            )
+            settings.last_rotation_time = current_period.rotation_at
+            settings.save(update_fields=['last_rotation_time'])
+        except Exception as e:
+            print(f"❌ خطأ في تنفيذ الفترة الحالية بعد التعويض: {e}")
+        return
+
     now_local = timezone.localtime(now)
     lead_minutes = max(int(settings.early_notification_minutes or 10), 0)
-    current_time = now_local.time()
-    current_date = now_local.date()
-    
-    # تعريف أوقات نهاية الشفتات
-    shift_end_times = {
-        "night": time(7, 0),      # نهاية الليلي - بداية الصباحي
-        "morning": time(15, 0),   # نهاية الصباحي - بداية المسائي  
-        "evening": time(23, 0),   # نهاية المسائي - بداية الليلي
-    }
     
-    # خريطة الشفتات التالية
-    next_shift_map = {
-        "morning": "evening",  # بعد الصباحي يأتي المسائي
-        "evening": "night",    # بعد المسائي يأتي الليلي
-        "night": "morning"     # بعد الليلي يأتي الصباحي
-    }
-    
-    # تعريف نطاقات الشفتات حسب الساعة
-    shift_ranges = {
-        "morning": (time(7, 0), time(15, 0)),    # صباحي
-        "evening": (time(15, 0), time(23, 0)),   # مسائي
-        "night": (time(23, 0), time(7, 0))       # ليلي
-    }
+    # 🗓️ حدود الشفتات من تقويم الشفتات (مبني مرة واحدة من جدول Shift)
+    calendar = get_shift_calendar()
     
     # أسماء الشفتات بالعربية للطباعة
-    shift_labels = {
-        "morning": "صباحي",
-        "evening": "مسائي",
-        "night": "ليلي"
-    }
-    
-    # 🔧 دالة لتحديد الشفت بناءً على وقت معين
-    def get_shift_for_time(check_time):
-        """تحديد الشفت المناسب لوقت معين"""
-        for shift_name, (start, end) in shift_ranges.items():
-            if start <= end:  # شفت عادي
-                if start <= check_time < end:
-                    return shift_name
-            else:  # شفت يمر منتصف الليل
-                if check_time >= start or check_time < end:
-                    return shift_name
-        return None
-    
-    # تحديد الشفت الحالي
-    current_shift_name = get_shift_for_time(current_time)
-    
-    if not current_shift_name:
-        print("❌ لا يوجد شفت نشط حاليا")
-        return
-    
-    try:
-        current_shift = Shift.objects.get(name__iexact=current_shift_name.strip())
-    except Shift.DoesNotExist:
-        print(f"❌ الشفت {current_shift_name} غير موجود")
-        return
+    shift_labels = calendar.labels
     
     current_tz = timezone.get_current_timezone()
 
@@ -90,20 +125,6 @@ def rotate_shifts_task(rotation_hours=None):
         if timezone.is_aware(dt):
             return dt
         return timezone.make_aware(dt, current_tz)
-
-    def calculate_shift_start_datetime(shift_obj):
-        """إرجاع بداية الشفت الحالية لاستخدامها كمرجع للتبديل الدوري."""
-        shift_start = now_local.replace(
-            hour=shift_obj.start_hour,
-            minute=0,
-            second=0,
-            microsecond=0
-        )
-        if shift_obj.end_hour <= shift_obj.start_hour and now_local.hour < shift_obj.start_hour:
-            shift_start -= timedelta(days=1)
-        return shift_start
-
-    shift_start = calculate_shift_start_datetime(current_shift)
     
     # الحصول على ساعات التبديل من الإعدادات
     rotation_hours = settings.get_effective_rotation_hours()
@@ -112,42 +133,37 @@ def rotate_shifts_task(rotation_hours=None):
     # ============================================
     # 🔥 الأولوية الأولى: التبديل في نهاية الشفت
     # ============================================
-    # إشعار قبل 10 دقائق من نهاية الشفت (6:50, 14:50, 22:50)
-    # التبديل في نهاية الشفت (7:00, 15:00, 23:00) للشفت التالي
-
-    for shift_name, end_time in shift_end_times.items():
-        # حساب وقت نهاية الشفت
-        end_datetime = datetime.combine(current_date, end_time)
-        if end_time.hour < 12 and current_time.hour >= 12:
-            end_datetime += timedelta(days=1)
-        elif end_time.hour >= 12 and current_time.hour < 12:
-            end_datetime -= timedelta(days=1)
-
-        # تحويل إلى وقت واعٍ بالمنطقة الزمنية
-        end_datetime = timezone.make_aware(end_datetime, current_tz)
+    # إشعار قبل 10 دقائق من نهاية الشفت (مثال: 6:50 للشفت الذي يبدأ 7:00)
+    # التبديل في نهاية الشفت (= بداية الشفت التالي في التقويم) للشفت التالي
+
+    nearby_boundaries = calendar.boundaries_between(
+        now - timedelta(minutes=2),
+        now + timedelta(minutes=SHIFT_END_NOTICE_MINUTES + 2)
+    )
+    for boundary in nearby_boundaries:
+        # نهاية الشفت = بداية الشفت التالي
+        end_datetime = boundary.at
+        shift_name = boundary.previous.name
         
         # وقت الإشعار (قبل 10 دقائق من نهاية الشفت)
-        notification_time = end_datetime - timedelta(minutes=10)
+        notification_time = end_datetime - timedelta(minutes=SHIFT_END_NOTICE_MINUTES)
         
         # حساب الفرق بالدقائق
         time_diff = (end_datetime - now).total_seconds() / 60
         notification_diff = (notification_time - now).total_seconds() / 60
         
         # الشفت التالي
-        next_shift_name = next_shift_map.get(shift_name)
+        next_shift = boundary.starting.shift
+        next_shift_name = next_shift.name
         
         # حالة 1: إرسال إشعار قبل 10 دقائق من نهاية الشفت (نطاق ±2 دقيقة)
         if -2 <= notification_diff <= 2:
-            # التحقق من عدم إرسال الإشعار مسبقاً
-            try:
-                next_shift = Shift.objects.get(name__iexact=next_shift_name)
-            except Shift.DoesNotExist:
-                print(f"❌ الشفت {next_shift_name} غير موجود")
-                continue
-            
             # وقت التبديل الرسمي (نهاية الشفت = بداية الشفت التالي)
             official_rotation_time = end_datetime
             
+            # 📋 تخطيط جميع فترات الشفت التالي مسبقاً (مرة واحدة)
+            ensure_shift_plan(next_shift_name, official_rotation_time)
+            
             # التحقق من وجود تبديل مسبق
             existing_assignment = EmployeeAssignment.objects.filter(
                 assigned_at=official_rotation_time,
@@ -156,22 +172,19 @@ def rotate_shifts_task(rotation_hours=None):
             
             if existing_assignment:
                 # التحقق من عدم إرسال إشعار مسبقاً
-                recent_notification = EarlyNotification.objects.filter(
-                    assignment=existing_assignment,
-                    notification_type='employee',
-                    notification_stage='initial',
-                    sent_at__gte=now - timedelta(minutes=5)
-                ).exists()
+                # الإشعار الأولي مسجل على التبديل نفسه (notification_flags) بدون استعلام إضافي
+                recent_notification = existing_assignment.has_notification('initial', 'employee')
                 
                 if not recent_notification:
                     print(f"📢 إشعار نهاية الشفت: قبل 10 دقائق من نهاية {shift_labels.get(shift_name)} → بداية {shift_labels.get(next_shift_name)}")
                     try:
-                        rotate_within_shift(
+                        dispatch_rotation(
                             next_shift_name, 
                             rotation_hours, 
                             lead_time_minutes=10, 
                             next_rotation_time=official_rotation_time, 
-                            is_early_notification=True
+                            is_early_notification=True,
+                            trigger='shift_end'
                         )
                         print(f"✅ تم إرسال إشعار نهاية الشفت للشفت {shift_labels.get(next_shift_name)}")
                         return
@@ -182,12 +195,13 @@ def rotate_shifts_task(rotation_hours=None):
                 # إنشاء التبديلات وإرسال الإشعار
                 print(f"📢 إشعار نهاية الشفت: قبل 10 دقائق من نهاية {shift_labels.get(shift_name)} → بداية {shift_labels.get(next_shift_name)}")
                 try:
-                    rotate_within_shift(
+                    dispatch_rotation(
                         next_shift_name, 
                         rotation_hours, 
                         lead_time_minutes=10, 
                         next_rotation_time=official_rotation_time, 
-                        is_early_notification=True
+                        is_early_notification=True,
+                        trigger='shift_end'
                     )
                     print(f"✅ تم إرسال إشعار نهاية الشفت للشفت {shift_labels.get(next_shift_name)}")
                     return
@@ -204,24 +218,20 @@ def rotate_shifts_task(rotation_hours=None):
                     print(f"⏸️ تم التبديل مؤخراً. تجاهل...")
                     return
             
-            try:
-                next_shift = Shift.objects.get(name__iexact=next_shift_name)
-            except Shift.DoesNotExist:
-                print(f"❌ الشفت {next_shift_name} غير موجود")
-                continue
-            
             # وقت التبديل الرسمي (نهاية الشفت = بداية الشفت التالي)
             official_rotation_time = end_datetime
             
             print(f"⏰ نهاية الشفت! {shift_labels.get(shift_name)} → بداية {shift_labels.get(next_shift_name)}")
+            ensure_shift_plan(next_shift_name, official_rotation_time)
             try:
                 # تنفيذ التبديل للشفت التالي
-                rotate_within_shift(
+                dispatch_rotation(
                     next_shift_name, 
                     rotation_hours, 
                     lead_time_minutes=0, 
                     next_rotation_time=official_rotation_time, 
-                    is_early_notification=False
+                    is_early_notification=False,
+                    trigger='shift_end'
                 )
                 # تحديث last_rotation_time إلى الوقت الرسمي (نهاية الشفت)
                 settings.last_rotation_time = official_rotation_time
@@ -232,6 +242,14 @@ def rotate_shifts_task(rotation_hours=None):
                 print(f"❌ خطأ في تبديل نهاية الشفت: {e}")
                 return
     
+    # تحديد الشفت الحالي وبدايته (بحث bisect في التقويم)
+    current_slot, shift_start = calendar.locate(now_local)
+    if current_slot is None:
+        print("❌ لا يوجد شفت نشط حاليا")
+        return
+    current_shift = current_slot.shift
+    current_shift_name = current_shift.name
+    
     # ============================================
     # 🔥 الأولوية الثانية: التبديل حسب الإعدادات
     # ============================================
@@ -242,8 +260,6 @@ def rotate_shifts_task(rotation_hours=None):
         print(f"🆕 أول تبديل في النظام - حساب التبديل الأول من بداية الشفت {shift_labels.get(current_shift_name)}")
         
         # حساب وقت التبديل الأول من بداية الشفت
-        shift_start = calculate_shift_start_datetime(current_shift)
-        
         hours_since_start = (now_local - shift_start).total_seconds() / 3600
         rotation_index = int(hours_since_start // rotation_hours)
         first_rotation_time = shift_start + timedelta(hours=rotation_index * rotation_hours)
@@ -251,19 +267,20 @@ def rotate_shifts_task(rotation_hours=None):
         if first_rotation_time < now_local:
             first_rotation_time += timedelta(hours=rotation_hours)
         
-        first_rotation_time_aware = timezone.make_aware(first_rotation_time)
+        first_rotation_time_aware = ensure_aware(first_rotation_time)
         time_until_first = (first_rotation_time_aware - now).total_seconds() / 60
         
         if time_until_first > 0:
             # التبديل في المستقبل - إنشاء التبديلات فقط
             print(f"⏳ التبديل الأول في المستقبل ({int(time_until_first)} دقيقة)")
             try:
-                rotate_within_shift(
+                dispatch_rotation(
                     current_shift_name, 
                     rotation_hours, 
                     lead_time_minutes=0, 
                     next_rotation_time=first_rotation_time_aware, 
-                    is_early_notification=True
+                    is_early_notification=True,
+                    trigger='first_run'
                 )
                 settings.last_rotation_time = first_rotation_time_aware - timedelta(hours=rotation_hours)
                 settings.save(update_fields=['last_rotation_time'])
@@ -274,12 +291,13 @@ def rotate_shifts_task(rotation_hours=None):
             # التبديل الآن - تنفيذ فوراً
             print(f"🔄 التبديل الأول الآن")
             try:
-                rotate_within_shift(
+                dispatch_rotation(
                     current_shift_name, 
                     rotation_hours, 
                     lead_time_minutes=0, 
                     next_rotation_time=first_rotation_time_aware, 
-                    is_early_notification=False
+                    is_early_notification=False,
+                    trigger='first_run'
                 )
                 settings.last_rotation_time = first_rotation_time_aware
                 settings.save(update_fields=['last_rotation_time'])
@@ -291,15 +309,7 @@ def rotate_shifts_task(rotation_hours=None):
     # =========================
     # ⛔ أولوية ثانية: منع التبديل الداخلي في آخر 59 دقيقة من الشفت
     # =========================
-    shift_end_time = shift_end_times[current_shift_name]
-    shift_end_dt = shift_start.replace(
-        hour=shift_end_time.hour,
-        minute=shift_end_time.minute,
-        second=0,
-        microsecond=0
-    )
-    if shift_end_time.hour <= current_shift.start_hour:
-        shift_end_dt += timedelta(days=1)
+    shift_end_dt = shift_start + timedelta(minutes=current_slot.duration_minutes)
     minutes_to_shift_end = (shift_end_dt - now_local).total_seconds() / 60
     lock_window_minutes = 59
     if 0 <= minutes_to_shift_end <= lock_window_minutes:
@@ -337,49 +347,35 @@ def rotate_shifts_task(rotation_hours=None):
         last_rotation_aware = anchored_last_rotation
 
     time_since_last = now - settings.last_rotation_time
-    catchup_rotations = 0
-    max_catchup_rotations = 6  # حماية من عدد كبير من التبديلات المتأخرة
 
-    while time_since_last >= required_interval and catchup_rotations < max_catchup_rotations:
+    # الفترات الفائتة يعوضها catch_up_missed_rotations أعلاه، وهنا التبديل الدوري المستحق الآن فقط
+    if time_since_last >= required_interval:
         next_rotation_time = settings.last_rotation_time + required_interval
         next_rotation_time_local = timezone.localtime(next_rotation_time)
-        hours_since = time_since_last.total_seconds() / 3600
-        
+
         # 🔧 تحديد الشفت الصحيح بناءً على وقت التبديل (وليس الوقت الحالي)
-        target_shift_name = get_shift_for_time(next_rotation_time_local.time())
+        target_shift_name = calendar.shift_name_at(next_rotation_time_local)
         if not target_shift_name:
             target_shift_name = current_shift_name
-        
+
         print(
-            f"⏱️ مر {hours_since:.1f} ساعة من آخر تبديل "
-            f"(المطلوب: {rotation_hours} ساعة) - تنفيذ تبديل تعويضي #{catchup_rotations + 1} للشفت {shift_labels.get(target_shift_name)}"
+            f"⏱️ مر {time_since_last.total_seconds() / 3600:.1f} ساعة من آخر تبديل "
+            f"(المطلوب: {rotation_hours} ساعة) - تنفيذ التبديل الدوري للشفت {shift_labels.get(target_shift_name)}"
         )
         try:
-            rotate_within_shift(
+            dispatch_rotation(
                 target_shift_name,  # استخدام الشفت الصحيح
                 rotation_hours,
                 lead_time_minutes=0,
                 next_rotation_time=next_rotation_time,
-                is_early_notification=False
+                is_early_notification=False,
+                trigger='interval'
             )
             settings.last_rotation_time = next_rotation_time
             settings.save(update_fields=['last_rotation_time'])
-            print(f"✅ تبديل دوري (تعويضي) في {next_rotation_time_local.strftime('%H:%M')} - شفت {shift_labels.get(target_shift_name)}")
-            catchup_rotations += 1
-            time_since_last = now - settings.last_rotation_time
+            print(f"✅ تبديل دوري في {next_rotation_time_local.strftime('%H:%M')} - شفت {shift_labels.get(target_shift_name)}")
         except Exception as e:
             print(f"❌ خطأ في التبديل الدوري: {e}")
-            return
-
-    if catchup_rotations > 0:
-        if time_since_last >= required_interval:
-            total_delay_hours = time_since_last.total_seconds() / 3600
-            print(
-                f"⚠️ بقي {total_delay_hours:.1f} ساعة متأخرة بعد {catchup_rotations} تبديلات."
-                " سيُستكمل التعويض في الدورة القادمة."
-            )
-        else:
-            print(f"✅ تمت معالجة كل التبديلات المتأخرة ({catchup_rotations})")
         return
 
     next_rotation_time = settings.last_rotation_time + required_interval
@@ -399,7 +395,7 @@ def rotate_shifts_task(rotation_hours=None):
     
     if -notification_window <= minutes_until_notification <= notification_window:
         # 🔧 تحديد الشفت الصحيح بناءً على وقت التبديل (وليس الوقت الحالي)
-        target_shift_name = get_shift_for_time(next_rotation_time_local.time())
+        target_shift_name = calendar.shift_name_at(next_rotation_time_local)
         if not target_shift_name:
             target_shift_name = current_shift_name
         
@@ -410,22 +406,19 @@ def rotate_shifts_task(rotation_hours=None):
         ).first()
         
         if existing_assignment:
-            recent_notification = EarlyNotification.objects.filter(
-                assignment=existing_assignment,
-                notification_type='employee',
-                notification_stage='initial',
-                sent_at__gte=now - timedelta(minutes=5)
-            ).exists()
+            # الإشعار الأولي مسجل على التبديل نفسه (notification_flags) بدون استعلام إضافي
+            recent_notification = existing_assignment.has_notification('initial', 'employee')
             
             if not recent_notification:
                 print(f"📢 حان وقت إرسال الإشعار المبكر! التبديل القادم في {next_rotation_time_local.strftime('%H:%M')} - شفت {shift_labels.get(target_shift_name)}")
                 try:
-                    rotate_within_shift(
+                    dispatch_rotation(
                         target_shift_name,  # استخدام الشفت الصحيح
                         rotation_hours, 
                         lead_time_minutes=lead_minutes, 
                         next_rotation_time=next_rotation_time, 
-                        is_early_notification=True
+                        is_early_notification=True,
+                        trigger='interval'
                     )
                     print(f"✅ تم إرسال الإشعار المبكر بنجاح - شفت {shift_labels.get(target_shift_name)}")
                     return
@@ -436,12 +429,13 @@ def rotate_shifts_task(rotation_hours=None):
             # إنشاء التبديلات وإرسال الإشعار
             print(f"📢 حان وقت إرسال الإشعار المبكر! التبديل القادم في {next_rotation_time_local.strftime('%H:%M')} - شفت {shift_labels.get(target_shift_name)}")
             try:
-                rotate_within_shift(
+                dispatch_rotation(
                     target_shift_name,  # استخدام الشفت الصحيح
                     rotation_hours, 
                     lead_time_minutes=lead_minutes, 
                     next_rotation_time=next_rotation_time, 
-                    is_early_notification=True
+                    is_early_notification=True,
+                    trigger='interval'
                 )
                 print(f"✅ تم إرسال الإشعار المبكر بنجاح - شفت {shift_labels.get(target_shift_name)}")
                 return
@@ -457,15 +451,163 @@ def rotate_shifts_task(rotation_hours=None):
             print(f"   📢 الإشعار سيُرسل في: {timezone.localtime(notification_time).strftime('%H:%M')} (متبقي: {minutes_until_notification:.1f} دقيقة)")
 
 
+def dispatch_rotation(shift_name, rotation_hours, lead_time_minutes=0, next_rotation_time=None, is_early_notification=False, trigger='manual'):
+    """تنفيذ التبديل لكل موقع كمهمة Celery مستقلة
+
+    موقع واحد (الحالة الافتراضية): التنفيذ مباشرة كما في السابق.
+    عدة مواقع: رفض التبديلات المنتهية مرة واحدة ثم إطلاق rotate_site_task لكل موقع
+    في chord، فلا يؤخر موقع بطيء مواعيد المواقع الأخرى.
+    """
+    sites = rotation_sites()
+    if len(sites) <= 1:
+        rotate_within_shift(
+            shift_name,
+            rotation_hours,
+            lead_time_minutes=lead_time_minutes,
+            next_rotation_time=next_rotation_time,
+            is_early_notification=is_early_notification,
+            trigger=trigger
+        )
+        return
+
+    rejected_count = cancel_expired_confirmations()
+    if rejected_count > 0:
+        print(f"❌ تم رفض {rejected_count} تبديل غير مؤكد من الفترة السابقة")
+
+    # التواريخ تُمرر بصيغة ISO لأن Celery يستخدم JSON
+    rotation_time_iso = next_rotation_time.isoformat() if next_rotation_time else None
+    header = [
+        rotate_site_task.s(
+            shift_name, site, rotation_hours, lead_time_minutes, rotation_time_iso, is_early_notification, trigger
+        )
+        for site in sites
+    ]
+    chord(header)(summarize_site_rotations.s(shift_name, rotation_time_iso))
+    print(f"🚀 تم إطلاق التبديل لـ {len(sites)} موقع بالتوازي - شفت {shift_name}")
+
+
+@shared_task
+def rotate_site_task(shift_name, site, rotation_hours, lead_time_minutes, next_rotation_time, is_early_notification, trigger='manual'):
+    """تبديل موقع واحد (مجموعة سونارات وموظفيها) مع قفل خاص بالمجموعة (داخل rotate_within_shift)"""
+    rotation_time = dt.fromisoformat(next_rotation_time) if next_rotation_time else None
+    site_label = site or 'الافتراضي'
+
+    try:
+        acquired = rotate_within_shift(
+            shift_name,
+            rotation_hours,
+            lead_time_minutes=lead_time_minutes,
+            next_rotation_time=rotation_time,
+            is_early_notification=is_early_notification,
+            site=site,
+            cancel_expired=False,
+            trigger=trigger
+        )
+    except Exception as e:
+        print(f"❌ خطأ في تبديل الموقع {site_label}: {e}")
+        return {'site': site, 'status': 'error', 'error': str(e)}
+    if not acquired:
+        return {'site': site, 'status': 'locked'}
+    return {'site': site, 'status': 'done'}
+
+
+@shared_task
+def summarize_site_rotations(results, shift_name, next_rotation_time):
+    """ملخص نتائج تبديل المواقع (callback للـ chord)"""
+    done = [result['site'] or 'الافتراضي' for result in results if result['status'] == 'done']
+    failed = [result for result in results if result['status'] != 'done']
+    print(f"📊 تبديل الشفت {shift_name} ({next_rotation_time}): {len(done)} موقع ناجح")
+    for result in failed:
+        print(f"  ⚠️ {result['site'] or 'الافتراضي'}: {result['status']} {result.get('error', '')}")
+    return {'done': len(done), 'failed': len(failed)}
+
+
+def ensure_shift_plan(shift_name, shift_start):
+    """تخطيط الشفت كاملاً إذا لم يكن مخططاً (لا يوقف التبديل عند الفشل)"""
+    try:
+        plan_whole_shift_all_sites(shift_name, shift_start=shift_start)
+    except Exception as e:
+        print(f"⚠️ تعذر تخطيط الشفت {shift_name} مسبقاً: {e}")
+
+
+@shared_task
+def plan_shift_task(shift_name=None, replan=False):
+    """تخطيط جميع فترات الشفت (الحالي افتراضياً) عند الطلب"""
+    if shift_name is None:
+        shift_name = get_shift_calendar().shift_name_at(timezone.now())
+        if shift_name is None:
+            print("❌ لا يوجد شفت نشط حاليا")
+            return 0
+    return plan_whole_shift_all_sites(shift_name, replan=replan)
+
+
 @shared_task
 def check_early_notifications_task():
-    """مهمة دورية لفحص وإرسال الإشعارات المبكرة"""
+    """فحص وإرسال الإشعارات المبكرة (تُستدعى من rotate_shifts_task في لحظات ETA أو يدوياً)"""
     try:
         check_and_send_early_notifications()
     except Exception as e:
         print(f"❌ خطأ في فحص الإشعارات المبكرة: {e}")
 
 
+@shared_task
+def deliver_outbox_task():
+    """إرسال رسائل صندوق الصادر (تعمل على قائمة notifications بعامل منفصل)
+
+    تُطلب بعد كل معاملة تكتب رسائل، وكل دقيقة من beat لإعادة المحاولة. القفل
+    يضمن عاملاً واحداً يرسل في نفس الوقت حتى يبقى ترتيب رسائل كل محادثة محفوظاً.
+    """
+    from .outbox import deliver_due_messages
+
+    totals = {'sent': 0, 'retried': 0, 'dead': 0}
+    with rotation_lock('outbox-delivery', timeout=OUTBOX_LOCK_SECONDS) as acquired:
+        if not acquired:
+            print("⏭️ عامل آخر يرسل رسائل صندوق الصادر حالياً")
+            return totals
+
+        deadline = time.monotonic() + OUTBOX_DELIVERY_BUDGET_SECONDS
+        while time.monotonic() < deadline:
+            stats = deliver_due_messages()
+            for key, value in stats.items():
+                totals[key] += value
+            if not any(stats.values()):
+                break
+    return totals
+
+
+@shared_task
+def send_broadcast_task(notification_id):
+    """تجهيز رسائل إشعار مخصص في صندوق الصادر (قائمة notifications)"""
+    from .broadcast import queue_broadcast
+
+    return queue_broadcast(notification_id)
+
+
+@shared_task
+def resume_broadcasts_task():
+    """استئناف الإشعارات المخصصة التي لم يكتمل تجهيزها (عامل توقف أو تعذر طلب المهمة)"""
+    from .broadcast import queue_broadcast
+    from .models import CustomNotification
+
+    queued = 0
+    for notification_id in CustomNotification.objects.filter(status='queued').order_by('id').values_list('id', flat=True):
+        queued += queue_broadcast(notification_id)
+    return queued
+
+
+@shared_task
+def reconcile_work_hours_aggregate():
+    """مقارنة مجموع الساعات المتراكم مع Sum/Count من قاعدة البيانات وتصحيحه"""
+    from .models import WorkHoursAggregate
+    
+    hours_drift, count_drift = WorkHoursAggregate.reconcile()
+    if abs(hours_drift) > 0.01 or count_drift:
+        print(f"🔧 تم تصحيح مجموع الساعات المتراكم (فرق الساعات: {hours_drift:.2f}، فرق العدد: {count_drift})")
+    else:
+        print("✅ مجموع الساعات المتراكم مطابق لقاعدة البيانات")
+    return {'hours_drift': hours_drift, 'count_drift': count_drift}
+
+
 @shared_task
 def reset_monthly_work_hours():
     """تصفير ساعات العمل لجميع الموظفين في بداية كل شهر
@@ -561,7 +703,7 @@ def reset_monthly_work_hours():
             telegram_id = admin.manager_profile.phone
         
         if telegram_id:
-            from .utils import send_telegram_message
+            from .outbox import enqueue_texts
             
             message = f"""
 🔄 تصفير ساعات العمل الشهرية
@@ -584,8 +726,8 @@ def reset_monthly_work_hours():
 شهر جديد سعيد! 🎉
             """
             
-            send_telegram_message(telegram_id, message)
-            print(f"  ✅ تم إرسال إشعار إلى: {admin.username}")
+            enqueue_texts([(telegram_id, message)])
+            print(f"  ✅ تم تجهيز إشعار إلى: {admin.username}")
     
     print("\n" + "="*70)
     print("✅ اكتملت عملية التصفير الشهرية بنجاح!")
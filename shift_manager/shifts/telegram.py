@@ -0,0 +1,206 @@
+"""عميل إرسال رسائل تليغرام مع اتصالات مُعاد استخدامها وإرسال متوازٍ
+
+سابقاً كان كل إشعار يستدعي requests.post بدون Session ولا timeout، فتبديل
+لـ 200 موظف يعني 200 مصافحة TLS متتالية داخل مهمة التبديل.
+
+الآن:
+- requests.Session واحدة لكل عملية مع مجموعة اتصالات keep-alive
+- مهلة صارمة للاتصال والقراءة (لا تتوقف مهمة التبديل بسبب خادم بطيء)
+- deliver_many: إرسال دفعة رسائل بالتوازي عبر ThreadPoolExecutor مع احترام حدود
+  تليغرام عبر حد الإرسال المشترك بين العمليات (ratelimit.py)، ورسائل نفس المحادثة
+  بالترتيب
+"""
+import math
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .ratelimit import get_rate_limiter
+
+
+API_BASE_URL = 'https://api.telegram.org'
+
+# (مهلة الاتصال، مهلة القراءة) بالثواني
+REQUEST_TIMEOUT = (3.05, 10)
+
+# عدد الإرسالات المتزامنة (وحجم مجموعة الاتصالات)
+MAX_WORKERS = 8
+
+# إعادة المحاولة عند 429 (Too Many Requests) حسب retry_after، وأقصى انتظار لحد
+# الإرسال قبل إرجاع الرسالة كفاشلة (يعيد صندوق الصادر المحاولة لاحقاً)
+MAX_RETRIES = 2
+MAX_RETRY_AFTER = 30
+
+# أقصى طول لنص رسالة تليغرام واحدة
+MESSAGE_LIMIT = 4096
+
+# أخطاء لا تفيد إعادة المحاولة معها (محادثة غير موجودة، البوت محظور...)
+PERMANENT_STATUS_CODES = (400, 403)
+
+
+# نتيجة إرسال رسالة واحدة (يستخدمها صندوق الصادر لتحديد إعادة المحاولة)
+DeliveryResult = namedtuple('DeliveryResult', ['ok', 'status_code', 'error', 'retry_after', 'permanent'])
+
+
+class TelegramClient:
+    def __init__(self, token, base_url=API_BASE_URL, max_workers=MAX_WORKERS, rate_limiter=None):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+
+    @property
+    def send_url(self):
+        return f"{self.base_url}/bot{self.token}/sendMessage"
+
+    def deliver(self, chat_id, text):
+        """إرسال رسالة واحدة مع تفاصيل النتيجة
+
+        Returns:
+            DeliveryResult (الخطأ يُطبع ولا يُرفع)
+        """
+        if not chat_id:
+            print("❌ الموظف لا يملك chat_id")
+            return DeliveryResult(False, None, 'لا يوجد chat_id', None, True)
+
+        payload = {"chat_id": chat_id, "text": text}
+        for attempt in range(MAX_RETRIES + 1):
+            # رمز من الدلو العام ودلو المحادثة (مشتركان بين جميع العمليات)
+            wait = self.rate_limiter.wait(chat_id, max_wait=MAX_RETRY_AFTER)
+            if wait:
+                print(f"⏳ حد الإرسال للـ chat_id {chat_id}: الانتظار {wait:.0f} ثانية - تأجيل الرسالة")
+                return DeliveryResult(False, 429, 'حد الإرسال', math.ceil(wait), False)
+            try:
+                response = self.session.post(self.send_url, data=payload, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                print(f"❌ خطأ في إرسال التليغرام للـ chat_id {chat_id}: {e}")
+                return DeliveryResult(False, None, str(e), None, False)
+
+            if response.status_code == 429:
+                retry_after = _retry_after(response)
+                # الحظر يمنع جميع العمليات من الإرسال لهذه المحادثة حتى انتهاء المدة
+                self.rate_limiter.block(chat_id, retry_after)
+                if attempt < MAX_RETRIES and retry_after <= MAX_RETRY_AFTER:
+                    print(f"⏳ تليغرام طلب الانتظار {retry_after} ثانية (chat_id {chat_id})")
+                    continue
+                return DeliveryResult(False, 429, response.text[:500], retry_after, False)
+
+            print(f"تم الإرسال للـ chat_id {chat_id}: {response.status_code}")
+            if response.ok:
+                return DeliveryResult(True, response.status_code, '', None, False)
+            return DeliveryResult(
+                False, response.status_code, response.text[:500], None,
+                response.status_code in PERMANENT_STATUS_CODES,
+            )
+        return DeliveryResult(False, None, 'تجاوز عدد المحاولات', None, False)
+
+    def send(self, chat_id, text):
+        """إرسال رسالة واحدة
+
+        Returns:
+            True عند النجاح، False عند الفشل
+        """
+        return self.deliver(chat_id, text).ok
+
+    def _send_chat(self, chat_messages, stop_on_failure=False):
+        """إرسال رسائل محادثة واحدة بالترتيب (التباعد من دلو المحادثة في حد الإرسال)
+
+        مع stop_on_failure تتوقف المحادثة عند أول فشل (الباقي نتيجته None) حتى
+        لا تصل الرسائل اللاحقة قبل السابقة عند إعادة المحاولة.
+        """
+        results = []
+        try:
+            for position, chat_id, text in chat_messages:
+                result = self.deliver(chat_id, text)
+                results.append((position, result))
+                if stop_on_failure and not result.ok:
+                    break
+        finally:
+            self.rate_limiter.close()
+        return results
+
+    def deliver_many(self, messages, stop_on_failure=False):
+        """إرسال دفعة رسائل [(chat_id, text), ...] بالتوازي
+
+        رسائل نفس المحادثة تُرسل بالترتيب من نفس الخيط، والمحادثات المختلفة بالتوازي.
+
+        Returns:
+            قائمة DeliveryResult بنفس ترتيب الرسائل (None لما لم يُرسل بسبب stop_on_failure)
+        """
+        messages = list(messages)
+        by_chat = OrderedDict()
+        for position, (chat_id, text) in enumerate(messages):
+            by_chat.setdefault(str(chat_id), []).append((position, chat_id, text))
+
+        results = [None] * len(messages)
+        if not by_chat:
+            return results
+
+        workers = min(self.max_workers, len(by_chat))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='telegram') as executor:
+            chats = executor.map(lambda chat: self._send_chat(chat, stop_on_failure), by_chat.values())
+            for chat_results in chats:
+                for position, result in chat_results:
+                    results[position] = result
+        sent = sum(1 for result in results if result and result.ok)
+        print(f"📨 تم إرسال {sent}/{len(messages)} رسالة تليغرام ({len(by_chat)} محادثة)")
+        return results
+
+
+def paginate(lines, header='', footer='', limit=MESSAGE_LIMIT):
+    """تقسيم أسطر رسالة طويلة إلى عدة رسائل لا تتجاوز limit حرفاً
+
+    كل صفحة تبدأ بـ header (مع رقم الصفحة عند التعدد) وتنتهي بـ footer، والسطر
+    الأطول من صفحة كاملة يُقص.
+    """
+    # احتياط لرقم الصفحة " (12/12)" وفواصل الأسطر
+    budget = max(limit - len(header) - len(footer) - 16, 1)
+    pages = [[]]
+    size = 0
+    for line in lines:
+        line = line[:budget]
+        if pages[-1] and size + len(line) + 1 > budget:
+            pages.append([])
+            size = 0
+        pages[-1].append(line)
+        size += len(line) + 1
+
+    total = len(pages)
+    messages = []
+    for number, page in enumerate(pages, 1):
+        title = f"{header} ({number}/{total})" if header and total > 1 else header
+        messages.append('\n\n'.join(part for part in (title, '\n'.join(page), footer) if part))
+    return messages
+
+
+def _retry_after(response):
+    """مدة الانتظار التي يطلبها تليغرام مع 429"""
+    try:
+        return int(response.json().get('parameters', {}).get('retry_after', 1))
+    except (ValueError, AttributeError):
+        return 1
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_telegram_client(token):
+    """عميل مشترك لكل عملية (ولكل توكن وعنوان API) حتى تُعاد استخدام الاتصالات
+
+    العنوان من TELEGRAM_API_BASE_URL (خادم telegram_stub المحلي في الاختبارات).
+    """
+    base_url = getattr(settings, 'TELEGRAM_API_BASE_URL', API_BASE_URL)
+    with _clients_lock:
+        client = _clients.get((token, base_url))
+        if client is None:
+            client = _clients[(token, base_url)] = TelegramClient(token, base_url=base_url)
+        return client
@@ -0,0 +1,239 @@
+"""خادم محلي يحاكي sendMessage في Bot API لتليغرام (لاختبار الحمل والتكامل بدون إنترنت)
+
+يُشغَّل بأمر telegram_stub، أو داخل العملية (simulate_rotations --deliver)،
+ويُوجَّه إليه العميل بالإعداد TELEGRAM_API_BASE_URL.
+
+يمكن حقن:
+- تأخير لكل طلب (latency ± jitter)
+- ردود 429 مع retry_after بنسبة معينة، أو فرض حدود تليغرام الحقيقية
+  (30 رسالة/ثانية للبوت ورسالة/ثانية لكل محادثة)
+- أخطاء 5xx بنسبة معينة، و 403 لمحادثات محددة (البوت محظور)
+
+كل طلب يُسجَّل (المحادثة، النص، رمز الرد، الوقت) للتحقق منه في الاختبارات:
+- داخل العملية: stub.messages و stub.stats()
+- من عملية أخرى: GET /_stub/messages و GET /_stub/stats و POST /_stub/reset
+- اختيارياً في ملف JSONL (record_path)
+"""
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# حدود تليغرام التي تُفرض مع enforce_limits
+GLOBAL_LIMIT_PER_SECOND = 30
+CHAT_INTERVAL_SECONDS = 1.0
+
+# سماحية تذبذب الشبكة بين أخذ الرمز عند العميل ووصول الطلب (تليغرام لا يقيس بدقة الميلي ثانية)
+LIMIT_TOLERANCE_SECONDS = 0.1
+
+
+class TelegramStub:
+    """خادم sendMessage وهمي مع حقن الأعطال وتسجيل الرسائل"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_limit_rate=0.0,
+                 retry_after=1, error_rate=0.0, error_status=502, forbidden_chats=(),
+                 enforce_limits=False, record_path=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.forbidden_chats = {str(chat_id) for chat_id in forbidden_chats}
+        self.enforce_limits = enforce_limits
+        self.record_path = record_path
+        self.messages = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._accepted = deque()  # أوقات الرسائل المقبولة خلال آخر ثانية (الحد العام)
+        self._chat_last = {}  # المحادثة → وقت آخر رسالة مقبولة
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # ---------------------------------------------------------------- التشغيل
+
+    def start(self):
+        """تشغيل الخادم في خيط خلفي"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='telegram-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ---------------------------------------------------------------- التسجيل
+
+    def reset(self):
+        with self._lock:
+            self.messages = []
+            self._accepted.clear()
+            self._chat_last.clear()
+
+    def stats(self):
+        """عدد الطلبات حسب رمز الرد وعدد المحادثات المختلفة"""
+        with self._lock:
+            messages = list(self.messages)
+        statuses = Counter(message['status'] for message in messages)
+        return {
+            'requests': len(messages),
+            'delivered': statuses.get(200, 0),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'chats': len({message['chat_id'] for message in messages if message['status'] == 200}),
+        }
+
+    def _record(self, chat_id, text, status):
+        message = {'chat_id': chat_id, 'text': text, 'status': status, 'received_at': time.time()}
+        with self._lock:
+            self.messages.append(message)
+            if self.record_path:
+                with open(self.record_path, 'a', encoding='utf-8') as record:
+                    record.write(json.dumps(message, ensure_ascii=False) + '\n')
+
+    # ------------------------------------------------------------------ الرد
+
+    def _limit_wait(self, chat_id, now):
+        """الثواني المطلوب انتظارها حسب حدود تليغرام، أو 0 مع تسجيل الرسالة كمقبولة"""
+        with self._lock:
+            while self._accepted and now - self._accepted[0] >= 1 - LIMIT_TOLERANCE_SECONDS:
+                self._accepted.popleft()
+            wait = 0.0
+            if len(self._accepted) >= GLOBAL_LIMIT_PER_SECOND:
+                wait = 1 - LIMIT_TOLERANCE_SECONDS - (now - self._accepted[0])
+            last = self._chat_last.get(chat_id)
+            if last is not None and now - last < CHAT_INTERVAL_SECONDS - LIMIT_TOLERANCE_SECONDS:
+                wait = max(wait, CHAT_INTERVAL_SECONDS - LIMIT_TOLERANCE_SECONDS - (now - last))
+            if wait <= 0:
+                self._accepted.append(now)
+                self._chat_last[chat_id] = now
+            return wait
+
+    def respond(self, chat_id, text):
+        """(رمز الرد، جسم JSON) لطلب sendMessage"""
+        delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if not chat_id:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat_id is empty'}
+        if chat_id in self.forbidden_chats:
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return self._too_many_requests(self.retry_after)
+        if roll < self.rate_limit_rate + self.error_rate:
+            return self.error_status, {'ok': False, 'error_code': self.error_status, 'description': 'Bad Gateway'}
+
+        if self.enforce_limits:
+            wait = self._limit_wait(chat_id, time.monotonic())
+            if wait > 0:
+                return self._too_many_requests(max(math.ceil(wait), 1))
+
+        with self._lock:
+            message_id = len(self.messages) + 1
+        return 200, {
+            'ok': True,
+            'result': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id},
+                'text': text,
+            },
+        }
+
+    def _too_many_requests(self, retry_after):
+        return 429, {
+            'ok': False,
+            'error_code': 429,
+            'description': f'Too Many Requests: retry after {retry_after}',
+            'parameters': {'retry_after': retry_after},
+        }
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _params(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    return json.loads(body or '{}')
+                params = parse_qs(urlparse(self.path).query)
+                params.update(parse_qs(body))
+                return {key: values[-1] for key, values in params.items()}
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/_stub/messages':
+                    with stub._lock:
+                        messages = list(stub.messages)
+                    self._reply(200, messages)
+                elif path == '/_stub/stats':
+                    self._reply(200, stub.stats())
+                elif path.endswith('/sendMessage'):
+                    self._send_message()
+                else:
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == '/_stub/reset':
+                    self._params()
+                    stub.reset()
+                    self._reply(200, {'ok': True})
+                elif path.endswith('/sendMessage'):
+                    self._send_message()
+                else:
+                    self._params()
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+            def _send_message(self):
+                try:
+                    params = self._params()
+                except ValueError:
+                    self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid body'})
+                    return
+                chat_id = str(params.get('chat_id') or '')
+                text = params.get('text', '')
+                status, body = stub.respond(chat_id, text)
+                stub._record(chat_id, text, status)
+                self._reply(status, body)
+
+        return Handler
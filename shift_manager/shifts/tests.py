@@ -1,3 +1,395 @@
-from django.test import TestCase
+import io
+import itertools
+import json
+import random
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from .catchup import commit_historical_rotations, missed_rotations
+from .locks import rotation_lock, rotation_lock_name
+from .management.commands.simulate_rotations import Command as SimulateRotationsCommand
+from .models import (
+    Employee, EmployeeAssignment, OutboxMessage, RotationCommit, Shift, Sonar, SystemSettings, WeeklyShiftAssignment,
+)
+from .outbox import BASE_BACKOFF_SECONDS, MAX_BACKOFF_SECONDS, backoff_delay, deliver_due_messages, due_messages
+from .rotation import RosterEntry, RotationPlan, SonarEntry, assign_sonars
+from .runs import RotationRecorder
+from .scheduler import next_wakeup
+from .scoring import priority_score, priority_scores
+from .telegram import DeliveryResult
+from .utils import (
+    check_and_send_early_notifications, commit_rotation_plan, create_default_shifts, rotate_within_shift,
+)
+
+
+def brute_force_cost(workers, sonars, recent_sonars):
+    """أقل تكلفة ممكنة بتجربة كل التوزيعات (نفس تعريف التكلفة في assign_sonars)"""
+    slot_sonars = [j for j, sonar in enumerate(sonars) for _ in range(sonar.max_employees)]
+    penalty_unit = len(workers) * len(slot_sonars) + 1
+    best = None
+    for chosen in set(itertools.permutations(slot_sonars, len(workers))):
+        total = sum(
+            assignment_cost(i, employee_id, sonars[j], j, sonars, recent_sonars, penalty_unit)
+            for i, (employee_id, j) in enumerate(zip(workers, chosen))
+        )
+        best = total if best is None else min(best, total)
+    return best
+
+
+def assignment_cost(i, employee_id, sonar, j, sonars, recent_sonars, penalty_unit):
+    start = sum(other.max_employees for other in sonars[:j])
+    end = start + sonar.max_employees - 1
+    distance = start - i if i < start else (i - end if i > end else 0)
+    history = recent_sonars.get(employee_id, ())
+    if sonar.sonar_id in history:
+        distance += (len(history) - history.index(sonar.sonar_id)) * penalty_unit
+    return distance
+
+
+class AssignSonarsTests(SimpleTestCase):
+    """التوزيع بأقل تكلفة مقارنة بالبحث الشامل على حالات صغيرة"""
+
+    def test_matches_brute_force_optimum(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            sonars = [
+                SonarEntry(sonar_id=100 + j, name=f'S{j}', max_employees=rng.randint(1, 2))
+                for j in range(rng.randint(1, 4))
+            ]
+            slots = sum(sonar.max_employees for sonar in sonars)
+            workers = list(range(1, rng.randint(1, slots) + 1))
+            recent_sonars = {
+                employee_id: rng.sample([sonar.sonar_id for sonar in sonars], rng.randint(0, len(sonars)))
+                for employee_id in workers
+            }
+
+            result = assign_sonars(workers, sonars, recent_sonars)
+
+            self.assertEqual(sorted(employee_id for employee_id, _ in result), workers)
+            for sonar in sonars:
+                self.assertLessEqual(sum(1 for _, sonar_id in result if sonar_id == sonar.sonar_id), sonar.max_employees)
+            penalty_unit = len(workers) * slots + 1
+            position = {employee_id: i for i, employee_id in enumerate(workers)}
+            index = {sonar.sonar_id: j for j, sonar in enumerate(sonars)}
+            cost = sum(
+                assignment_cost(position[employee_id], employee_id, sonars[index[sonar_id]], index[sonar_id],
+                                sonars, recent_sonars, penalty_unit)
+                for employee_id, sonar_id in result
+            )
+            self.assertEqual(cost, brute_force_cost(workers, sonars, recent_sonars))
+
+    def test_greedy_fallback_avoids_repeats(self):
+        sonars = [SonarEntry(sonar_id=100 + j, name=f'S{j}') for j in range(150)]
+        workers = list(range(1, 151))
+        recent_sonars = {employee_id: [99 + employee_id] for employee_id in workers}
+
+        with mock.patch('shifts.rotation.ASSIGN_SONARS_MAX_WORK', 0):
+            result = assign_sonars(workers, sonars, recent_sonars)
+
+        self.assertEqual(len({sonar_id for _, sonar_id in result}), len(workers))
+        self.assertFalse(any(sonar_id in recent_sonars[employee_id] for employee_id, sonar_id in result))
+
+
+class PriorityScoresTests(SimpleTestCase):
+    """الحساب المتجه يطابق حساب الموظف الواحد"""
+
+    def test_matches_priority_score(self):
+        rng = random.Random(3)
+        now = timezone.now()
+        roster = [
+            RosterEntry(
+                employee_id=i,
+                name=f'E{i}',
+                total_work_hours=rng.uniform(0, 200),
+                last_work_datetime=None if i % 5 == 0 else now - timedelta(minutes=rng.randint(1, 10000)),
+                consecutive_rest_count=rng.randint(0, 4),
+            )
+            for i in range(50)
+        ]
+        average = sum(entry.total_work_hours for entry in roster) / len(roster)
+
+        scores = priority_scores(roster, now=now)
+
+        for entry, score in zip(roster, scores):
+            expected = priority_score(
+                entry.total_work_hours, entry.last_work_datetime, entry.consecutive_rest_count, average, now
+            )
+            self.assertAlmostEqual(float(score), expected, places=6)
+
+    def test_empty_roster(self):
+        self.assertEqual(len(priority_scores([])), 0)
+
+
+class SimulateRotationsTests(TestCase):
+    """تشغيل المحاكاة على قائمة صغيرة والتحقق من مفاتيح المقاييس"""
+
+    def test_json_metrics(self):
+        out = io.StringIO()
+        # قاعدة بيانات الاختبار معزولة أصلاً، فلا داعي لاستبدال الاتصال بقاعدة في الذاكرة
+        with mock.patch.object(SimulateRotationsCommand, 'use_memory_database'):
+            call_command(
+                'simulate_rotations', '--employees', '9', '--sonars', '2', '--max-capacity', '1',
+                '--days', '1', '--json', stdout=out,
+            )
+
+        metrics = json.loads(out.getvalue())
+
+        self.assertLessEqual({
+            'rotations', 'wall_ms_mean', 'wall_ms_p95', 'wall_ms_max', 'queries_mean', 'queries_max',
+            'hours_spread', 'hours_stdev', 'max_consecutive_rest', 'sonar_repeat_rate', 'messages', 'weights',
+        }, set(metrics))
+        self.assertGreater(metrics['rotations'], 0)
+        self.assertEqual(
+            set(metrics['weights']), {'HOURS_SINCE_WORK_WEIGHT', 'NEVER_WORKED_BONUS', 'CONSECUTIVE_REST_WEIGHT'}
+        )
+
+
+class CommitRotationPlanTests(TestCase):
+    """تطبيق نفس الخطة مرتين لا يكرر السجلات ولا الساعات"""
+
+    def setUp(self):
+        self.shift, _ = Shift.objects.get_or_create(name='morning', defaults={'start_hour': 7, 'end_hour': 15})
+        self.sonars = [Sonar.objects.create(name=f'S{i}') for i in range(2)]
+        self.employees = [Employee.objects.create(name=f'E{i}', telegram_id=str(1000 + i)) for i in range(3)]
+        rotation_start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.plan = RotationPlan(
+            rotation_start=rotation_start,
+            rotation_hours=2.0,
+            work_slots=((self.employees[0].id, self.sonars[0].id), (self.employees[1].id, self.sonars[1].id)),
+            standby=(self.employees[2].id,),
+            hour_deltas=((self.employees[0].id, 2.0), (self.employees[1].id, 2.0)),
+        )
+
+    def commit(self):
+        employees_by_id = {employee.id: employee for employee in Employee.objects.all()}
+        sonars_by_id = {sonar.id: sonar for sonar in Sonar.objects.all()}
+        with transaction.atomic():
+            return commit_rotation_plan(self.plan, self.shift, employees_by_id, sonars_by_id, count_hours=True)
+
+    def test_commit_is_idempotent(self):
+        first = self.commit()
+        second = self.commit()
+
+        self.assertEqual([row.pk for row in first[0]], [row.pk for row in second[0]])
+        self.assertEqual([row.pk for row in first[1]], [row.pk for row in second[1]])
+        self.assertEqual(EmployeeAssignment.objects.filter(shift=self.shift).count(), 3)
+        self.assertEqual(RotationCommit.objects.filter(shift=self.shift).count(), 1)
+        worker, _, standby = [Employee.objects.get(pk=employee.pk) for employee in self.employees]
+        self.assertEqual(worker.total_work_hours, 2.0)
+        self.assertEqual(worker.last_work_datetime, self.plan.rotation_start)
+        self.assertEqual(standby.consecutive_rest_count, 1)
+
+    def test_unique_slot_ignores_concurrent_duplicates(self):
+        self.commit()
+        worker_id, sonar_id = self.plan.work_slots[0]
+        duplicates = [
+            EmployeeAssignment(employee_id=worker_id, sonar_id=sonar_id, shift=self.shift,
+                               assigned_at=self.plan.rotation_start),
+            EmployeeAssignment(employee_id=self.plan.standby[0], shift=self.shift,
+                               assigned_at=self.plan.rotation_start, is_standby=True),
+        ]
+
+        EmployeeAssignment.objects.bulk_create(duplicates, ignore_conflicts=True)
+
+        self.assertEqual(EmployeeAssignment.objects.filter(shift=self.shift).count(), 3)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            EmployeeAssignment.objects.create(
+                employee_id=self.plan.standby[0], shift=self.shift,
+                assigned_at=self.plan.rotation_start, is_standby=True,
+            )
+
+    def test_rotation_skipped_while_group_is_locked(self):
+        with rotation_lock(rotation_lock_name(self.shift.name)) as acquired:
+            self.assertTrue(acquired)
+            rotated = rotate_within_shift(
+                self.shift.name, 2.0, lead_time_minutes=30, next_rotation_time=self.plan.rotation_start,
+                is_early_notification=True, trigger='early_check',
+            )
+
+        self.assertFalse(rotated)
+        self.assertFalse(EmployeeAssignment.objects.exists())
+
+
+class CatchUpTests(TestCase):
+    """تبديل حي يحتسب فترة وسطى أثناء التعويض لا تُكتب فوقه حالة خطة التعويض"""
+
+    def setUp(self):
+        create_default_shifts()
+        # 4 خانات لـ 12 موظفاً: بعضهم يبقى احتياطاً في كل الفترات بعد الفترة المحجوزة
+        for i in range(2):
+            Sonar.objects.create(name=f'S{i}', max_employees=2)
+        employees = [Employee.objects.create(name=f'E{i}', telegram_id=str(1000 + i)) for i in range(12)]
+        today = timezone.localdate()
+        for shift in Shift.objects.all():
+            weekly = WeeklyShiftAssignment.objects.create(
+                shift=shift, week_start_date=today - timedelta(days=7), week_end_date=today + timedelta(days=7)
+            )
+            weekly.employees.set(employees)
+        self.settings = SystemSettings.get_current_settings()
+        self.settings.rotation_interval_hours = 3
+        self.settings.last_rotation_time = timezone.now() - timedelta(days=1)
+        self.settings.save()
+
+    def test_skips_state_of_period_committed_concurrently(self):
+        periods = missed_rotations(self.settings, timezone.now())[:4]
+        taken = periods[1]
+
+        with RotationRecorder('catch-up', trigger='catch_up') as run:
+            add_timings = run.add_timings
+
+            def live_rotation_commits_taken_period(timings):
+                # بعد التخطيط وقبل الكتابة: تبديل حي يحتسب الفترة الثانية
+                add_timings(timings)
+                RotationCommit.objects.create(
+                    key=RotationCommit.make_key(taken.shift, taken.rotation_at, None),
+                    shift=taken.shift, rotation_at=taken.rotation_at,
+                )
+                Employee.objects.update(last_work_datetime=taken.rotation_at, consecutive_rest_count=7)
+
+            run.add_timings = live_rotation_commits_taken_period
+            commit_historical_rotations(periods, self.settings, run)
+
+        self.assertFalse(EmployeeAssignment.objects.filter(assigned_at=taken.rotation_at).exists())
+        self.assertTrue(EmployeeAssignment.objects.filter(assigned_at=periods[0].rotation_at).exists())
+        for employee in Employee.objects.all():
+            # الحالة = نتيجة التبديل الحي ثم فترات التعويض التي تليه فقط
+            last_work, rest_count = taken.rotation_at, 7
+            later = EmployeeAssignment.objects.filter(
+                employee=employee, assigned_at__gt=taken.rotation_at
+            ).order_by('assigned_at')
+            for assignment in later:
+                if assignment.is_standby:
+                    rest_count += 1
+                else:
+                    last_work, rest_count = assignment.assigned_at, 0
+            self.assertEqual((employee.last_work_datetime, employee.consecutive_rest_count), (last_work, rest_count))
+            worked = EmployeeAssignment.objects.filter(employee=employee, is_standby=False)
+            self.assertAlmostEqual(employee.total_work_hours, sum(a.work_duration_hours for a in worked))
+
+
+class ReminderSchedulingTests(TestCase):
+    """التذكيرات تُجدول بلحظة ETA من last_reminder_at وتُرسل بدون تبديلات في نافذة الإشعار النهائي"""
+
+    def test_wakeup_at_next_reminder_and_reminder_sent(self):
+        settings = SystemSettings.get_current_settings()
+        settings.is_rotation_active = True
+        settings.early_notification_minutes = 30
+        settings.save()
+        now = timezone.now()
+        shift, _ = Shift.objects.get_or_create(name='morning', defaults={'start_hour': 7, 'end_hour': 15})
+        employee = Employee.objects.create(name='E0', telegram_id='1000')
+        assignment = EmployeeAssignment.objects.create(
+            employee=employee, shift=shift, sonar=Sonar.objects.create(name='S0'),
+            assigned_at=now + timedelta(minutes=20),
+        )
+        EmployeeAssignment.mark_notified([assignment], 'initial', 'employee', at=now - timedelta(minutes=3))
+
+        reminder_at = now + timedelta(minutes=7)
+        self.assertLessEqual(next_wakeup(settings, now), reminder_at)
+
+        with mock.patch('django.utils.timezone.now', return_value=reminder_at + timedelta(seconds=5)):
+            check_and_send_early_notifications()
+        self.assertEqual(OutboxMessage.objects.filter(category='reminder').count(), 1)
+        assignment.refresh_from_db()
+        self.assertTrue(assignment.has_notification('reminder', 'employee'))
+
+
+class FakeTelegramClient:
+    """عميل يرد حسب المحادثة ويوقف باقي رسائل المحادثة بعد الفشل (مثل deliver_many)"""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+
+    def deliver_many(self, messages, stop_on_failure=False):
+        results = []
+        stopped = set()
+        for chat_id, text in messages:
+            if chat_id in stopped:
+                results.append(None)
+                continue
+            failure = self.failures.get(chat_id)
+            if failure is None:
+                self.sent.append((chat_id, text))
+                results.append(DeliveryResult(True, 200, '', None, False))
+            else:
+                results.append(failure)
+                if stop_on_failure:
+                    stopped.add(chat_id)
+        return results
+
+
+class OutboxTests(TestCase):
+    """ترتيب رسائل كل محادثة وإعادة المحاولة بتأخير متزايد"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def message(self, chat_id, text, **fields):
+        return OutboxMessage.objects.create(chat_id=chat_id, text=text, next_attempt_at=self.now, **fields)
+
+    def test_backoff_delay(self):
+        self.assertEqual(backoff_delay(1), timedelta(seconds=BASE_BACKOFF_SECONDS))
+        self.assertEqual(backoff_delay(3), timedelta(seconds=BASE_BACKOFF_SECONDS * 4))
+        self.assertEqual(backoff_delay(20), timedelta(seconds=MAX_BACKOFF_SECONDS))
+        self.assertEqual(backoff_delay(1, retry_after=120), timedelta(seconds=120))
+
+    def test_due_messages_keep_chat_order(self):
+        waiting = self.message('1', 'a1')
+        waiting.next_attempt_at = self.now + timedelta(minutes=5)
+        waiting.save()
+        blocked = self.message('1', 'a2')
+        first = self.message('2', 'b1')
+        second = self.message('2', 'b2')
+        self.message('3', 'c1', status='sent')
+
+        due = due_messages(self.now)
+
+        self.assertEqual(due, [first, second])
+        self.assertNotIn(blocked, due)
+
+    def test_due_messages_skip_waiting_before_slicing(self):
+        waiting = [self.message(str(100 + i), 'waiting') for i in range(5)]
+        OutboxMessage.objects.filter(pk__in=[m.pk for m in waiting]).update(
+            next_attempt_at=self.now + timedelta(minutes=5)
+        )
+        ready = self.message('2', 'ready')
+
+        self.assertEqual(due_messages(self.now, batch_size=1), [ready])
+
+    def test_deliver_retries_with_backoff_and_keeps_order(self):
+        failing = self.message('1', 'a1')
+        queued_after = self.message('1', 'a2')
+        other = self.message('2', 'b1')
+        client = FakeTelegramClient({'1': DeliveryResult(False, 429, 'Too Many Requests', 90, False)})
+
+        with mock.patch('shifts.telegram.get_telegram_client', return_value=client):
+            stats = deliver_due_messages(now=self.now)
+
+        self.assertEqual(stats, {'sent': 1, 'retried': 1, 'dead': 0})
+        self.assertEqual(client.sent, [('2', 'b1')])
+        failing.refresh_from_db()
+        queued_after.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('pending', 1))
+        self.assertGreaterEqual(failing.next_attempt_at, self.now + timedelta(seconds=90))
+        self.assertEqual((queued_after.status, queued_after.attempts), ('pending', 0))
+        self.assertEqual(other.status, 'sent')
+        # a2 لا تُرسل قبل a1 حتى تنتهي مهلة إعادة المحاولة
+        self.assertEqual(due_messages(self.now + timedelta(seconds=60)), [])
+
+    def test_permanent_failure_is_dead(self):
+        blocked = self.message('1', 'a1')
+        client = FakeTelegramClient({'1': DeliveryResult(False, 403, 'Forbidden', None, True)})
+
+        with mock.patch('shifts.telegram.get_telegram_client', return_value=client):
+            stats = deliver_due_messages(now=self.now)
+
+        self.assertEqual(stats['dead'], 1)
+        blocked.refresh_from_db()
+        self.assertEqual(blocked.status, 'dead')
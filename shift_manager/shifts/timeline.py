@@ -0,0 +1,134 @@
+"""الجدول الزمني المحسوب مسبقاً للتبديلات (RotationTimelineEntry)
+
+يُولّد من الشفتات المحفوظة وإعدادات النظام لعدة أيام قادمة:
+وقت كل تبديل، نوعه (بداية شفت / دوري)، وقت الإشعار المبكر، وأوقات التذكير.
+
+الإبطال صريح: rebuild_rotation_timeline() عند حفظ الإعدادات أو تعديل الشفتات،
+و ensure_rotation_timeline() من المراقب لتمديد الجدول يومياً.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RotationTimelineEntry, Shift, SystemSettings
+from .shift_calendar import shift_bounds
+from .utils import REMINDER_INTERVAL_MINUTES, shift_rotation_times
+
+
+TIMELINE_DAYS = 7
+# الجدول يُمدد عندما يبقى أقل من هذا المدى مغطى
+TIMELINE_MIN_COVERAGE = timedelta(days=2)
+
+SHIFT_START_NOTICE_MINUTES = 10  # إشعار نهاية الشفت في rotate_shifts_task
+
+# نطاق تنفيذ الأحداث في rotate_shifts_task (±2 دقيقة)
+EVENT_WINDOW = timedelta(minutes=2)
+
+
+def lead_minutes_for(settings):
+    return max(int(settings.early_notification_minutes or 10), 0)
+
+
+def build_timeline_entries(shifts, settings, start, days=TIMELINE_DAYS):
+    """حساب مواعيد جميع الشفتات من الشفت الجاري عند start ولمدة days يوماً (بدون حفظ)"""
+    rotation_hours = settings.get_effective_rotation_hours()
+    lead = timedelta(minutes=lead_minutes_for(settings))
+    reminder_step = timedelta(minutes=REMINDER_INTERVAL_MINUTES)
+    horizon = start + timedelta(days=days)
+
+    entries = []
+    for shift in shifts:
+        shift_start, shift_end = shift_bounds(shift, start)
+        while shift_start < horizon:
+            rotation_times = shift_rotation_times(shift_start, shift_end, rotation_hours)
+            for index, rotation_at in enumerate(rotation_times):
+                is_shift_start = index == 0
+                notification_at = rotation_at - (
+                    timedelta(minutes=SHIFT_START_NOTICE_MINUTES) if is_shift_start else lead
+                )
+                reminders = []
+                reminder_at = rotation_at - lead + reminder_step
+                while reminder_at < rotation_at:
+                    reminders.append(reminder_at.isoformat())
+                    reminder_at += reminder_step
+                entries.append(RotationTimelineEntry(
+                    shift=shift,
+                    rotation_at=rotation_at,
+                    period_end=min(rotation_at + timedelta(hours=rotation_hours), shift_end),
+                    kind='shift_start' if is_shift_start else 'interval',
+                    notification_at=notification_at,
+                    reminder_times=reminders,
+                ))
+            shift_start += timedelta(days=1)
+            shift_end += timedelta(days=1)
+
+    entries.sort(key=lambda entry: entry.rotation_at)
+    return entries
+
+
+def rebuild_rotation_timeline(days=TIMELINE_DAYS, now=None):
+    """إعادة بناء الجدول الزمني بالكامل (إبطال صريح بعد تغيير الإعدادات أو الشفتات)
+
+    Returns:
+        عدد المواعيد المولدة
+    """
+    now = now or timezone.now()
+    settings = SystemSettings.get_current_settings()
+    entries = build_timeline_entries(list(Shift.objects.order_by('start_hour')), settings, now, days)
+
+    with transaction.atomic():
+        RotationTimelineEntry.objects.all().delete()
+        RotationTimelineEntry.objects.bulk_create(entries)
+
+    print(f"🗓️ تم بناء الجدول الزمني للتبديل: {len(entries)} موعد لـ {days} يوم")
+    return len(entries)
+
+
+def ensure_rotation_timeline(now=None):
+    """تمديد الجدول إذا كان فارغاً أو يقترب من نهايته"""
+    now = now or timezone.now()
+    last_entry = RotationTimelineEntry.objects.order_by('-rotation_at').only('rotation_at').first()
+    if last_entry is None or last_entry.rotation_at < now + TIMELINE_MIN_COVERAGE:
+        return rebuild_rotation_timeline(now=now)
+    return 0
+
+
+def upcoming_rotations(now=None, limit=6):
+    """المواعيد القادمة من الجدول (للوحة التحكم)"""
+    now = now or timezone.now()
+    return list(
+        RotationTimelineEntry.objects.filter(rotation_at__gt=now).select_related('shift').order_by('rotation_at')[:limit]
+    )
+
+
+def timeline_event_due(settings, now=None):
+    """هل يوجد تبديل أو إشعار مستحق الآن حسب الجدول؟
+
+    يُرجع True أيضاً عندما لا يمكن الحكم من الجدول (فارغ، أول تبديل، أو تبديل فائت
+    لم يُسجل في last_rotation_time) حتى تتولى rotate_shifts_task الحساب الكامل.
+    """
+    now = now or timezone.now()
+    if settings.last_rotation_time is None:
+        return True
+    if not RotationTimelineEntry.objects.filter(rotation_at__gt=now).exists():
+        return True
+
+    # تبديل فائت (عامل متوقف أو مهمة ضائعة)
+    latest_due = RotationTimelineEntry.objects.filter(
+        rotation_at__lte=now
+    ).order_by('-rotation_at').only('rotation_at').first()
+    if latest_due and settings.last_rotation_time < latest_due.rotation_at - timedelta(minutes=1):
+        return True
+
+    lead_minutes = lead_minutes_for(settings)
+    look_ahead = timedelta(minutes=max(lead_minutes, SHIFT_START_NOTICE_MINUTES)) + EVENT_WINDOW
+    nearby = RotationTimelineEntry.objects.filter(
+        rotation_at__gte=now - EVENT_WINDOW,
+        rotation_at__lte=now + look_ahead,
+    )
+    return any(
+        abs(event_at - now) <= EVENT_WINDOW
+        for entry in nearby
+        for event_at in entry.event_times(lead_minutes)
+    )
@@ -16,6 +16,7 @@ urlpatterns = [
     path('dashboard/admin/', views.admin_dashboard, name='admin_dashboard'),
     path('dashboard/manager/', views.manager_dashboard, name='manager_dashboard'),
     path('dashboard/supervisor/', views.supervisor_dashboard, name='supervisor_dashboard'),
+    path('dashboard/supervisor/shift-plan/', views.generate_shift_plan, name='generate_shift_plan'),
     path('dashboard/employee/', views.employee_dashboard, name='employee_dashboard'),
     
     # إدارة حسابات المديرين (سوبر أدمن فقط)
@@ -86,4 +87,5 @@ urlpatterns = [
     path('notifications/send/', views.send_custom_notification, name='send_custom_notification'),
     path('notifications/', views.custom_notifications_list, name='custom_notifications_list'),
     path('notifications/<int:pk>/', views.custom_notification_detail, name='custom_notification_detail'),
+    path('notifications/<int:pk>/progress/', views.custom_notification_progress, name='custom_notification_progress'),
 ]
@@ -1,13 +1,21 @@
-import random
-import requests
 import os
-from datetime import time, timedelta
+from datetime import timedelta
 from dotenv import load_dotenv
 
 from django.utils import timezone
-from django.db import models
-from .models import Shift, Sonar, Employee, EmployeeAssignment, WeeklyShiftAssignment, SystemSettings, EarlyNotification
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from .models import Sonar, Employee, EmployeeAssignment, Supervisor, SystemSettings, PlannedAssignment, WorkHoursAggregate, RotationCommit, RotationTimelineEntry
 from django.contrib.auth.models import User
+from .rotation import RosterEntry, SonarEntry, plan_rotation, plan_shift, plan_from_assignments
+from .locks import rotation_lock, rotation_lock_name
+from .runs import RotationRecorder
+from .shift_calendar import get_shift_calendar, shift_bounds
+from .telegram import get_telegram_client, paginate
+from .outbox import (
+    enqueue, enqueue_texts, notification_dedupe_key, notification_messages, outbox_message,
+)
 
 # تحميل ملف .env
 from pathlib import Path
@@ -25,25 +33,14 @@ if not BOT_TOKEN:
     print("⚠️ تحذير: TELEGRAM_BOT_TOKEN غير موجود في متغيرات البيئة!")
     print("   الإشعارات عبر Telegram لن تعمل حتى يتم إضافة Token في ملف .env")
 
+# تذكير كل 10 دقائق بين الإشعار الأولي والنهائي (scheduler.py يجدول لحظة التذكير القادم)
+REMINDER_INTERVAL_MINUTES = 10
+
 
 # 📨 دالة لإرسال رسالة إلى موظف عبر تليغرام
 def send_telegram_message(chat_id, text):
-    # التأكد أن الموظف لديه chat_id صالح
-    if not chat_id:
-        print("❌ الموظف لا يملك chat_id")
-        return
-
-    # عنوان API الخاص بتليغرام لإرسال الرسائل
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-
-    try:
-        # إرسال الطلب إلى خوادم تليغرام
-        response = requests.post(url, data=payload)
-        print(f"تم الإرسال للـ chat_id {chat_id}: {response.status_code}")
-    except Exception as e:
-        # في حال فشل الإرسال
-        print(f"❌ خطأ في إرسال التليغرام: {e}")
+    """إرسال رسالة تليغرام واحدة عبر العميل المشترك (اتصالات keep-alive ومهلة محددة)"""
+    return get_telegram_client(BOT_TOKEN).send(chat_id, text)
 
 
 def check_and_send_early_notifications():
@@ -68,7 +65,9 @@ def check_and_send_early_notifications():
     # 🆕 1. الإشعار الأولي (Initial Notification)
     # ============================================================
     try:
-        next_rotation = settings.get_next_rotation_time()
+        # الموعد القادم من الجدول الزمني المحسوب مسبقاً (مع الشفت المستهدف)
+        next_entry = RotationTimelineEntry.next_after(now)
+        next_rotation = next_entry.rotation_at if next_entry else settings.get_next_rotation_time()
         if next_rotation:
             # وقت الإشعار المستهدف
             notification_time = next_rotation - timedelta(minutes=lead_minutes)
@@ -77,45 +76,36 @@ def check_and_send_early_notifications():
             
             # نافذة الإشعار: ±2 دقيقة من وقت الإشعار
             if -2 <= diff_minutes <= 2:
-                 assignments_exist = EmployeeAssignment.objects.filter(
-                     assigned_at=next_rotation
+                 # التحقق من تسجيل أي إشعار أولي لهذا التبديل (بت في notification_flags)
+                 already_sent = EmployeeAssignment.notification_filter(
+                     EmployeeAssignment.objects.filter(assigned_at=next_rotation), 'initial'
                  ).exists()
                  
-                 already_sent = False
-                 if assignments_exist:
-                     # التحقق من إرسال أي إشعار أولي لهذا التبديل
-                     already_sent = EarlyNotification.objects.filter(
-                         assignment__assigned_at=next_rotation,
-                         notification_stage='initial'
-                     ).exists()
-                 
                  if not already_sent:
                      print(f"📢 حان وقت الإشعار الأولي! (التبديل: {next_rotation.strftime('%H:%M')}، الإشعار: {notification_time.strftime('%H:%M')})")
                      
                      # تحديد الشفت المستهدف
                      target_shift_name = None
-                     # 🔧 مهم: تحويل إلى التوقيت المحلي (بغداد) قبل استخراج الوقت
-                     next_rotation_local = timezone.localtime(next_rotation)
-                     t = next_rotation_local.time()
-                     
-                     # التحقق من حدود الشفتات (بداية الشفت التالي)
-                     if t.hour == 7 and t.minute == 0: target_shift_name = "morning"
-                     elif t.hour == 15 and t.minute == 0: target_shift_name = "evening"
-                     elif t.hour == 23 and t.minute == 0: target_shift_name = "night"
+                     if next_entry:
+                         target_shift_name = next_entry.shift.name
                      else:
-                         # داخل الشفت الحالي - باستخدام التوقيت المحلي
-                         if time(7, 0) <= t < time(15, 0): target_shift_name = "morning"
-                         elif time(15, 0) <= t < time(23, 0): target_shift_name = "evening"
-                         else: target_shift_name = "night"
+                         # الشفت الذي يبدأ عند التبديل أو يحتويه (من تقويم الشفتات)
+                         target_shift_name = get_shift_calendar().shift_name_at(next_rotation)
                      
                      if target_shift_name:
-                         rotate_within_shift(
-                             target_shift_name, 
-                             rotation_hours, 
-                             lead_time_minutes=lead_minutes, 
-                             next_rotation_time=next_rotation, 
-                             is_early_notification=True
-                         )
+                         # كل موقع بنفس قفل مهام المواقع (rotate_site_task) حتى لا يتكرر الإشعار
+                         sites = rotation_sites()
+                         for index, site in enumerate(sites if len(sites) > 1 else [None]):
+                             rotate_within_shift(
+                                 target_shift_name,
+                                 rotation_hours,
+                                 lead_time_minutes=lead_minutes,
+                                 next_rotation_time=next_rotation,
+                                 is_early_notification=True,
+                                 site=site,
+                                 cancel_expired=index == 0,
+                                 trigger='early_check'
+                             )
                          print("✅ تم تنفيذ الإشعار الأولي بنجاح")
     except Exception as e:
         print(f"❌ خطأ في فحص الإشعار الأولي: {e}")
@@ -138,95 +128,88 @@ def check_and_send_early_notifications():
 
     if not upcoming_assignments.exists():
         print("⏰ لا توجد تبديلات تحتاج إشعاراً نهائياً الآن")
+        send_due_reminders(now, lead_minutes)
         return
 
-    for assignment in upcoming_assignments:
-        if not assignment.sonar:
-            continue
+    with transaction.atomic():
+        # الرسائل تُجمع وتُكتب في صندوق الصادر دفعة واحدة مع تحديث الساعات في نفس المعاملة
+        outgoing = []
+        admin_notified = []
+        employee_notified = []
+        for assignment in upcoming_assignments:
+            if not assignment.sonar:
+                continue
 
-        work_hours = assignment.work_duration_hours or rotation_hours
-        assignment_end = assignment.assigned_at + timedelta(hours=work_hours)
-        assignment_start_local = timezone.localtime(assignment.assigned_at, current_tz)
-        assignment_end_local = timezone.localtime(assignment_end, current_tz)
-        minutes_until_start = int((assignment_start_local - now).total_seconds() / 60)
+            work_hours = assignment.work_duration_hours or rotation_hours
+            assignment_end = assignment.assigned_at + timedelta(hours=work_hours)
+            assignment_start_local = timezone.localtime(assignment.assigned_at, current_tz)
+            assignment_end_local = timezone.localtime(assignment_end, current_tz)
+            minutes_until_start = int((assignment_start_local - now).total_seconds() / 60)
 
-        if abs(minutes_until_start) > notifications_window_margin:
-            continue
+            if abs(minutes_until_start) > notifications_window_margin:
+                continue
 
-        admin_notification_exists = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_type='admin',
-            notification_stage='final'
-        ).exists()
-
-        employee_notification_exists = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_type='employee',
-            notification_stage='final'
-        ).exists()
-
-        period_label = f"{assignment_start_local.strftime('%H:%M')} - {assignment_end_local.strftime('%H:%M')}"
-
-        if not admin_notification_exists:
-            sonar_info = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
-            admin_message = (
-                "🔔 وقت التبديل الرسمي الآن!\n\n"
-                f"👤 الموظف: {assignment.employee.name}\n"
-                f"📡 السونار: {sonar_info}\n"
-                f"🕒 الفترة الرسمية: {period_label}\n"
-                f"⏳ تم تجهيز التبديل قبل {lead_minutes} دقيقة - هذا تذكير نهائي للمتابعة."
-            )
+            admin_notification_exists = assignment.has_notification('final', 'admin')
+            employee_notification_exists = assignment.has_notification('final', 'employee')
 
-            for admin in admins_and_supervisors:
-                if hasattr(admin, 'supervisor_profile') and admin.supervisor_profile.phone:
-                    send_telegram_message(admin.supervisor_profile.phone, admin_message)
-                elif admin.is_superuser:
-                    pass
-
-            EarlyNotification.objects.create(
-                assignment=assignment,
-                notification_type='admin',
-                notification_stage='final',
-                minutes_before=0
-            )
-            notifications_sent += 1
-            print(f"  ✅ إشعار نهائي للإدارة: {assignment.employee.name} ({period_label})")
+            period_label = f"{assignment_start_local.strftime('%H:%M')} - {assignment_end_local.strftime('%H:%M')}"
 
-        if assignment.employee.telegram_id and not employee_notification_exists:
+            if not admin_notification_exists:
+                sonar_info = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
+                admin_message = (
+                    "🔔 وقت التبديل الرسمي الآن!\n\n"
+                    f"👤 الموظف: {assignment.employee.name}\n"
+                    f"📡 السونار: {sonar_info}\n"
+                    f"🕒 الفترة الرسمية: {period_label}\n"
+                    f"⏳ تم تجهيز التبديل قبل {lead_minutes} دقيقة - هذا تذكير نهائي للمتابعة."
+                )
 
-            sonar_info = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
-            employee_message = (
-                "🔔 حان وقت التبديل الرسمي الآن!\n\n"
-                f"{assignment.employee.name}،\n\n"
-                f"📡 السونار: {sonar_info}\n"
+                admin_recipients = [
+                    (admin.supervisor_profile.phone, admin_message)
+                    for admin in admins_and_supervisors
+                    if hasattr(admin, 'supervisor_profile') and admin.supervisor_profile.phone
+                ]
+                outgoing.extend(notification_messages(assignment, 'admin', 'final', admin_recipients, category='final'))
+                admin_notified.append(assignment)
+                notifications_sent += 1
+                print(f"  ✅ إشعار نهائي للإدارة: {assignment.employee.name} ({period_label})")
+
+            if assignment.employee.telegram_id and not employee_notification_exists:
+
+                sonar_info = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
+                employee_message = (
+                    "🔔 حان وقت التبديل الرسمي الآن!\n\n"
+                    f"{assignment.employee.name}،\n\n"
+                    f"📡 السونار: {sonar_info}\n"
               
-                "✅ تم تجهيزك مسبقاً لتعرف مكانك. يرجى التوجه الآن والبدء في التبديل."
-            )
-
-            send_telegram_message(assignment.employee.telegram_id, employee_message)
+                    "✅ تم تجهيزك مسبقاً لتعرف مكانك. يرجى التوجه الآن والبدء في التبديل."
+                )
 
-            EarlyNotification.objects.create(
-                assignment=assignment,
-                notification_type='employee',
-                notification_stage='final',
-                minutes_before=0
-            )
+                outgoing.extend(notification_messages(
+                    assignment, 'employee', 'final',
+                    [(assignment.employee.telegram_id, employee_message)], category='final'
+                ))
+                employee_notified.append(assignment)
             
-            # ✅ تحديث ساعات العمل عند الإشعار النهائي
-            if not assignment.notification_sent and not assignment.is_standby:
-                emp = assignment.employee
-                emp.total_work_hours += work_hours
-                emp.last_work_datetime = assignment.assigned_at
-                emp.consecutive_rest_count = 0
-                emp.save()
+                # ✅ تحديث ساعات العمل عند الإشعار النهائي
+                if not assignment.notification_sent and not assignment.is_standby:
+                    emp = assignment.employee
+                    emp.total_work_hours += work_hours
+                    emp.last_work_datetime = assignment.assigned_at
+                    emp.consecutive_rest_count = 0
+                    emp.save()
                 
-                assignment.notification_sent = True
-                assignment.save(update_fields=['notification_sent'])
+                    assignment.notification_sent = True
+                    assignment.save(update_fields=['notification_sent'])
                 
-                print(f"  📊 تم تحديث ساعات {emp.name}: {emp.total_work_hours:.1f} ساعة (+{work_hours})")
+                    print(f"  📊 تم تحديث ساعات {emp.name}: {emp.total_work_hours:.1f} ساعة (+{work_hours})")
             
-            notifications_sent += 1
-            print(f"  ✅ إشعار نهائي للموظف: {assignment.employee.name} ({period_label})")
+                notifications_sent += 1
+                print(f"  ✅ إشعار نهائي للموظف: {assignment.employee.name} ({period_label})")
+
+        enqueue(outgoing)
+        EmployeeAssignment.mark_notified(admin_notified, 'final', 'admin')
+        EmployeeAssignment.mark_notified(employee_notified, 'final', 'employee')
 
     # ✅ التأكد من تحديث ساعات جميع التبديلات في النافذة الحالية (حتى بدون تليجرام)
     for assignment in upcoming_assignments:
@@ -234,12 +217,7 @@ def check_and_send_early_notifications():
             continue
         
         # التحقق من وجود إشعار نهائي
-        has_final = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_stage='final'
-        ).exists()
-        
-        if has_final:
+        if assignment.has_notification('final'):
             emp = assignment.employee
             work_hours = assignment.work_duration_hours or rotation_hours
             emp.total_work_hours += work_hours
@@ -257,84 +235,75 @@ def check_and_send_early_notifications():
     else:
         print("⏰ لا توجد تبديلات تحتاج إشعاراً نهائياً ضمن النافذة الحالية")
 
-    # ============================================================
-    # 🔔 منطق التذكيرات (Reminders) - بين الإشعار الأولي والنهائي
-    # ============================================================
-    # البحث عن التبديلات المستقبلية التي تم إرسال إشعار أولي لها لكن لم يحن موعدها بعد
-    
-    reminder_interval = 10  # تذكير كل 10 دقائق
-    
-    # التبديلات التي موعدها في المستقبل القريب (خلال فترة الإشعار المبكر)
-    active_future_assignments = EmployeeAssignment.objects.filter(
+    send_due_reminders(now, lead_minutes)
+
+
+def pending_reminders(now, lead_minutes):
+    """التبديلات التي ما زالت تنتظر تذكيرات (بغض النظر عن وقت آخر تذكير)
+
+    موعدها في المستقبل القريب (خلال فترة الإشعار المبكر)، سُجل لها الإشعار الأولي ولم
+    يُسجل الإشعار النهائي. محسوبة من أعمدة التبديل نفسه (notification_flags).
+    """
+    pending = EmployeeAssignment.objects.filter(
         assigned_at__gt=now,
         assigned_at__lte=now + timedelta(minutes=lead_minutes),
-        is_standby=False
-    ).distinct()
+        is_standby=False,
+        employee__telegram_id__isnull=False,
+    ).exclude(
+        employee__telegram_id=''
+    )
+    pending = EmployeeAssignment.notification_filter(pending, 'initial')
+    return EmployeeAssignment.notification_filter(pending, 'final', notified=False)
+
+
+def send_due_reminders(now, lead_minutes):
+    """
+    🔔 منطق التذكيرات (Reminders) - بين الإشعار الأولي والنهائي
+
+    تذكير لكل تبديل من pending_reminders مر على آخر إشعار له (الأولي أو تذكير)
+    REMINDER_INTERVAL_MINUTES دقيقة على الأقل (أو وقته غير معروف: إشعار أولي مسجل
+    بدون last_reminder_at).
+    """
+    reminder_candidates = pending_reminders(now, lead_minutes).filter(
+        Q(last_reminder_at__lte=now - timedelta(minutes=REMINDER_INTERVAL_MINUTES)) | Q(last_reminder_at__isnull=True),
+    ).select_related('employee', 'sonar')
     
     reminders_sent = 0
+    reminder_messages = []
+    reminded = []
     
-    for assignment in active_future_assignments:
-        # 1. التحقق من إرسال الإشعار الأولي
-        has_initial = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_stage='initial'
-        ).exists()
-        
-        if not has_initial:
-            continue
-            
-        # 2. التحقق من عدم إرسال إشعار نهائي
-        has_final = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_stage='final'
-        ).exists()
-        
-        if has_final:
-            continue
-            
-        # 3. التحقق من آخر تذكير (أو الإشعار الأولي إذا لم يوجد تذكير)
-        last_notification = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_stage__in=['initial', 'reminder']
-        ).order_by('-sent_at').first()
+    for assignment in reminder_candidates:
+        minutes_remaining = int((assignment.assigned_at - now).total_seconds() / 60)
+        sonar_name = assignment.sonar.name if assignment.sonar else "بدون سونار"
+        period_label = f"{assignment.assigned_at.strftime('%H:%M')}"
         
-        if not last_notification:
-            continue
-            
-        minutes_since_last = (now - last_notification.sent_at).total_seconds() / 60
-        
-        if minutes_since_last >= reminder_interval:
-            # إرسال تذكير
-            minutes_remaining = int((assignment.assigned_at - now).total_seconds() / 60)
-            sonar_name = assignment.sonar.name if assignment.sonar else "بدون سونار"
-            period_label = f"{assignment.assigned_at.strftime('%H:%M')}"
-            
-            # رسالة التذكير للموظف
-            if assignment.employee.telegram_id:
-                msg = (
-                    f"⏰ تذكير: اقترب موعد التبديل!\n\n"
-                    f"👤 الموظف: {assignment.employee.name}\n"
-                    f"📡 السونار: {sonar_name}\n"
-                    f"🕒 وقت التبديل: {period_label}\n"
-                    f"⏳ متبقي: {minutes_remaining} دقيقة\n\n"
-                    "يرجى الاستعداد للتوجه إلى موقعك."
-                )
-                send_telegram_message(assignment.employee.telegram_id, msg)
-                
-                # تسجيل التذكير
-                EarlyNotification.objects.create(
-                    assignment=assignment,
-                    notification_type='employee',
-                    notification_stage='reminder',
-                    minutes_before=minutes_remaining
-                )
-                reminders_sent += 1
-                print(f"  🔔 إرسال تذكير للموظف: {assignment.employee.name} (متبقي {minutes_remaining} دقيقة)")
-
+        # رسالة التذكير للموظف
+        msg = (
+            f"⏰ تذكير: اقترب موعد التبديل!\n\n"
+            f"👤 الموظف: {assignment.employee.name}\n"
+            f"📡 السونار: {sonar_name}\n"
+            f"🕒 وقت التبديل: {period_label}\n"
+            f"⏳ متبقي: {minutes_remaining} دقيقة\n\n"
+            "يرجى الاستعداد للتوجه إلى موقعك."
+        )
+        # التذكير يُسجل في notification_flags و last_reminder_at مع كتابته في صندوق الصادر
+        reminder_messages.extend(notification_messages(
+            assignment, 'employee', 'reminder',
+            [(assignment.employee.telegram_id, msg)],
+            minutes_before=minutes_remaining, category='reminder'
+        ))
+        reminded.append(assignment)
+        reminders_sent += 1
+        print(f"  🔔 إرسال تذكير للموظف: {assignment.employee.name} (متبقي {minutes_remaining} دقيقة)")
+
+    with transaction.atomic():
+        enqueue(reminder_messages)
+        EmployeeAssignment.mark_notified(reminded, 'reminder', 'employee', at=now)
     if reminders_sent > 0:
         print(f"📢 تم إرسال {reminders_sent} تذكير بنجاح")
+
 # 🔁 دالة تدوير الموظفين داخل الشفت (أي تبديل مواقعهم أو السونارات)
-def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, next_rotation_time=None, is_early_notification=False):
+def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, next_rotation_time=None, is_early_notification=False, site=None, cancel_expired=True, trigger='manual'):
     """
     تقوم هذه الدالة بتوزيع الموظفين على السونارات بشكل ذكي حسب سعة كل سونار
     مع إمكانية تجهيز التبديل قبل الوقت الرسمي بدقائق محددة.
@@ -345,7 +314,30 @@ def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, ne
         lead_time_minutes: دقائق التجهيز المبكر (للإشعار فقط)
         next_rotation_time: وقت التبديل القادم الفعلي (إذا لم يُحدد، يُحسب من بداية الشفت)
         is_early_notification: إذا كان True، يتم إرسال الإشعار فقط دون تحديث last_rotation_time
+        site: تبديل سونارات وموظفي موقع واحد فقط (None = جميع المواقع)
+        cancel_expired: رفض التبديلات المنتهية قبل البدء (يُعطل عند تنفيذ المواقع بالتوازي)
+        trigger: سبب التشغيل (shift_end / interval / first_run / early_check / manual) لسجل RotationRun
+
+    القفل لكل (شفت، موقع) يجمع كل المستدعين (مهمة التبديل، مهام المواقع، فحص الإشعار
+    المبكر، الواجهة)، فلا يكتب عاملان سجلات ورسائل نفس الفترة في نفس الوقت.
+
+    Returns:
+        False إذا كان تبديل نفس المجموعة قيد التنفيذ من عامل آخر، وإلا True
     """
+    with rotation_lock(rotation_lock_name(shift_name, site)) as acquired:
+        if not acquired:
+            print(f"⏸️ تبديل الشفت {shift_name} (الموقع {site or 'الافتراضي'}) قيد التنفيذ من عامل آخر. تجاهل...")
+            return False
+        with RotationRecorder(shift_name, trigger, site, is_early_notification) as run:
+            _rotate_within_shift(
+                run, shift_name, rotation_hours, lead_time_minutes, next_rotation_time,
+                is_early_notification, site, cancel_expired
+            )
+    return True
+
+
+def _rotate_within_shift(run, shift_name, rotation_hours, lead_time_minutes, next_rotation_time, is_early_notification, site, cancel_expired):
+    """تنفيذ التبديل مع تسجيل زمن كل مرحلة في run (RotationRecorder)"""
     if is_early_notification:
         print(f"📢 إرسال إشعار مبكر للشفت: {shift_name} (قبل {lead_time_minutes} دقيقة)")
     else:
@@ -362,28 +354,27 @@ def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, ne
         print(f"📊 استخدام فترة التبديل المحددة: {rotation_hours} ساعة")
 
     # ❌ رفض التبديلات السابقة غير المؤكدة قبل البدء بالتبديل الجديد
-    print("\n🔍 فحص التبديلات السابقة غير المؤكدة...")
-    rejected_count = cancel_expired_confirmations()
-    if rejected_count > 0:
-        print(f"❌ تم رفض {rejected_count} تبديل غير مؤكد من الفترة السابقة\n")
+    if cancel_expired:
+        print("\n🔍 فحص التبديلات السابقة غير المؤكدة...")
+        with run.phase('cancel_expired'):
+            rejected_count = cancel_expired_confirmations()
+        if rejected_count > 0:
+            print(f"❌ تم رفض {rejected_count} تبديل غير مؤكد من الفترة السابقة\n")
 
     # استخدام الوقت المحلي (Asia/Baghdad)
     now_actual = timezone.localtime(timezone.now())
     
-    # 🕒 الحصول على الشفت الحالي من قاعدة البيانات
-    try:
-        shift = Shift.objects.get(name__iexact=shift_name.strip())
-    except Shift.DoesNotExist:
+    # 🕒 الحصول على الشفت من تقويم الشفتات
+    shift = get_shift_calendar().get(shift_name)
+    if shift is None:
         print(f"❌ الشفت {shift_name} غير موجود")
+        run.skip(f"الشفت {shift_name} غير موجود")
         return
 
     # حساب وقت التبديل القادم
     if next_rotation_time is None:
-        # إذا لم يُحدد وقت التبديل، نحسبه من بداية الشفت
-        shift_start = now_actual.replace(hour=shift.start_hour, minute=0, second=0, microsecond=0)
-        if shift.end_hour <= shift.start_hour and now_actual.hour < shift.start_hour:
-            # شفت ليلي - قد يكون shift_start في اليوم السابق
-            shift_start -= timedelta(days=1)
+        # إذا لم يُحدد وقت التبديل، نحسبه من بداية الشفت (الليلي قد يبدأ في اليوم السابق)
+        shift_start, _ = shift_bounds(shift, now_actual)
         
         hours_since_start = (now_actual - shift_start).total_seconds() / 3600
         rotation_index = int(hours_since_start // rotation_hours)
@@ -397,327 +388,544 @@ def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, ne
         current_rotation_start = next_rotation_local
         print(f"⏰ وقت التبديل الفعلي: {next_rotation_local.strftime('%H:%M')} → الفترة الرسمية: {official_rotation_start.strftime('%H:%M')}")
 
-    # تحديد بداية ونهاية الشفت بالساعة
-    shift_start = current_rotation_start.replace(hour=shift.start_hour, minute=0, second=0, microsecond=0)
-    shift_end = current_rotation_start.replace(hour=shift.end_hour, minute=0, second=0, microsecond=0)
-
-    # في حال الشفت الليلي (ينتهي بعد منتصف الليل)
-    if shift.end_hour <= shift.start_hour:
-        shift_end += timedelta(days=1)
-        if current_rotation_start.hour < shift.start_hour:
-            shift_start -= timedelta(days=1)
+    # تحديد بداية ونهاية الشفت (الليلي ينتهي بعد منتصف الليل)
+    shift_start, shift_end = shift_bounds(shift, current_rotation_start)
     
     # حساب نهاية الفترة الرسمية (لا تتجاوز نهاية الشفت)
     calculated_window_end = official_rotation_start + timedelta(hours=rotation_hours)
     # استخدام نهاية الشفت كحد أقصى للفترة الرسمية
     official_window_end = min(calculated_window_end, shift_end)
     official_window_label = f"{official_rotation_start.strftime('%H:%M')} → {official_window_end.strftime('%H:%M')}"
+    run.set_target(shift, official_rotation_start)
+
+    with run.phase('roster_load'):
+        # 🔍 جلب جميع السونارات (Sonar) النشطة فقط
+        active_sonars = load_active_sonars(site)
+        # 🧑‍💼 جمع جميع الموظفين الذين يعملون في هذا الشفت وغير مجازين
+        employees = load_shift_roster(shift, current_rotation_start.date(), site) if active_sonars else []
 
-    # 🔍 جلب جميع السونارات (Sonar) النشطة فقط
-    active_sonars = list(Sonar.objects.filter(active=True))
     if not active_sonars:
         print(f"❌ لا يوجد سونارات فعالة للشفت {shift.name}")
+        run.skip('لا يوجد سونارات فعالة')
         return
-
-    # 🔎 البحث عن توزيع الأسبوع الحالي للشفت (WeeklyShiftAssignment)
-    assignments = WeeklyShiftAssignment.objects.filter(
-        shift=shift,
-        week_start_date__lte=current_rotation_start.date(),
-        week_end_date__gte=current_rotation_start.date()
-    )
-
-    # 🧑‍💼 جمع جميع الموظفين الذين يعملون في هذا الشفت وغير مجازين
-    employees = []
-    for assignment in assignments:
-        employees.extend([emp for emp in assignment.employees.all() if not emp.is_on_leave])
-
     if not employees:
         print(f"⚠️ لا يوجد موظفين متاحين للشفت {shift.name}")
+        run.skip('لا يوجد موظفين متاحين')
         return
 
+    employees_by_id = {emp.id: emp for emp in employees}
+    sonars_by_id = {sonar.id: sonar for sonar in active_sonars}
 
+    # ♻️ إعادة استخدام الخطة المحفوظة لنفس الفترة (مثلاً من الإشعار المبكر)
+    # حتى لا يتغير السونار الذي أُبلغ به الموظف مسبقاً
+    with run.phase('roster_load'):
+        plan = load_saved_plan(shift, current_rotation_start, rotation_hours, employees_by_id, sonars_by_id)
+    if plan:
+        print(f"\n♻️ إعادة استخدام خطة التبديل المحفوظة للفترة ({official_window_label})")
+    else:
+        # 🎯 نظام التبديل العادل - تخطيط التوزيع كاملاً في الذاكرة
+        print(f"\n📊 حساب أولويات الموظفين للتبديل العادل ({official_window_label})...")
+        with run.phase('roster_load'):
+            recent_sonars = load_sonar_history(
+                employees_by_id.keys(),
+                current_rotation_start,
+                settings.sonar_history_depth
+            )
+        plan_timings = {}
+        plan = plan_rotation(
+            [RosterEntry.from_employee(emp) for emp in employees],
+            [SonarEntry.from_sonar(sonar) for sonar in active_sonars],
+            current_rotation_start,
+            rotation_hours,
+            now=timezone.now(),
+            recent_sonars=recent_sonars,
+            timings=plan_timings,
+        )
+        run.add_timings(plan_timings)
 
-    # 🎯 نظام التبديل العادل - ترتيب الموظفين حسب الأولوية
-    print(f"\n📊 حساب أولويات الموظفين للتبديل العادل ({official_window_label})...")
-    
-    # حساب متوسط ساعات العمل لجميع الموظفين
-    total_work_hours = sum(emp.total_work_hours for emp in employees)
-    avg_work_hours = total_work_hours / len(employees) if len(employees) > 0 else 0.0
-    print(f"  📊 متوسط ساعات العمل للجميع: {avg_work_hours:.1f} ساعة")
-    
-    # حساب نقاط الأولوية لكل موظف
-    employee_priorities = []
-    for emp in employees:
-        priority_score = emp.get_priority_score(avg_work_hours)
-        diff_from_avg = emp.total_work_hours - avg_work_hours
-        employee_priorities.append((emp, priority_score))
-        
-        # رمز الحالة
-        if diff_from_avg < -1:
-            status = "🔺 يحتاج عمل"
-        elif diff_from_avg > 1:
-            status = "🔻 يحتاج راحة"
-        else:
-            status = "⚖️ متوازن"
-        
-        print(f"  📌 {emp.name}: نقاط={priority_score:.1f} | عمل={emp.total_work_hours:.1f}س | فرق عن المتوسط={diff_from_avg:+.1f}س | {status}")
-    
-    # ترتيب الموظفين حسب الأولوية (الأقل نقاطاً = الأعلى أولوية للعمل)
-    employee_priorities.sort(key=lambda x: x[1])
-    sorted_employees = [emp for emp, score in employee_priorities]
-    
-    print("\n🔄 ترتيب الأولوية للعمل (من الأعلى للأقل):")
-    for i, (emp, score) in enumerate(employee_priorities[:10], 1):  # عرض أول 10 فقط
-        diff = emp.total_work_hours - avg_work_hours
-        print(f"  {i}. {emp.name} (نقاط: {score:.1f} | عمل: {emp.total_work_hours:.1f}س | فرق: {diff:+.1f}س)")
-    
-    # حساب إجمالي المقاعد المتاحة في جميع السونارات
-    total_available_slots = sum(sonar.max_employees for sonar in active_sonars)
-    
-    print(f"\n📍 إجمالي المقاعد المتاحة: {total_available_slots}")
-    print(f"📍 إجمالي الموظفين: {len(sorted_employees)}")
-    
-    # تقسيم الموظفين إلى: عاملين + احتياط
-    working_employees = sorted_employees[:total_available_slots]
-    standby_employees = sorted_employees[total_available_slots:]
-    
-    print(f"\n✅ الموظفين العاملين: {len(working_employees)}")
-    print(f"💤 الموظفين في الاحتياط: {len(standby_employees)}")
-    
-    # 📊 قاموس لتتبع عدد الموظفين المعينين لكل سونار
-    sonar_assignment_count = {sonar.id: 0 for sonar in active_sonars}
-    
-    # خلط السونارات لتوزيع عشوائي عادل
-    shuffled_sonars = active_sonars.copy()
-    random.shuffle(shuffled_sonars)
-    
-    # 📝 قوائم لتتبع التوزيع
-    work_assignments = []  # (موظف, سونار)
-    standby_assignments = []  # موظف
-    
-    # 🎯 المرحلة الأولى: توزيع الموظفين العاملين على السونارات
-    print("\n📍 المرحلة 1: توزيع الموظفين على السونارات حسب الأولوية...")
-    
-    # 🔍 جلب السونارات السابقة للموظفين (التبديل السابق فقط) لتجنب التكرار
-    employee_last_sonars = {}
+        print("\n🔄 ترتيب الأولوية للعمل (من الأعلى للأقل):")
+        for i, (employee_id, score) in enumerate(plan.priority[:10], 1):  # عرض أول 10 فقط
+            emp = employees_by_id[employee_id]
+            print(f"  {i}. {emp.name} (نقاط: {score:.1f} | عمل: {emp.total_work_hours:.1f}س)")
+
+    print(f"\n✅ الموظفين العاملين: {len(plan.work_slots)}")
+    print(f"💤 الموظفين في الاحتياط: {len(plan.standby)}")
+
+    # 📨 تجهيز الإشعارات
+    now_actual = timezone.localtime(timezone.now())
+    # حساب الوقت المتبقي حتى بداية الفترة الرسمية (للإشعار)
+    time_until_start = (official_rotation_start - now_actual).total_seconds() / 60
+    notification_stage = 'initial' if is_early_notification else 'final'
+    notify_workers = not is_early_notification or time_until_start > 0
+
+    # 💾 تطبيق الخطة بعدد ثابت من الاستعلامات داخل معاملة واحدة مع رسائلها، والمرحلتان
+    # متتاليتان (لا تتداخلان) حتى لا يُحسب زمن الإشعارات ضمن الحفظ
+    with transaction.atomic():
+        with run.phase('persistence'):
+            work_rows, standby_rows = commit_rotation_plan(
+                plan,
+                shift,
+                employees_by_id,
+                sonars_by_id,
+                count_hours=not is_early_notification,
+                site=site,
+            )
+
+            if not is_early_notification:
+                # تفعيل خانات الفترة المخططة مسبقاً (إن وجدت)
+                PlannedAssignment.objects.filter(
+                    shift=shift,
+                    rotation_at=current_rotation_start,
+                    employee_id__in=employees_by_id.keys(),
+                    activated=False
+                ).update(activated=True)
+
+        # 📨 الإشعارات الجديدة فقط (تجنب تكرار نفس المرحلة لنفس التبديل) تُكتب في صندوق
+        # الصادر ضمن نفس المعاملة، ويرسلها عامل notifications بعد نجاحها
+        with run.phase('notifications'):
+            notification_targets = list(work_rows) if notify_workers else []
+            notification_targets.extend(
+                assignment for assignment in standby_rows if assignment.employee.telegram_id
+            )
+            minutes_before = 0 if not is_early_notification else max(int(time_until_start), 0)
+            new_targets = [
+                assignment for assignment in notification_targets
+                if not assignment.has_notification(notification_stage, 'employee')
+            ]
+            new_notifications = {assignment.id for assignment in new_targets}
+            queue_rotation_notifications(
+                shift,
+                [row for row in work_rows if row.id in new_notifications],
+                [row for row in standby_rows if row.id in new_notifications],
+                official_window_label,
+                time_until_start,
+                is_early_notification,
+                notification_stage,
+                minutes_before,
+            )
+            EmployeeAssignment.mark_notified(new_targets, notification_stage, 'employee', at=now_actual)
+
+    print(f"\n📤 تم تجهيز {len(new_notifications)} إشعار للإرسال")
+    run.set_counts(workers=len(work_rows), standby=len(standby_rows), notifications=len(new_notifications))
+
+    # ✅ تأكيد اكتمال العملية بنجاح
+    print(f"\n✅ تم توزيع {len(work_rows)} موظف للعمل في الشفت {shift.name}")
+    print(f"💤 تم تسجيل {len(standby_rows)} موظف في حالة احتياط")
+    print(f"⏰ الفترة الرسمية: {official_window_label}")
+
+    # ملاحظة: last_rotation_time يُحدث في tasks.py بناءً على الوقت الرسمي
     if not is_early_notification:
-        # حساب وقت التبديل السابق
-        previous_rotation_time = current_rotation_start - timedelta(hours=rotation_hours)
-        
-        for emp in working_employees:
-            # البحث عن التبديل السابق للموظف في نفس الشفت
-            previous_assignment = EmployeeAssignment.objects.filter(
-                employee=emp,
+        print(f"🕐 التبديل الرسمي: {official_rotation_start.strftime('%Y-%m-%d %H:%M')}")
+    else:
+        print(f"📢 تم إرسال الإشعار المبكر فقط (الوقت الرسمي: {official_rotation_start.strftime('%H:%M')})")
+
+    # 📊 عرض ملخص التوزيع
+    sonar_assignment_count = {sonar.id: 0 for sonar in active_sonars}
+    for _, sonar_id in plan.work_slots:
+        sonar_assignment_count[sonar_id] += 1
+    print("\n📊 ملخص التوزيع:")
+    print("="*60)
+    for sonar in active_sonars:
+        print(f"  🏢 {sonar.name}: {sonar_assignment_count[sonar.id]}/{sonar.max_employees} موظف")
+    print(f"  👥 إجمالي الموظفين: {len(employees)}")
+    print("="*60)
+
+
+def rotation_sites():
+    """المواقع التي لديها سونارات نشطة (كل موقع مجموعة تبديل مستقلة)"""
+    return list(
+        Sonar.objects.filter(active=True).order_by('site').values_list('site', flat=True).distinct()
+    )
+
+
+def load_active_sonars(site=None):
+    """السونارات النشطة (لموقع واحد إذا حُدد)"""
+    sonars = Sonar.objects.filter(active=True)
+    if site is not None:
+        sonars = sonars.filter(site=site)
+    return list(sonars.order_by('id'))
+
+
+def load_shift_roster(shift, on_date, site=None):
+    """الموظفون المتاحون (غير المجازين) في الجدولة الأسبوعية للشفت في تاريخ معين"""
+    filters = {
+        'weeklyshiftassignment__shift': shift,
+        'weeklyshiftassignment__week_start_date__lte': on_date,
+        'weeklyshiftassignment__week_end_date__gte': on_date,
+    }
+    if site is not None:
+        filters['weeklyshiftassignment__site'] = site
+    return list(
+        Employee.objects.filter(is_on_leave=False, **filters).distinct().order_by('id')
+    )
+
+
+def load_sonar_history(employee_ids, before, depth):
+    """آخر depth سونارات لكل موظف قبل وقت معين - باستعلام واحد
+
+    يستخدم دالة نافذة (ROW_NUMBER مقسمة حسب الموظف ومرتبة من الأحدث)
+    بدلاً من استعلام لكل موظف، ولا يعتمد على تطابق وقت التبديل السابق بالضبط
+    (يبقى صحيحاً بعد تغيير فترة التبديل).
+
+    Returns:
+        قاموس employee_id → tuple من sonar_id (من الأحدث للأقدم)
+    """
+    if depth <= 0:
+        return {}
+
+    rows = EmployeeAssignment.objects.filter(
+        employee_id__in=list(employee_ids),
+        assigned_at__lt=before,
+        is_standby=False,
+        sonar__isnull=False
+    ).annotate(
+        history_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('employee_id')],
+            order_by=[F('assigned_at').desc(), F('id').desc()],
+        )
+    ).filter(history_rank__lte=depth).order_by('employee_id', 'history_rank').values_list('employee_id', 'sonar_id')
+
+    history = {}
+    for employee_id, sonar_id in rows:
+        history.setdefault(employee_id, []).append(sonar_id)
+    return {employee_id: tuple(sonars) for employee_id, sonars in history.items()}
+
+
+def load_saved_plan(shift, rotation_start, rotation_hours, employees_by_id, sonars_by_id):
+    """بناء RotationPlan من التبديلات المحفوظة مسبقاً لنفس الفترة (أو None)
+
+    الأولوية للتبديلات المنفذة (EmployeeAssignment) ثم الخانات المخططة مسبقاً
+    من تخطيط الشفت الكامل (PlannedAssignment).
+    """
+    fields = ('employee_id', 'sonar_id', 'is_standby', 'work_duration_hours')
+    # سجلات هذه المجموعة فقط: موظفوها أو سوناراتها (عند تقسيم المواقع)
+    in_group = Q(employee_id__in=list(employees_by_id)) | Q(sonar_id__in=list(sonars_by_id))
+    sources = (
+        EmployeeAssignment.objects.filter(in_group, shift=shift, assigned_at=rotation_start),
+        PlannedAssignment.objects.filter(in_group, shift=shift, rotation_at=rotation_start),
+    )
+    for saved in sources:
+        plan = plan_from_assignments(
+            saved.order_by('id').only(*fields),
+            rotation_start,
+            rotation_hours,
+            roster_ids=employees_by_id.keys()
+        )
+        if plan is None:
+            continue
+        if all(sonar_id in sonars_by_id for _, sonar_id in plan.work_slots):
+            return plan
+        return None
+    return None
+
+
+def shift_rotation_times(shift_start, shift_end, rotation_hours, lock_window_minutes=59):
+    """أوقات بداية جميع فترات التبديل داخل الشفت
+
+    نفس قواعد rotate_shifts_task: الفترات تبدأ من بداية الشفت كل rotation_hours،
+    ولا يبدأ تبديل دوري في آخر lock_window_minutes دقيقة من الشفت.
+    """
+    if rotation_hours <= 0:
+        return []
+    interval = timedelta(hours=rotation_hours)
+    lock_window = timedelta(minutes=lock_window_minutes)
+    times = [shift_start]
+    next_time = shift_start + interval
+    while next_time < shift_end and shift_end - next_time > lock_window:
+        times.append(next_time)
+        next_time += interval
+    return times
+
+
+def plan_whole_shift(shift_name, shift_start=None, replan=False, site=None):
+    """تخطيط جميع فترات الشفت دفعة واحدة وحفظها كخانات PlannedAssignment
+
+    الفترات التي تم تنفيذها (لها EmployeeAssignment) أو تفعيلها لا تتغير؛
+    تُخطط الفترات المتبقية فقط على الحالة المتوقعة للموظفين.
+
+    Args:
+        shift_name: اسم الشفت
+        shift_start: بداية الشفت (افتراضياً الشفت الحالي الذي يحتوي الوقت الحالي)
+        replan: إعادة تخطيط الفترات غير المفعلة حتى لو كانت مخططة مسبقاً
+        site: تخطيط موقع واحد فقط (None = جميع المواقع)
+
+    Returns:
+        عدد الفترات التي تم تخطيطها
+    """
+    shift = get_shift_calendar().get(shift_name)
+    if shift is None:
+        print(f"❌ الشفت {shift_name} غير موجود")
+        return 0
+
+    settings = SystemSettings.get_current_settings()
+    rotation_hours = settings.get_effective_rotation_hours()
+    shift_start, shift_end = shift_bounds(shift, shift_start or timezone.now())
+    period_starts = shift_rotation_times(shift_start, shift_end, rotation_hours)
+
+    active_sonars = load_active_sonars(site)
+    employees = load_shift_roster(shift, shift_start.date(), site)
+    if not active_sonars or not employees:
+        print(f"⚠️ لا يمكن تخطيط الشفت {shift.name}: لا يوجد سونارات فعالة أو موظفين متاحين")
+        return 0
+    employee_ids = [emp.id for emp in employees]
+    in_group = Q(employee_id__in=employee_ids) | Q(sonar_id__in=[sonar.id for sonar in active_sonars])
+
+    # الفترات المنفذة أو المفعلة مسبقاً ثابتة
+    executed = set(
+        EmployeeAssignment.objects.filter(
+            in_group, shift=shift, assigned_at__gte=shift_start, assigned_at__lt=shift_end
+        ).values_list('assigned_at', flat=True).distinct()
+    )
+    planned = PlannedAssignment.objects.filter(
+        in_group, shift=shift, rotation_at__gte=shift_start, rotation_at__lt=shift_end
+    )
+    executed.update(planned.filter(activated=True).values_list('rotation_at', flat=True).distinct())
+    if not replan:
+        executed.update(planned.values_list('rotation_at', flat=True).distinct())
+
+    pending_starts = [start for start in period_starts if start not in executed]
+    if not pending_starts:
+        print(f"📋 جميع فترات الشفت {shift.name} مخططة مسبقاً")
+        return 0
+
+    plans = plan_shift(
+        [RosterEntry.from_employee(emp) for emp in employees],
+        [SonarEntry.from_sonar(sonar) for sonar in active_sonars],
+        pending_starts,
+        rotation_hours,
+        shift_end,
+        recent_sonars=load_sonar_history(employee_ids, pending_starts[0], settings.sonar_history_depth),
+        history_depth=settings.sonar_history_depth,
+    )
+
+    rows = []
+    for plan in plans:
+        hours = dict(plan.hour_deltas)
+        rows.extend(
+            PlannedAssignment(
                 shift=shift,
-                assigned_at=previous_rotation_time,
-                is_standby=False
-            ).select_related('sonar').first()
-            
-            if previous_assignment and previous_assignment.sonar:
-                employee_last_sonars[emp.id] = previous_assignment.sonar.id
-    
-    employee_index = 0
-    for sonar in shuffled_sonars:
-        for slot in range(sonar.max_employees):
-            if employee_index >= len(working_employees):
-                break
-            
-            emp = working_employees[employee_index]
-            
-            # 🔒 التحقق: تجنب نفس السونار من التبديل السابق (فقط في التبديلين المتتاليين)
-            if emp.id in employee_last_sonars and employee_last_sonars[emp.id] == sonar.id:
-                # نفس السونار - نبحث عن موظف بديل من نفس قائمة العاملين
-                found_alternative = False
-                for alt_index in range(employee_index + 1, len(working_employees)):
-                    alt_emp = working_employees[alt_index]
-                    # التحقق إذا كان الموظف البديل ليس في نفس السونار السابق
-                    if alt_emp.id not in employee_last_sonars or employee_last_sonars[alt_emp.id] != sonar.id:
-                        # استبدال الموظفين في القائمة (لا يؤثر على الأولوية أو الساعات)
-                        working_employees[employee_index], working_employees[alt_index] = working_employees[alt_index], working_employees[employee_index]
-                        emp = working_employees[employee_index]
-                        found_alternative = True
-                        print(f"  🔄 تم استبدال {emp.name} لتجنب تكرار السونار {sonar.name}")
-                        break
-                
-                # إذا لم نجد بديل، نترك الموظف في نفس السونار (نادر الحدوث)
-                if not found_alternative:
-                    print(f"  ⚠️ {emp.name} سيُوضع في {sonar.name} مرة أخرى (لا يوجد بديل متاح)")
-            
-            # 🧾 حفظ التعيين الجديد في قاعدة البيانات (أو استخدام الموجود)
-            # ✅ التأكيد التلقائي: جميع التبديلات مؤكدة تلقائياً
-            assignment, created = EmployeeAssignment.objects.get_or_create(
-                employee=emp,
-                sonar=sonar,
+                rotation_at=plan.rotation_start,
+                employee_id=employee_id,
+                sonar_id=sonar_id,
+                work_duration_hours=hours[employee_id],
+            )
+            for employee_id, sonar_id in plan.work_slots
+        )
+        rows.extend(
+            PlannedAssignment(
                 shift=shift,
-                assigned_at=current_rotation_start,
-                defaults={
-                    'rotation_number': 0,
-                    'is_standby': False,
-                    'work_duration_hours': rotation_hours,
-                    'employee_confirmed': True,  # ✅ تأكيد تلقائي
-                    'employee_confirmed_at': current_rotation_start,
-                    'supervisor_confirmed': True,  # ✅ تأكيد تلقائي
-                    'supervisor_confirmed_at': current_rotation_start,
-                    'confirmed': True  # ✅ تأكيد نهائي
-                }
+                rotation_at=plan.rotation_start,
+                employee_id=employee_id,
+                is_standby=True,
             )
-            
-            if not created:
-                print(f"  ℹ️ {emp.name} → {sonar.name} (موجود مسبقاً)")
-                # تحديث التأكيد للتبديلات الموجودة مسبقاً
-                if not assignment.confirmed:
-                    assignment.employee_confirmed = True
-                    assignment.employee_confirmed_at = current_rotation_start
-                    assignment.supervisor_confirmed = True
-                    assignment.supervisor_confirmed_at = current_rotation_start
-                    assignment.confirmed = True
-                    assignment.save()
-            
-            # 📊 تحديث إحصائيات الموظف (فقط إذا لم يكن إشعار مبكر)
-            if not is_early_notification:
-                # التحقق من عدم احتساب الساعات مسبقاً باستخدام notification_sent كعلامة
-                # notification_sent = True يعني أن الساعات تم احتسابها مسبقاً
-                if not assignment.notification_sent:
-                    emp.total_work_hours += rotation_hours
-                    emp.last_work_datetime = current_rotation_start
-                    emp.consecutive_rest_count = 0  # إعادة تعيين عداد الراحة
-                    emp.save()
-                    # وضع علامة أن الساعات تم احتسابها
-                    assignment.notification_sent = True
-                    assignment.save(update_fields=['notification_sent'])
-                    print(f"  📊 تم تحديث ساعات {emp.name}: {emp.total_work_hours:.1f} ساعة (+{rotation_hours})")
-                else:
-                    print(f"  ℹ️ {emp.name}: الساعات محسوبة مسبقاً ({emp.total_work_hours:.1f} ساعة)")
-            
-            sonar_assignment_count[sonar.id] += 1
-            work_assignments.append((emp, sonar))
-            employee_index += 1
-            
-            print(f"  ✅ {emp.name} → {sonar.name} ({sonar_assignment_count[sonar.id]}/{sonar.max_employees})")
-    
-    # 🎯 المرحلة الثانية: تسجيل الموظفين في الاحتياط
-    if standby_employees:
-        print(f"\n📍 المرحلة 2: تسجيل {len(standby_employees)} موظف في حالة احتياط...")
-        
-        for emp in standby_employees:
-            # 🧾 حفظ التعيين كاحتياط (بدون سونار) (أو استخدام الموجود)
-            # ✅ التأكيد التلقائي للاحتياط أيضاً
-            assignment, created = EmployeeAssignment.objects.get_or_create(
-                employee=emp,
-                sonar=None,  # لا يوجد سونار للاحتياط
+            for employee_id in plan.standby
+        )
+
+    with transaction.atomic():
+        planned.filter(activated=False, rotation_at__in=pending_starts).delete()
+        PlannedAssignment.objects.bulk_create(rows)
+
+    print(
+        f"📋 تم تخطيط {len(plans)} فترة للشفت {shift.name} "
+        f"({shift_start.strftime('%H:%M')} → {shift_end.strftime('%H:%M')}) - {len(rows)} خانة"
+    )
+    return len(plans)
+
+
+def plan_whole_shift_all_sites(shift_name, shift_start=None, replan=False):
+    """تخطيط الشفت لكل موقع على حدة (أو للجميع معاً عند وجود موقع واحد)"""
+    sites = rotation_sites()
+    return sum(
+        plan_whole_shift(shift_name, shift_start=shift_start, replan=replan, site=site)
+        for site in (sites if len(sites) > 1 else [None])
+    )
+
+
+def auto_confirmation_fields(rotation_start):
+    """حقول التأكيد التلقائي لتبديلات النظام"""
+    return {
+        'employee_confirmed': True,  # ✅ تأكيد تلقائي
+        'employee_confirmed_at': rotation_start,
+        'supervisor_confirmed': True,  # ✅ تأكيد تلقائي
+        'supervisor_confirmed_at': rotation_start,
+        'confirmed': True,  # ✅ تأكيد نهائي
+    }
+
+
+def commit_rotation_plan(plan, shift, employees_by_id, sonars_by_id, count_hours, site=''):
+    """تطبيق خطة تبديل على قاعدة البيانات بعدد ثابت من الاستعلامات (bulk_create / bulk_update).
+
+    يجب استدعاؤها داخل transaction.atomic.
+    عند احتساب الساعات يُحجز مفتاح RotationCommit أولاً؛ إذا كان التبديل قد نُفذ
+    مسبقاً (عامل آخر أو إعادة محاولة) تُعاد السجلات المحفوظة بدون إنشاء أو احتساب.
+
+    Args:
+        plan: RotationPlan المراد تطبيقها
+        shift: الشفت
+        employees_by_id: قاموس الموظفين المحملين (تُحدّث ساعاتهم في الذاكرة أيضاً)
+        sonars_by_id: قاموس السونارات النشطة
+        count_hours: احتساب الساعات وعداد الراحة (False في الإشعار المبكر)
+        site: موقع مجموعة السونارات (جزء من مفتاح منع التكرار)
+
+    Returns:
+        (work_rows, standby_rows): سجلات EmployeeAssignment بنفس ترتيب الخطة
+    """
+    rotation_start = plan.rotation_start
+    hour_deltas = dict(plan.hour_deltas)
+
+    confirmation_defaults = auto_confirmation_fields(rotation_start)
+
+    def load_existing():
+        rows = EmployeeAssignment.objects.filter(
+            shift=shift,
+            assigned_at=rotation_start,
+            employee_id__in=employees_by_id.keys()
+        ).order_by('id')
+        existing = {}
+        for row in rows:
+            existing.setdefault((row.employee_id, row.sonar_id), row)
+        return existing
+
+    wanted = list(plan.work_slots) + [(employee_id, None) for employee_id in plan.standby]
+
+    already_committed = False
+    if count_hours:
+        # 🔑 مفتاح منع التكرار: عامل ثانٍ ينتظر هنا حتى تنتهي معاملة الأول ثم يفشل القيد الفريد
+        try:
+            with transaction.atomic():
+                RotationCommit.objects.create(
+                    key=RotationCommit.make_key(shift, rotation_start, site),
+                    shift=shift,
+                    site=site or '',
+                    rotation_at=rotation_start,
+                )
+        except IntegrityError:
+            already_committed = True
+            print(f"  🔑 التبديل ({shift.name} {rotation_start}) نُفذ مسبقاً - استخدام السجلات المحفوظة")
+
+    existing = load_existing()
+    if already_committed:
+        # الخطة المحسوبة قد تختلف عن المنفذة فعلاً، لذا المرجع هو السجلات المحفوظة
+        wanted = [key for key in existing if key[1] in sonars_by_id] + [key for key in existing if key[1] is None]
+        count_hours = False
+    missing = [key for key in wanted if key not in existing]
+    if missing:
+        EmployeeAssignment.objects.bulk_create([
+            EmployeeAssignment(
+                employee_id=employee_id,
+                sonar_id=sonar_id,
                 shift=shift,
-                assigned_at=current_rotation_start,
-                defaults={
-                    'rotation_number': 0,
-                    'is_standby': True,
-                    'work_duration_hours': 0.0,
-                    'employee_confirmed': True,  # ✅ تأكيد تلقائي
-                    'employee_confirmed_at': current_rotation_start,
-                    'supervisor_confirmed': True,  # ✅ تأكيد تلقائي
-                    'supervisor_confirmed_at': current_rotation_start,
-                    'confirmed': True  # ✅ تأكيد نهائي
-                }
+                assigned_at=rotation_start,
+                rotation_number=0,
+                is_standby=sonar_id is None,
+                work_duration_hours=hour_deltas.get(employee_id, 0.0) if sonar_id is not None else 0.0,
+                **confirmation_defaults
             )
-            
-            if not created:
-                print(f"  ℹ️ {emp.name} - في حالة احتياط (موجود مسبقاً)")
-                # تحديث التأكيد للتبديلات الموجودة مسبقاً
-                if not assignment.confirmed:
-                    assignment.employee_confirmed = True
-                    assignment.employee_confirmed_at = current_rotation_start
-                    assignment.supervisor_confirmed = True
-                    assignment.supervisor_confirmed_at = current_rotation_start
-                    assignment.confirmed = True
-                    assignment.save()
-            
-            # تحديث عداد الراحة المتتالية (فقط إذا لم يكن إشعار مبكر)
-            if not is_early_notification:
-                emp.consecutive_rest_count += 1
-                emp.save()
-            
-            standby_assignments.append(emp)
-            print(f"  💤 {emp.name} - في حالة احتياط (راحة)")
-    
-    # 📨 إرسال إشعارات تليغرام للموظفين العاملين
-    print("\n📤 إرسال الإشعارات...")
-    now_actual = timezone.localtime(timezone.now())
-    # حساب الوقت المتبقي حتى بداية الفترة الرسمية (للإشعار)
-    time_until_start = (official_rotation_start - now_actual).total_seconds() / 60
-    
-    for emp, sonar in work_assignments:
-        # البحث عن assignment لهذا الموظف
-        assignment = EmployeeAssignment.objects.filter(
-            employee=emp,
-            sonar=sonar,
-            assigned_at=current_rotation_start,
-            shift=shift
-        ).first()
-        
+            for employee_id, sonar_id in missing
+        ], ignore_conflicts=True)
+        # القيد الفريد يتجاهل سجلات كتبها عامل متزامن، والمرجع بعدها ما في قاعدة البيانات
+        existing = load_existing()
+
+    # تحديث التأكيد للتبديلات الموجودة مسبقاً
+    to_confirm = [existing[key] for key in wanted if not existing[key].confirmed]
+    for assignment in to_confirm:
+        for field, value in confirmation_defaults.items():
+            setattr(assignment, field, value)
+    if to_confirm:
+        EmployeeAssignment.objects.bulk_update(to_confirm, list(confirmation_defaults))
+
+    work_rows = []
+    standby_rows = []
+    for employee_id, sonar_id in wanted:
+        assignment = existing[(employee_id, sonar_id)]
+        # ربط الكائنات المحملة مسبقاً لتجنب استعلامات إضافية عند بناء الرسائل
+        assignment.employee = employees_by_id[employee_id]
+        if sonar_id is None:
+            standby_rows.append(assignment)
+        else:
+            assignment.sonar = sonars_by_id[sonar_id]
+            work_rows.append(assignment)
+
+    if not count_hours:
+        return work_rows, standby_rows
+
+    # 📊 تحديث إحصائيات الموظفين
+    # notification_sent = True يعني أن الساعات (أو الراحة) تم احتسابها مسبقاً
+    changed_employees = []
+    counted_assignments = []
+    added_hours = 0.0
+    for assignment in work_rows:
+        if assignment.notification_sent:
+            continue
+        emp = assignment.employee
+        work_hours = hour_deltas.get(emp.id, plan.rotation_hours)
+        emp.total_work_hours += work_hours
+        added_hours += work_hours
+        emp.last_work_datetime = rotation_start
+        emp.consecutive_rest_count = 0  # إعادة تعيين عداد الراحة
+        assignment.notification_sent = True
+        changed_employees.append(emp)
+        counted_assignments.append(assignment)
+    for assignment in standby_rows:
+        if assignment.notification_sent:
+            continue
+        emp = assignment.employee
+        emp.consecutive_rest_count += 1
+        assignment.notification_sent = True
+        changed_employees.append(emp)
+        counted_assignments.append(assignment)
+
+    if changed_employees:
+        # bulk_update يتجاوز Employee.save (لا حاجة لمعادلة الساعات هنا)
+        Employee.objects.bulk_update(
+            changed_employees,
+            ['total_work_hours', 'last_work_datetime', 'consecutive_rest_count']
+        )
+        EmployeeAssignment.objects.bulk_update(counted_assignments, ['notification_sent'])
+        # bulk_update لا يمر عبر Employee.save، لذا نحدّث المجموع المتراكم هنا
+        WorkHoursAggregate.apply_delta(added_hours)
+    print(f"  📊 تم تحديث إحصائيات {len(changed_employees)} موظف دفعة واحدة")
+
+    return work_rows, standby_rows
+
+
+def queue_rotation_notifications(shift, work_rows, standby_rows, official_window_label, time_until_start,
+                                 is_early_notification, notification_stage, minutes_before):
+    """كتابة رسائل تبديل تم حفظه (العاملين ثم الاحتياط) في صندوق الصادر
+
+    يجب استدعاؤها داخل معاملة الحفظ. المستدعي يسجل الإشعار في notification_flags.
+    """
+    outgoing = []
+    for assignment in work_rows:
+        emp, sonar = assignment.employee, assignment.sonar
+
         official_msg = (
             f"🕒 الفترة الرسمية: {official_window_label}\n"
             f"📡 السونار: {sonar.name} (رقم: {sonar.id})\n"
         )
 
-        if is_early_notification and time_until_start > 0:
+        if is_early_notification:
             # إشعار مبكر قبل وقت التبديل
-            current_work_hours = emp.total_work_hours
             msg = (
                 f"📢 تم تجهيز تبديلك القادم!\n\n"
                 f"{official_msg}"
                 f"✅ تم إعلامك مبكراً لتعرف وجهتك قبل {int(time_until_start)} دقيقة.\n\n"
-                f"📊 إجمالي ساعات عملك: {current_work_hours:.1f} ساعة"
+                f"📊 إجمالي ساعات عملك: {emp.total_work_hours:.1f} ساعة"
             )
-            send_telegram_message(emp.telegram_id, msg)
-            
-            # حفظ سجل الإشعار المبكر
-            if assignment:
-                EarlyNotification.objects.get_or_create(
-                    assignment=assignment,
-                    notification_type='employee',
-                    notification_stage='initial',
-                    defaults={'minutes_before': int(time_until_start)}
-                )
-        elif not is_early_notification:
+        else:
             # إشعار فوري عند تنفيذ التبديل (يطلب التأكيد ويذكر الوقت الرسمي)
             msg = (
                 f"🔔 تم تثبيت تبديلك الآن!\n\n"
                 f"{official_msg}"
                 "✅ يرجى التوجه للسونار وتأكيد التبديل من النظام."
             )
-            send_telegram_message(emp.telegram_id, msg)
-
-            if assignment:
-                EarlyNotification.objects.get_or_create(
-                    assignment=assignment,
-                    notification_type='employee',
-                    notification_stage='final',
-                    defaults={'minutes_before': 0}
-                )
-
-    # 📨 إرسال إشعارات للموظفين في الاحتياط
-    for emp in standby_assignments:
-        existing_standby_assignment = EmployeeAssignment.objects.filter(
-            employee=emp,
-            sonar=None,
-            shift=shift,
-            assigned_at=current_rotation_start,
-            is_standby=True
-        ).first()
+        outgoing.append(rotation_message(assignment, msg, notification_stage, minutes_before))
 
-        if not existing_standby_assignment or not emp.telegram_id:
-            continue
+    for assignment in standby_rows:
+        emp = assignment.employee
 
         if is_early_notification:
-            # تجنب إرسال إشعار احتياط مبكر مرتين
-            standby_initial_sent = EarlyNotification.objects.filter(
-                assignment=existing_standby_assignment,
-                notification_type='employee',
-                notification_stage='initial'
-            ).exists()
-
-            if standby_initial_sent:
-                continue
-
             minutes_remaining = max(int(time_until_start), 0)
             msg = (
                 f"💤 تم وضعك في حالة احتياط (راحة) للفترة الرسمية: {official_window_label}\n"
@@ -727,23 +935,7 @@ def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, ne
                 f"🔄 مرات الراحة المتتالية: {emp.consecutive_rest_count}\n\n"
                 f"✨ سيتم إشعارك فور توفر التبديل القادم."
             )
-            send_telegram_message(emp.telegram_id, msg)
-            EarlyNotification.objects.get_or_create(
-                assignment=existing_standby_assignment,
-                notification_type='employee',
-                notification_stage='initial',
-                defaults={'minutes_before': minutes_remaining}
-            )
         else:
-            standby_final_sent = EarlyNotification.objects.filter(
-                assignment=existing_standby_assignment,
-                notification_type='employee',
-                notification_stage='final'
-            ).exists()
-
-            if standby_final_sent:
-                continue
-
             msg = (
                 f"💤 أنت في حالة احتياط (راحة) للفترة الرسمية: {official_window_label}\n"
                 f"🕒 الشفت: {shift.get_name_display()}\n"
@@ -751,42 +943,24 @@ def rotate_within_shift(shift_name, rotation_hours=None, lead_time_minutes=0, ne
                 f"🔄 مرات الراحة المتتالية: {emp.consecutive_rest_count}\n\n"
                 f"✨ سيتم إعطاؤك الأولوية في التبديل القادم!"
             )
-            send_telegram_message(emp.telegram_id, msg)
-            EarlyNotification.objects.get_or_create(
-                assignment=existing_standby_assignment,
-                notification_type='employee',
-                notification_stage='final',
-                defaults={'minutes_before': 0}
-            )
-    
-    # ✅ تأكيد اكتمال العملية بنجاح
-    print(f"\n✅ تم توزيع {len(work_assignments)} موظف للعمل في الشفت {shift.name}")
-    print(f"💤 تم تسجيل {len(standby_assignments)} موظف في حالة احتياط")
-    print(f"⏰ الفترة الرسمية: {official_window_label}")
-    
-    # 🕐 تحديث وقت آخر تبديل في الإعدادات (فقط إذا لم يكن إشعار مبكر)
-    # ملاحظة: last_rotation_time يُحدث في tasks.py بناءً على الوقت الرسمي
-    # هنا لا نحدثه لأن tasks.py سيتولى ذلك
-    if not is_early_notification:
-        print(f"🕐 التبديل الرسمي: {official_rotation_start.strftime('%Y-%m-%d %H:%M')}")
-    else:
-        print(f"📢 تم إرسال الإشعار المبكر فقط (الوقت الرسمي: {official_rotation_start.strftime('%H:%M')})")
-    
-    # 📊 عرض ملخص التوزيع المفصل
-    print("\n📊 ملخص التوزيع:")
-    print("="*60)
-    for sonar in active_sonars:
-        count = sonar_assignment_count[sonar.id]
-        print(f"  🏢 {sonar.name}: {count}/{sonar.max_employees} موظف")
-    
-    print(f"\n  💼 إجمالي العاملين: {len(work_assignments)}")
-    print(f"  💤 إجمالي الاحتياط: {len(standby_assignments)}")
-    print(f"  👥 إجمالي الموظفين: {len(employees)}")
-    print("="*60)
+        outgoing.append(rotation_message(assignment, msg, notification_stage, minutes_before))
+
+    return enqueue(outgoing)
+
+
+def rotation_message(assignment, text, notification_stage, minutes_before):
+    return outbox_message(
+        assignment.employee.telegram_id, text, category='rotation', assignment=assignment,
+        notification_type='employee', notification_stage=notification_stage, minutes_before=minutes_before,
+        dedupe_key=notification_dedupe_key(assignment, 'employee', notification_stage, assignment.employee.telegram_id),
+    )
 
 
 def cancel_expired_confirmations():
-    """إشعار المشرف بالتبديلات التي لم يؤكدها الموظف (بدون رفض تلقائي)"""
+    """إشعار المشرف بالتبديلات التي لم يؤكدها الموظف (بدون رفض تلقائي)
+
+    كل تشغيل يرسل لكل مشرف رسالة ملخصة واحدة (أو عدة صفحات) بالتبديلات الجديدة فقط.
+    """
     from datetime import timedelta
 
     now = timezone.localtime(timezone.now())
@@ -805,67 +979,57 @@ def cancel_expired_confirmations():
         confirmed=False  # لم يتم تأكيدها نهائياً
     ).select_related('employee', 'sonar', 'shift')
 
-    notified_count = 0
-
-    for assignment in unconfirmed_assignments:
-        # حساب كم ساعة/دقيقة مرت منذ وقت التبديل
-        time_passed = now - assignment.assigned_at
-        hours_passed = time_passed.total_seconds() / 3600
+    # التبديلات التي سُجل لها التحذير مسبقاً (بت في notification_flags) مستبعدة من الاستعلام
+    unconfirmed_assignments = EmployeeAssignment.notification_filter(
+        unconfirmed_assignments, 'unconfirmed_warning', 'admin', notified=False
+    )
 
-        # التحقق من عدم إرسال نفس الإشعار مسبقاً (تجنب التكرار)
-        # نستخدم EarlyNotification لتتبع الإشعارات المرسلة
-        notification_exists = EarlyNotification.objects.filter(
-            assignment=assignment,
-            notification_type='admin',
-            notification_stage='unconfirmed_warning'  # مرحلة جديدة للتحذير
-        ).exists()
+    warned = list(unconfirmed_assignments.order_by('assigned_at'))
+    notified_count = len(warned)
+
+    # 📋 رسالة ملخصة واحدة لكل مشرف (مقسمة حسب حد طول رسالة تليغرام) بدلاً من رسالة
+    # لكل مشرف × تبديل. المشرف المسؤول عن شفت يرى تبديلات شفته فقط.
+    supervisors = Supervisor.objects.filter(
+        models.Q(is_active=True) | models.Q(user__is_superuser=True)
+    ).exclude(phone__isnull=True).exclude(phone='')
+
+    lines = {}
+    for assignment in warned:
+        hours_passed = (now - assignment.assigned_at).total_seconds() / 3600
+        sonar_name = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
+        print(f"⚠️ تبديل غير مؤكد: {assignment.employee.name} → {sonar_name} (مر عليه {hours_passed:.1f} ساعة)")
+        lines[assignment.id] = (
+            f"👤 {assignment.employee.name} → 📡 {sonar_name}\n"
+            f"   🕐 {assignment.shift.get_name_display()} | ⏰ {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}"
+            f" | ⏳ مر عليه {int(hours_passed)} ساعة"
+        )
 
-        if notification_exists:
-            # تم إرسال الإشعار مسبقاً، تخطي
+    outgoing = []
+    for supervisor in supervisors if warned else []:
+        scoped = [
+            assignment for assignment in warned
+            if supervisor.assigned_shift_id in (None, assignment.shift_id)
+        ]
+        if not scoped:
             continue
-
-        sonar_name = assignment.sonar.name if assignment.sonar else "بدون سونار (احتياط)"
-        print(
-            f"⚠️ تبديل غير مؤكد: {assignment.employee.name} → {sonar_name} (مر عليه {hours_passed:.1f} ساعة)")
-
-        # إرسال إشعار للمشرفين فقط (بدون رفض تلقائي)
-        supervisors = User.objects.filter(
-            models.Q(is_superuser=True) | models.Q(supervisor_profile__is_active=True)
-        ).distinct()
-
-        for supervisor in supervisors:
-            if hasattr(supervisor, 'supervisor_profile') and supervisor.supervisor_profile.phone:
-                supervisor_sonar_name = f"{assignment.sonar.name} (رقم: {assignment.sonar.id})" if assignment.sonar else "بدون سونار (احتياط)"
-                supervisor_message = f"""
-⚠️ تحذير: موظف لم يؤكد التبديل
-
-👤 الموظف: {assignment.employee.name}
-📡 السونار: {supervisor_sonar_name}
-🕐 الشفت: {assignment.shift.get_name_display()}
-⏰ وقت التبديل: {assignment.assigned_at.strftime('%Y-%m-%d %H:%M')}
-⏳ مر عليه: {int(hours_passed)} ساعة
-❓ الحالة: لم يؤكد الموظف
-
-📋 يرجى المتابعة مع الموظف واتخاذ القرار المناسب:
-- تأكيد التبديل يدوياً
-- أو رفض التبديل يدوياً
-
-⚠️ لن يتم الرفض تلقائياً - القرار بيدك.
-                """
-                send_telegram_message(supervisor.supervisor_profile.phone, supervisor_message)
-
-        # حفظ سجل الإشعار لتجنب التكرار
-        EarlyNotification.objects.create(
-            assignment=assignment,
-            notification_type='admin',
-            notification_stage='unconfirmed_warning',
-            minutes_before=0  # إشعار بعد انتهاء المدة
+        outgoing.extend(
+            (supervisor.phone, page)
+            for page in paginate(
+                [lines[assignment.id] for assignment in scoped],
+                header=f"⚠️ تحذير: {len(scoped)} تبديل لم يؤكده الموظف",
+                footer=(
+                    "📋 يرجى المتابعة مع الموظفين وتأكيد التبديلات أو رفضها يدوياً.\n"
+                    "⚠️ لن يتم الرفض تلقائياً - القرار بيدك."
+                ),
+            )
         )
 
-        notified_count += 1
+    with transaction.atomic():
+        enqueue_texts(outgoing, category='supervisor')
+        EmployeeAssignment.mark_notified(warned, 'unconfirmed_warning', 'admin')
 
     if notified_count > 0:
-        print(f"📢 تم إرسال {notified_count} إشعار للمشرفين عن تبديلات غير مؤكدة")
+        print(f"📢 تم إرسال {len(outgoing)} رسالة ملخصة للمشرفين عن {notified_count} تبديل غير مؤكد")
     else:
         print("✓ جميع التبديلات إما مؤكدة أو تم الإشعار عنها مسبقاً")
 
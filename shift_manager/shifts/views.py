@@ -1,13 +1,21 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
-from .models import EmployeeAssignment, Employee, Sonar, Shift, WeeklyShiftAssignment, Supervisor, AssignmentConfirmation, SystemSettings, Manager, CustomNotification
+from .models import EmployeeAssignment, Employee, Sonar, Shift, WeeklyShiftAssignment, Supervisor, AssignmentConfirmation, SystemSettings, Manager, CustomNotification, PlannedAssignment, WorkHoursAggregate, RotationRun
 from .forms import EmployeeAssignmentForm, LoginForm, EmployeeForm, SonarForm, ShiftForm, WeeklyShiftAssignmentForm, SystemSettingsForm, ManagerCreateForm, SupervisorCreateForm, EmployeeAccountCreateForm, CustomNotificationForm
-from .utils import send_telegram_message
+from .utils import plan_whole_shift_all_sites
+from .outbox import enqueue_texts
+from .broadcast import broadcast_recipients, schedule_broadcast
+from .scoring import priority_scores
+from .scheduler import schedule_next_rotation
+from .timeline import rebuild_rotation_timeline, upcoming_rotations
+from .shift_calendar import get_shift_calendar
 from .decorators import get_user_role, superadmin_required, manager_required, supervisor_required, employee_required, staff_required
 
 # صفحة الهبوط (Landing Page)
@@ -189,13 +197,13 @@ def supervisor_dashboard(request):
     
     # 📊 إحصائيات الموظفين وساعات العمل
     employees_stats = []
-    all_employees = Employee.objects.filter(is_on_leave=False).order_by('name')
+    all_employees = list(Employee.objects.filter(is_on_leave=False).order_by('name'))
     
-    # حساب متوسط ساعات العمل
-    total_work_hours = sum(emp.total_work_hours for emp in all_employees)
-    avg_work_hours = total_work_hours / all_employees.count() if all_employees.count() > 0 else 0.0
+    # متوسط ساعات العمل (من المجموع المتراكم) ونقاط الأولوية لجميع الموظفين دفعة واحدة
+    avg_work_hours = WorkHoursAggregate.get_average()
+    scores = priority_scores(all_employees, avg_work_hours=avg_work_hours)
     
-    for emp in all_employees:
+    for emp, score in zip(all_employees, scores):
         diff_from_avg = emp.total_work_hours - avg_work_hours
         employees_stats.append({
             'employee': emp,
@@ -203,7 +211,7 @@ def supervisor_dashboard(request):
             'diff_from_avg': diff_from_avg,
             'last_work': emp.last_work_datetime,
             'consecutive_rest': emp.consecutive_rest_count,
-            'priority_score': emp.get_priority_score(avg_work_hours)
+            'priority_score': float(score)
         })
     
     # ترتيب حسب ساعات العمل (من الأكثر إلى الأقل)
@@ -243,6 +251,16 @@ def supervisor_dashboard(request):
         employee_confirmed=False
     ).select_related('employee', 'sonar', 'shift').order_by('-assigned_at')[:10]
     
+    # 📋 خطة التبديل المسبقة (الفترة الحالية وحتى 24 ساعة قادمة)
+    rotation_hours = SystemSettings.get_current_settings().get_effective_rotation_hours()
+    shift_plan = PlannedAssignment.objects.filter(
+        rotation_at__gt=now - timedelta(hours=rotation_hours),
+        rotation_at__lt=now + timedelta(hours=24)
+    ).select_related('employee', 'sonar', 'shift').order_by('rotation_at', 'is_standby', 'sonar__name')
+    
+    # 🗓️ المواعيد القادمة من الجدول الزمني المحسوب مسبقاً
+    upcoming_timeline = upcoming_rotations(now)
+    
     context = {
         'user_role': 'supervisor',
         'pending_assignments': pending_assignments,
@@ -264,10 +282,33 @@ def supervisor_dashboard(request):
         # 🔍 فلتر الوقت
         'time_filter': time_filter,
         'filter_label': filter_label,
+        # 📋 خطة الشفت الكاملة
+        'shift_plan': shift_plan,
+        'upcoming_timeline': upcoming_timeline,
     }
     return render(request, 'dashboards/supervisor.html', context)
 
 
+@supervisor_required
+def generate_shift_plan(request):
+    """تخطيط جميع فترات الشفت الحالي عند الطلب"""
+    if request.method != 'POST':
+        return redirect('supervisor_dashboard')
+    
+    current_shift = get_shift_calendar().shift_at(timezone.now())
+    
+    if not current_shift:
+        messages.error(request, 'لا يوجد شفت نشط حالياً')
+        return redirect('supervisor_dashboard')
+    
+    planned_count = plan_whole_shift_all_sites(current_shift.name, replan=True)
+    if planned_count:
+        messages.success(request, f'تم تخطيط {planned_count} فترة للشفت {current_shift.get_name_display()}')
+    else:
+        messages.warning(request, 'لا توجد فترات متبقية للتخطيط في الشفت الحالي')
+    return redirect('supervisor_dashboard')
+
+
 @employee_required
 def employee_dashboard(request):
     """لوحة تحكم الموظف"""
@@ -548,6 +589,7 @@ def shift_create(request):
         form = ShiftForm(request.POST)
         if form.is_valid():
             shift = form.save()
+            rebuild_rotation_timeline()
             messages.success(request, f'✅ تم إضافة الشفت بنجاح!')
             return redirect('shift_list')
     else:
@@ -562,6 +604,7 @@ def shift_update(request, pk):
         form = ShiftForm(request.POST, instance=shift)
         if form.is_valid():
             form.save()
+            rebuild_rotation_timeline()
             messages.success(request, f'✅ تم تحديث الشفت بنجاح!')
             return redirect('shift_list')
     else:
@@ -574,6 +617,7 @@ def shift_delete(request, pk):
     shift = get_object_or_404(Shift, pk=pk)
     if request.method == 'POST':
         shift.delete()
+        rebuild_rotation_timeline()
         messages.success(request, f'✅ تم حذف الشفت بنجاح!')
         return redirect('shift_list')
     return render(request, 'shifts/delete.html', {'shift': shift})
@@ -669,37 +713,38 @@ def confirm_assignment(request, pk):
     if request.method == 'POST':
         notes = request.POST.get('notes', '')
         
-        # تحديث حالة التبديل
-        assignment.confirmed = True
-        assignment.save()
-        
-        # إنشاء سجل تأكيد
-        confirmation = AssignmentConfirmation.objects.create(
-            assignment=assignment,
-            status='confirmed',
-            confirmed_by=request.user,
-            notes=notes
-        )
-        
-        # إرسال إشعار Telegram للموظف
-        if assignment.employee.telegram_id:
-            shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
-                assignment.shift.name, 
-                assignment.shift.name
-            )
+        with transaction.atomic():
+            # تحديث حالة التبديل
+            assignment.confirmed = True
+            assignment.save()
             
-            msg = (
-                f"✅ تم تأكيد تبديلك!\n\n"
-                f"📢 السونار الجديد: {assignment.sonar.name}\n"
-                f"🕒 الشفت: {shift_name_ar}\n"
-                f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}\n"
-                f"👤 تم التأكيد بواسطة: {request.user.username}"
+            # إنشاء سجل تأكيد
+            confirmation = AssignmentConfirmation.objects.create(
+                assignment=assignment,
+                status='confirmed',
+                confirmed_by=request.user,
+                notes=notes
             )
             
-            if notes:
-                msg += f"\n📝 ملاحظات: {notes}"
+            # إشعار Telegram للموظف عبر صندوق الصادر في نفس المعاملة (يُرسل من عامل notifications)
+            if assignment.employee.telegram_id:
+                shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
+                    assignment.shift.name, 
+                    assignment.shift.name
+                )
             
-            send_telegram_message(assignment.employee.telegram_id, msg)
+                msg = (
+                    f"✅ تم تأكيد تبديلك!\n\n"
+                    f"📢 السونار الجديد: {assignment.sonar.name}\n"
+                    f"🕒 الشفت: {shift_name_ar}\n"
+                    f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}\n"
+                    f"👤 تم التأكيد بواسطة: {request.user.username}"
+                )
+            
+                if notes:
+                    msg += f"\n📝 ملاحظات: {notes}"
+            
+                enqueue_texts([(assignment.employee.telegram_id, msg)], category='confirmation')
         
         messages.success(
             request, 
@@ -724,33 +769,34 @@ def reject_assignment(request, pk):
         employee_name = assignment.employee.name
         sonar_name = assignment.sonar.name
         
-        # إنشاء سجل رفض قبل الحذف
-        AssignmentConfirmation.objects.create(
-            assignment=assignment,
-            status='rejected',
-            confirmed_by=request.user,
-            notes=notes
-        )
-        
-        # إرسال إشعار Telegram للموظف
-        if assignment.employee.telegram_id:
-            shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
-                assignment.shift.name, 
-                assignment.shift.name
-            )
-            
-            msg = (
-                f"❌ تم رفض تبديلك\n\n"
-                f"📢 السونار: {sonar_name}\n"
-                f"🕒 الشفت: {shift_name_ar}\n"
-                f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}\n"
-                f"👤 تم الرفض بواسطة: {request.user.username}"
+        with transaction.atomic():
+            # إنشاء سجل رفض قبل الحذف
+            AssignmentConfirmation.objects.create(
+                assignment=assignment,
+                status='rejected',
+                confirmed_by=request.user,
+                notes=notes
             )
             
-            if notes:
-                msg += f"\n📝 سبب الرفض: {notes}"
-            
-            send_telegram_message(assignment.employee.telegram_id, msg)
+            # إشعار Telegram للموظف عبر صندوق الصادر في نفس المعاملة (يُرسل من عامل notifications)
+            if assignment.employee.telegram_id:
+                shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
+                    assignment.shift.name, 
+                    assignment.shift.name
+                )
+                
+                msg = (
+                    f"❌ تم رفض تبديلك\n\n"
+                    f"📢 السونار: {sonar_name}\n"
+                    f"🕒 الشفت: {shift_name_ar}\n"
+                    f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}\n"
+                    f"👤 تم الرفض بواسطة: {request.user.username}"
+                )
+                
+                if notes:
+                    msg += f"\n📝 سبب الرفض: {notes}"
+                
+                enqueue_texts([(assignment.employee.telegram_id, msg)], category='confirmation')
         
         messages.warning(
             request, 
@@ -796,40 +842,44 @@ def bulk_confirm_assignments(request):
             confirmed=False
         ).exclude(
             confirmation__isnull=False
-        )
-        count = 0
+        ).select_related('employee', 'sonar', 'shift')
+        with transaction.atomic():
+            count = 0
+            outgoing = []
         
-        for assignment in pending:
-            # تحديث حالة التبديل
-            assignment.confirmed = True
-            assignment.save()
+            for assignment in pending:
+                # تحديث حالة التبديل
+                assignment.confirmed = True
+                assignment.save()
             
-            # إنشاء سجل تأكيد
-            AssignmentConfirmation.objects.create(
-                assignment=assignment,
-                status='confirmed',
-                confirmed_by=request.user,
-                notes='تأكيد جماعي'
-            )
-            
-            # إرسال إشعار Telegram
-            if assignment.employee.telegram_id:
-                shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
-                    assignment.shift.name, 
-                    assignment.shift.name
+                # إنشاء سجل تأكيد
+                AssignmentConfirmation.objects.create(
+                    assignment=assignment,
+                    status='confirmed',
+                    confirmed_by=request.user,
+                    notes='تأكيد جماعي'
                 )
-                sonar_name = assignment.sonar.name if assignment.sonar else "بدون سونار (احتياط)"
+            
+                # إشعار Telegram (يُكتب في صندوق الصادر مع التأكيدات في نفس المعاملة)
+                if assignment.employee.telegram_id:
+                    shift_name_ar = dict(assignment.shift.SHIFT_CHOICES).get(
+                        assignment.shift.name, 
+                        assignment.shift.name
+                    )
+                    sonar_name = assignment.sonar.name if assignment.sonar else "بدون سونار (احتياط)"
                 
-                msg = (
-                    f"✅ تم تأكيد تبديلك!\n\n"
-                    f"📡 السونار: {sonar_name}\n"
-                    f"🕒 الشفت: {shift_name_ar}\n"
-                    f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}"
-                )
+                    msg = (
+                        f"✅ تم تأكيد تبديلك!\n\n"
+                        f"📡 السونار: {sonar_name}\n"
+                        f"🕒 الشفت: {shift_name_ar}\n"
+                        f"⏰ الوقت: {timezone.localtime(assignment.assigned_at).strftime('%Y-%m-%d %H:%M')}"
+                    )
                 
-                send_telegram_message(assignment.employee.telegram_id, msg)
+                    outgoing.append((assignment.employee.telegram_id, msg))
             
-            count += 1
+                count += 1
+
+            enqueue_texts(outgoing, category='confirmation')
         
         messages.success(request, f'✅ تم تأكيد {count} تبديل بنجاح!')
         return redirect('pending_assignments_list')
@@ -966,9 +1016,8 @@ def reports_view(request):
     all_employees = Employee.objects.filter(is_on_leave=False).order_by('name')
     employees_work_hours = []
     
-    # حساب متوسط ساعات العمل
-    total_hours = sum(emp.total_work_hours for emp in all_employees)
-    avg_hours = total_hours / all_employees.count() if all_employees.count() > 0 else 0.0
+    # متوسط ساعات العمل (من المجموع المتراكم)
+    avg_hours = WorkHoursAggregate.get_average()
     
     for emp in all_employees:
         diff = emp.total_work_hours - avg_hours
@@ -1016,7 +1065,6 @@ def reports_view(request):
 @login_required
 def employee_performance_report(request):
     """تقرير أداء الموظفين المفصل مع إمكانية التصدير إلى Excel"""
-    from django.utils import timezone
     from datetime import datetime, timedelta
     from django.db.models import Count, Q, Sum
     
@@ -1028,9 +1076,11 @@ def employee_performance_report(request):
     # جلب جميع الموظفين
     all_employees = Employee.objects.all().order_by('name')
     
-    # حساب متوسط ساعات العمل
-    total_hours = sum(emp.total_work_hours for emp in all_employees)
-    avg_hours = total_hours / all_employees.count() if all_employees.count() > 0 else 0.0
+    # مجموع ومتوسط ساعات العمل لجميع الموظفين (مع من في إجازة، بخلاف WorkHoursAggregate
+    # الذي يخدم التبديل والأولوية فقط)
+    hours_totals = all_employees.aggregate(total=Sum('total_work_hours'), count=Count('id'))
+    total_hours = hours_totals['total'] or 0.0
+    avg_hours = total_hours / hours_totals['count'] if hours_totals['count'] else 0.0
     
     # بناء تقرير مفصل لكل موظف
     employees_data = []
@@ -1270,7 +1320,6 @@ def settings_view(request):
             # إذا تم تغيير فترة التبديل وكان هناك تدوير قادم لم يحدث بعد،
             # نضبط last_rotation_time بحيث يبقى موعد التبديل القادم كما هو
             if rotation_changed and old_next_rotation:
-                from django.utils import timezone
                 from datetime import timedelta
 
                 now_local = timezone.localtime(timezone.now())
@@ -1285,8 +1334,10 @@ def settings_view(request):
                         f"مع فترة جديدة قدرها {new_interval} ساعة"
                     )
             
-            # تحديث جدولة Celery
+            # تحديث جدولة Celery وإعادة بناء الجدول الزمني ثم إعادة جدولة مهمة التبديل القادمة
             update_celery_schedule()
+            rebuild_rotation_timeline()
+            schedule_next_rotation(replan=True)
             
             messages.success(request, 'تم حفظ الإعدادات بنجاح!')
             return redirect('settings')
@@ -1296,12 +1347,23 @@ def settings_view(request):
     # حساب المعلومات الإضافية
     effective_hours = settings.get_effective_rotation_hours()
     next_rotation = settings.get_next_rotation_time()
+
+    # ⏱️ آخر عمليات التبديل وأبطؤها خلال أسبوع (RotationRun)
+    from datetime import timedelta
+    recent_runs = RotationRun.objects.select_related('shift')[:20]
+    slowest_runs = RotationRun.objects.filter(
+        status='success',
+        started_at__gte=timezone.now() - timedelta(days=7)
+    ).order_by('-duration_ms')[:5]
     
     context = {
         'form': form,
         'settings': settings,
         'effective_hours': effective_hours,
         'next_rotation': next_rotation,
+        'recent_runs': recent_runs,
+        'slowest_runs': slowest_runs,
+        'rotation_phases': RotationRun.PHASES,
     }
     
     return render(request, 'settings/index.html', context)
@@ -1319,8 +1381,10 @@ def settings_update(request):
             settings_obj.updated_by = request.user
             settings_obj.save()
             
-            # تحديث جدولة Celery
+            # تحديث جدولة Celery وإعادة بناء الجدول الزمني ثم إعادة جدولة مهمة التبديل القادمة
             update_celery_schedule()
+            rebuild_rotation_timeline()
+            schedule_next_rotation(replan=True)
             
             messages.success(request, 'تم تحديث الإعدادات بنجاح!')
             return redirect('settings')
@@ -1333,62 +1397,23 @@ def settings_update(request):
 
 
 def update_celery_schedule():
-    """تحديث جدولة Celery حسب الإعدادات الحالية"""
-    from celery import current_app
-    from celery.schedules import crontab
-    from datetime import timedelta
+    """تحديث جدولة Celery حسب الإعدادات الحالية
+
+    الجدولة تُحفظ في قاعدة البيانات (shifts/beat.py) وعملية beat تعيد تحميلها
+    خلال ثوانٍ، بدلاً من تعديل current_app.conf في عملية الويب فقط.
+    """
+    from .beat import sync_beat_schedule
     
     settings = SystemSettings.get_current_settings()
+    sync_beat_schedule()
     
     if not settings.is_rotation_active:
-        # فقط الإشعارات المبكرة بدون التبديل (كل 5 دقائق لضمان عدم تفويت الإشعارات)
-        base_schedule = {
-            'check-early-notifications': {
-                'task': 'shifts.tasks.check_early_notifications_task',
-                'schedule': crontab(minute='*/5'),  # كل 5 دقائق لضمان عدم تفويت الإشعارات
-            },
-        }
-        current_app.conf.beat_schedule = base_schedule
-        print("🔕 تم إيقاف جدولة التبديل التلقائي (الإشعارات المبكرة لا تزال نشطة)")
+        print("🔕 تم إيقاف جدولة التبديل التلقائي والإشعارات المبكرة")
         return
     
-    # حساب الفترة بالساعات والدقائق
     rotation_hours = float(settings.get_effective_rotation_hours())
-    rotation_minutes = rotation_hours * 60
-    
-    # حساب فترة beat للإشعارات وفق مدة التبديل
-    if rotation_minutes <= 30:
-        notification_interval = 1
-        notification_schedule = crontab()  # كل دقيقة
-    elif rotation_minutes <= 60:
-        notification_interval = 2
-        notification_schedule = crontab(minute='*/2')
-    elif rotation_minutes <= 120:
-        notification_interval = 5
-        notification_schedule = crontab(minute='*/5')
-    elif rotation_minutes <= 240:
-        notification_interval = 10
-        notification_schedule = crontab(minute='*/10')
-    else:
-        notification_interval = 15
-        notification_schedule = crontab(minute='0,15,30,45')
-    
-    # حفظ الجدولة الديناميكية
-    base_schedule = {
-        'check-early-notifications': {
-            'task': 'shifts.tasks.check_early_notifications_task',
-            'schedule': notification_schedule,
-        },
-        'rotate-shifts-dynamic': {
-            'task': 'shifts.tasks.rotate_shifts_task',
-            'schedule': crontab(minute='*'),  # كل دقيقة لضمان دقة المواعيد (التحقق يتم داخل المهمة)
-            'args': ()  # سيستخدم الإعدادات المحفوظة
-        },
-    }
-    
-    current_app.conf.beat_schedule = base_schedule
     print(f"⏰ تم تحديث جدولة التبديل: كل {rotation_hours} ساعة")
-    print(f"📢 تم تحديث جدولة الإشعارات: كل {notification_interval:.0f} دقيقة")
+    print("📢 الإشعارات المبكرة والتذكيرات تُجدول مع مهام التبديل في لحظاتها (ETA)")
 
 
 # ==================== تصدير التقارير (Export Reports) ====================
@@ -2192,47 +2217,20 @@ def send_custom_notification(request):
     if request.method == 'POST':
         form = CustomNotificationForm(request.POST)
         if form.is_valid():
-            notification = form.save(commit=False)
-            notification.sent_by = request.user
-            notification.save()
-            
-            # تحديد الموظفين المستهدفين
-            if notification.send_to_all:
-                employees = Employee.objects.filter(telegram_id__isnull=False).exclude(telegram_id='')
-            else:
-                form.save_m2m()  # حفظ العلاقة many-to-many
-                employees = notification.target_employees.filter(telegram_id__isnull=False).exclude(telegram_id='')
-            
-            # إرسال الإشعار لكل موظف
-            sent_count = 0
-            for employee in employees:
-                message = f"""
-📢 {notification.title}
-
-{notification.message}
-
-━━━━━━━━━━━━━━━━━
-📤 من: {notification.sent_by.get_full_name() or notification.sent_by.username}
-📅 {timezone.localtime(notification.sent_at).strftime('%Y-%m-%d %H:%M')}
-                """
-                
-                try:
-                    send_telegram_message(employee.telegram_id, message)
-                    sent_count += 1
-                except Exception as e:
-                    print(f"❌ خطأ في إرسال الإشعار لـ {employee.name}: {e}")
-            
-            # تحديث عدد المرسل إليهم
-            notification.total_sent = sent_count
-            notification.save()
-            
-            if sent_count > 0:
-                messages.success(
-                    request,
-                    f'✅ تم إرسال الإشعار بنجاح لـ {sent_count} موظف'
-                )
+            with transaction.atomic():
+                notification = form.save(commit=False)
+                notification.sent_by = request.user
+                notification.save()
+                if not notification.send_to_all:
+                    form.save_m2m()  # حفظ العلاقة many-to-many
+
+                # الرسائل تُجهز وتُرسل في الخلفية على قائمة notifications (انظر broadcast.py)
+                schedule_broadcast(notification)
+
+            if broadcast_recipients(notification).exists():
+                messages.success(request, '✅ تم جدولة الإشعار للإرسال، تابع التقدم من قائمة الإشعارات')
             else:
-                messages.warning(request, '⚠️ لم يتم إرسال أي إشعار (تحقق من أرقام التليجرام)')
+                messages.warning(request, '⚠️ لا يوجد مستلمون للإشعار (تحقق من أرقام التليجرام)')
             
             return redirect('custom_notifications_list')
     else:
@@ -2255,6 +2253,13 @@ def custom_notification_detail(request, pk):
     return render(request, 'notifications/detail.html', {'notification': notification})
 
 
+@staff_required
+def custom_notification_progress(request, pk):
+    """تقدم إرسال إشعار مخصص (JSON لتحديث صفحتي القائمة والتفاصيل)"""
+    notification = get_object_or_404(CustomNotification, pk=pk)
+    return JsonResponse(notification.progress())
+
+
 @staff_required
 def expired_assignments_list(request):
     """عرض قائمة الطلبات المنتهية غير المؤكدة"""